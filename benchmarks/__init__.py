@@ -0,0 +1 @@
+"""Offline benchmarks of BulkDock's orchestration overhead, run with `python -m benchmarks`"""
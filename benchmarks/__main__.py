@@ -0,0 +1,390 @@
+import mrich
+import typer
+from pathlib import Path
+from typing_extensions import Annotated
+
+HELP = """
+💪 BulkDock benchmarks: time BulkDock's own overhead with stand-in HIPPO and Fragmenstein backends
+"""
+
+app = typer.Typer(help=HELP)
+
+BENCHMARKS = [
+    "split",
+    "split_balanced",
+    "parse",
+    "place",
+    "combine",
+    "collate",
+    "collate_indexed",
+    "to_fragalysis",
+]
+
+TARGET = "bench"
+
+
+@app.command()
+def run(
+    scales: Annotated[
+        str, typer.Option(help="Comma-separated numbers of input rows")
+    ] = "1000,100000,1000000",
+    only: Annotated[
+        str, typer.Option(help=f"Comma-separated subset of: {','.join(BENCHMARKS)}")
+    ] = "",
+    split: Annotated[
+        int, typer.Option(help="Batch size, defaults to a tenth of the scale")
+    ] = 0,
+    n_hits: Annotated[int, typer.Option(help="Number of inspiration hits")] = 100,
+    place_latency: Annotated[
+        float, typer.Option(help="Latency of each fake Fragmenstein placement in seconds")
+    ] = 0.0,
+    workers: Annotated[int, typer.Option(help="Placement worker processes")] = 1,
+    ensemble: Annotated[
+        bool,
+        typer.Option(help="Place against every inspiration instead of one reference"),
+    ] = False,
+    workdir: Annotated[
+        str, typer.Option(help="Directory for the synthetic data, defaults to a temporary one")
+    ] = "",
+    output: Annotated[
+        str, typer.Option(help="JSON file to write the results to")
+    ] = "bench_output.json",
+):
+    """Run the benchmarks at each scale and write the timings as JSON"""
+
+    import json
+    import platform
+    import tempfile
+
+    from . import standins
+
+    standins.install(place_latency=place_latency)
+
+    selected = [b.strip() for b in only.split(",") if b.strip()] or BENCHMARKS
+    for benchmark in selected:
+        assert benchmark in BENCHMARKS, f"Unknown benchmark {benchmark}"
+
+    if workdir:
+        root = Path(workdir)
+        root.mkdir(exist_ok=True, parents=True)
+    else:
+        root = Path(tempfile.mkdtemp(prefix="bulkdock_bench_"))
+
+    results = []
+
+    for scale in [int(s) for s in scales.split(",")]:
+        results += run_scale(
+            root / f"scale_{scale}",
+            scale=scale,
+            split=split or max(100, scale // 10),
+            n_hits=n_hits,
+            workers=workers,
+            ensemble=ensemble,
+            selected=selected,
+        )
+
+    report = dict(
+        python=platform.python_version(),
+        machine=platform.machine(),
+        place_latency=place_latency,
+        workers=workers,
+        ensemble=ensemble,
+        n_hits=n_hits,
+        results=results,
+    )
+
+    json.dump(report, open(output, "wt"), indent=2)
+    mrich.writing(output)
+
+    mrich.h2("Results")
+    for result in results:
+        mrich.var(
+            f"{result['benchmark']} @ {result['scale']}",
+            f"{result['seconds']:.3f} s, {result['items_per_second']:.1f} items/s, {result['max_rss_mb']:.0f} MB",
+        )
+
+
+# heavy modules that the CLIs must only import inside the commands that need them
+LAZY_MODULES = ["rdkit", "pandas", "numpy", "fragmenstein", "hippo"]
+
+CLI_MODULES = ["bulkdock.__main__", "bulkdock.batch"]
+
+
+@app.command()
+def imports(
+    repeat: Annotated[int, typer.Option(help="Number of fresh interpreters to time")] = 5,
+    max_seconds: Annotated[
+        float, typer.Option(help="Fail if the median import time is above this")
+    ] = 0.0,
+):
+    """Time importing the CLI modules and check that no heavy module is imported eagerly"""
+
+    import sys
+    import json
+    import statistics
+    import subprocess
+
+    script = f"""
+import sys, time, json
+start = time.perf_counter()
+for name in {CLI_MODULES!r}:
+    __import__(name)
+seconds = time.perf_counter() - start
+loaded = [m for m in {LAZY_MODULES!r} if m in sys.modules]
+print(json.dumps(dict(seconds=seconds, loaded=loaded)))
+"""
+
+    timings = []
+
+    for i in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+
+    median = statistics.median(timings)
+
+    mrich.var("modules", ", ".join(CLI_MODULES))
+    mrich.var("median import time", f"{median:.3f} s")
+    mrich.var("eagerly imported", result["loaded"] or "none")
+
+    if result["loaded"]:
+        mrich.error("CLI modules import heavy dependencies:", ", ".join(result["loaded"]))
+        raise typer.Exit(code=1)
+
+    if max_seconds and median > max_seconds:
+        mrich.error(f"Import time above {max_seconds} s")
+        raise typer.Exit(code=1)
+
+    mrich.success("CLI imports are lazy")
+
+
+def run_scale(
+    root: Path,
+    *,
+    scale: int,
+    split: int,
+    n_hits: int,
+    workers: int,
+    ensemble: bool,
+    selected: list[str],
+) -> list[dict]:
+
+    import os
+    import json
+    from . import standins
+    from bulkdock.io import (
+        split_input_csv,
+        iter_balanced_split_input_csv,
+        parse_input_csv,
+    )
+
+    mrich.h1(f"Scale: {scale} rows")
+
+    engine = create_engine(root)
+    animal = engine.get_animal(TARGET)
+
+    results = []
+
+    # inputs are set up outside of the timed sections
+
+    hit_aliases = standins.create_hits(animal, engine.target_dir / TARGET, n_hits)
+    engine.pack_proteins(TARGET, animal=animal)
+    reference = None if ensemble else hit_aliases[0]
+
+    csv_name = f"{TARGET}_{scale}.csv"
+    csv_path = engine.input_dir / csv_name
+    standins.write_input_csv(csv_path, scale, hit_aliases)
+
+    inputs_dir = engine.get_scratch_subdir(f"{TARGET}_inputs")
+
+    def record(benchmark, items, seconds):
+        results.append(
+            dict(
+                benchmark=benchmark,
+                scale=scale,
+                items=items,
+                seconds=seconds,
+                items_per_second=items / seconds if seconds else 0.0,
+                max_rss_mb=max_rss_mb(),
+            )
+        )
+        mrich.success(f"{benchmark} @ {scale}: {seconds:.3f} s")
+
+    # split
+
+    with Timer() as t:
+        batch_paths = split_input_csv(csv_path, split=split, out_dir=inputs_dir)
+
+    if "split" in selected:
+        record("split", scale, t.seconds)
+
+    if "split_balanced" in selected:
+
+        balanced_dir = engine.get_scratch_subdir(f"{TARGET}_balanced")
+
+        with Timer() as t:
+            list(
+                iter_balanced_split_input_csv(
+                    csv_path, split=split, out_dir=balanced_dir, reference=not ensemble
+                )
+            )
+
+        record("split_balanced", scale, t.seconds)
+
+    # parse, which also registers the compounds
+
+    if "parse" in selected:
+
+        n_placements = 0
+
+        with Timer() as t:
+            for path in batch_paths:
+                n_placements += len(
+                    parse_input_csv(animal=animal, file=path, reference=reference)
+                )
+
+        record("parse", n_placements, t.seconds)
+
+    # placement loop
+
+    if "place" in selected or "combine" in selected:
+
+        with Timer() as t:
+            for i, path in enumerate(batch_paths):
+                os.environ["SLURM_JOB_ID"] = str(i + 1)
+                engine.place(TARGET, path, reference=reference, n_workers=workers)
+
+        if "place" in selected:
+            record("place", count_sdf_records(engine.output_dir), t.seconds)
+
+    if "combine" in selected:
+
+        batch = import_batch(engine)
+
+        with Timer() as t:
+            batch.combine(csv_name)
+
+        record("combine", scale, t.seconds)
+
+    # collate and export of poses registered by placement jobs
+
+    if {"collate", "collate_indexed", "to_fragalysis"} & set(selected):
+
+        batch = import_batch(engine)
+
+        job_ids = standins.create_placed_poses(animal, engine.scratch_dir, scale)
+
+        json.dump(job_ids, open(inputs_dir / "jobs.json", "wt"))
+
+        collated_name = f"{TARGET}_{scale}_collated.sdf"
+
+        with Timer() as t:
+            batch.collate(collated_name, TARGET, "jobs.json")
+
+        if "collate" in selected:
+            record("collate", scale, t.seconds)
+
+        if "collate_indexed" in selected:
+
+            with Timer() as t:
+                batch.collate(collated_name, TARGET, "jobs.json")
+
+            record("collate_indexed", scale, t.seconds)
+
+        if "to_fragalysis" in selected:
+
+            with Timer() as t:
+                engine.to_fragalysis(
+                    target=TARGET,
+                    sdf_file=collated_name,
+                    method="benchmark",
+                    ref_url="https://example.com",
+                    submitter_name="benchmark",
+                    submitter_institution="benchmark",
+                    submitter_email="benchmark@example.com",
+                    pose_filter_methods=[],
+                    debug=False,
+                )
+
+            record("to_fragalysis", scale, t.seconds)
+
+    return results
+
+
+def create_engine(root: Path) -> "BulkDock":
+    """A `BulkDock` object with its own directories under root"""
+
+    from bulkdock.bulkdock import BulkDock
+
+    class BenchmarkBulkDock(BulkDock):
+        def __init__(self):
+            self._config_path = root / "config.json"
+            self.config = {
+                f"DIR_{name.upper()}": root / name.upper()
+                for name in ["input", "target", "output", "scratch"]
+            }
+
+    engine = BenchmarkBulkDock()
+
+    for path in [engine.input_dir, engine.output_dir, engine.scratch_dir]:
+        path.mkdir(exist_ok=True, parents=True)
+
+    (engine.target_dir / TARGET).mkdir(exist_ok=True, parents=True)
+
+    return engine
+
+
+def import_batch(engine: "BulkDock"):
+    """Import the batch CLI module so that it uses the benchmark engine"""
+
+    import bulkdock.bulkdock
+    import bulkdock.batch
+
+    bulkdock.bulkdock._ENGINE = engine
+
+    return bulkdock.batch
+
+
+class Timer:
+    def __enter__(self):
+        import time
+
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        import time
+
+        self.seconds = time.perf_counter() - self._start
+
+
+def max_rss_mb() -> float:
+    """Peak resident memory of this process and its finished children"""
+
+    import resource
+
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024
+
+
+def count_sdf_records(directory: Path) -> int:
+
+    count = 0
+
+    for path in directory.glob("*.sdf"):
+        with open(path, "rb") as f:
+            count += sum(1 for line in f if line.startswith(b"$$$$"))
+
+    return count
+
+
+def main():
+    app()
+
+
+if __name__ == "__main__":
+    main()
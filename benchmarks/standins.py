@@ -0,0 +1,454 @@
+"""Offline stand-ins for HIPPO and Fragmenstein used by the BulkDock benchmarks
+
+Only the parts of the `hippo` and `fragmenstein` APIs that BulkDock uses are provided, backed by a plain SQLite database and a fake `Laboratory.place` with a configurable latency. Call :func:`install` before importing any BulkDock module that imports these packages.
+"""
+
+import sys
+import json
+import time
+import types
+import random
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+# placement latency of the fake Laboratory in seconds
+PLACE_LATENCY = 0.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS compound(
+    compound_id INTEGER PRIMARY KEY,
+    compound_inchikey TEXT UNIQUE NOT NULL,
+    compound_alias TEXT,
+    compound_smiles TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pose(
+    pose_id INTEGER PRIMARY KEY,
+    pose_alias TEXT UNIQUE,
+    pose_path TEXT,
+    pose_compound INTEGER,
+    pose_reference INTEGER,
+    pose_energy_score REAL,
+    pose_distance_score REAL,
+    pose_metadata TEXT,
+    pose_mol BLOB
+);
+CREATE TABLE IF NOT EXISTS tag(
+    tag_name TEXT NOT NULL,
+    tag_pose INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tag_name_pose ON tag(tag_name, tag_pose);
+"""
+
+_MOL_BINARY = None
+
+
+def mol_binary() -> bytes:
+    """Binary of a small 3D molecule used for every pose"""
+
+    global _MOL_BINARY
+
+    if _MOL_BINARY is None:
+        mol = Chem.AddHs(Chem.MolFromSmiles("c1ccccc1CC(=O)N"))
+        AllChem.EmbedMolecule(mol, randomSeed=0)
+        _MOL_BINARY = Chem.RemoveHs(mol).ToBinary()
+
+    return _MOL_BINARY
+
+
+def fake_inchikey(smiles: str) -> str:
+    digest = hashlib.sha1(smiles.encode()).hexdigest().upper()
+    return f"{digest[:14]}-{digest[14:24]}-N"
+
+
+### HIPPO
+
+
+class Compound:
+    def __init__(self, animal, db, id, inchikey, alias, smiles, metadata=None, mol=None):
+        self._animal = animal
+        self.id = id
+        self.inchikey = inchikey
+        self.alias = alias
+        self.smiles = smiles
+
+    def __str__(self):
+        return f"C{self.id}"
+
+
+class Pose:
+    def __init__(self, animal, record):
+        self._animal = animal
+        (
+            self.id,
+            self.alias,
+            self.path,
+            self.compound_id,
+            self.reference_id,
+            self.energy_score,
+            self.distance_score,
+            metadata,
+            self._mol_binary,
+        ) = record
+        self.metadata = json.loads(metadata or "{}")
+
+    @property
+    def mol(self):
+        return Chem.Mol(self._mol_binary)
+
+    def __str__(self):
+        return f"P{self.id}"
+
+
+class PoseSet:
+    def __init__(self, animal, ids: list[int]):
+        self._animal = animal
+        self.ids = list(ids)
+
+    @property
+    def aliases(self) -> list[str]:
+        return [pose.alias for pose in self]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        records = self._animal.db.execute(
+            f"SELECT {POSE_COLUMNS} FROM pose WHERE pose_id IN (SELECT value FROM json_each(?)) ORDER BY pose_id",
+            (json.dumps(self.ids),),
+        ).fetchall()
+        for record in records:
+            yield Pose(self._animal, record)
+
+    def __str__(self):
+        return f"{{P x {len(self)}}}"
+
+    def write_sdf(self, path, name_col: str = "id"):
+
+        writer = Chem.SDWriter(str(path))
+
+        for pose in self:
+            mol = pose.mol
+            mol.SetProp("_Name", str(getattr(pose, name_col)))
+            mol.SetProp("energy_score", str(pose.energy_score))
+            mol.SetProp("distance_score", str(pose.distance_score))
+            for key, value in pose.metadata.items():
+                mol.SetProp(key, str(value))
+            writer.write(mol)
+
+        writer.close()
+
+    def to_fragalysis(self, path, *, name_col: str = "id", **kwargs):
+        self.write_sdf(path, name_col=name_col)
+
+    def add_tag(self, tag: str):
+        self._animal.db.executemany(
+            "INSERT INTO tag(tag_name, tag_pose) VALUES (?, ?)",
+            [(tag, pose_id) for pose_id in self.ids],
+        )
+        self._animal.db.commit()
+
+
+POSE_COLUMNS = "pose_id, pose_alias, pose_path, pose_compound, pose_reference, pose_energy_score, pose_distance_score, pose_metadata, pose_mol"
+
+
+class PoseTable:
+    def __init__(self, animal):
+        self._animal = animal
+
+    def __getitem__(self, key):
+
+        db = self._animal.db
+
+        if isinstance(key, str):
+            record = db.execute(
+                f"SELECT {POSE_COLUMNS} FROM pose WHERE pose_alias = ?", (key,)
+            ).fetchone()
+            assert record, f"Unknown pose {key}"
+            return Pose(self._animal, record)
+
+        if isinstance(key, int):
+            record = db.execute(
+                f"SELECT {POSE_COLUMNS} FROM pose WHERE pose_id = ?", (key,)
+            ).fetchone()
+            assert record, f"Unknown pose {key}"
+            return Pose(self._animal, record)
+
+        key = list(key)
+
+        if key and isinstance(key[0], str):
+            records = db.execute(
+                "SELECT value, pose_id FROM json_each(?) LEFT JOIN pose ON pose_alias = value",
+                (json.dumps(key),),
+            ).fetchall()
+            missing = [alias for alias, pose_id in records if pose_id is None]
+            assert not missing, f"Unknown poses {missing}"
+            return PoseSet(self._animal, [pose_id for _, pose_id in records])
+
+        return PoseSet(self._animal, [int(pose_id) for pose_id in key])
+
+
+class HIPPO:
+    """SQLite-backed stand-in for `hippo.HIPPO`"""
+
+    def __init__(self, name: str, path: "Path", update_legacy: bool = True):
+        self.name = name
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.executescript(SCHEMA)
+        self.poses = PoseTable(self)
+
+    def __str__(self):
+        return f"HIPPO({self.name})"
+
+    def register_compounds(self, *, smiles) -> "list[tuple[str, str]]":
+
+        values = [(fake_inchikey(s), s) for s in smiles]
+
+        self.db.executemany(
+            "INSERT OR IGNORE INTO compound(compound_inchikey, compound_smiles) VALUES (?, ?)",
+            values,
+        )
+        self.db.commit()
+
+        return values
+
+    def register_pose(
+        self,
+        *,
+        compound: int,
+        target: int,
+        path: str,
+        reference: int | None = None,
+        inspirations=None,
+        tags=None,
+        energy_score=None,
+        distance_score=None,
+        metadata=None,
+        commit: bool = True,
+    ) -> int:
+
+        cursor = self.db.execute(
+            "INSERT INTO pose(pose_path, pose_compound, pose_reference, pose_energy_score, pose_distance_score, pose_metadata, pose_mol) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                path,
+                compound,
+                reference,
+                energy_score,
+                distance_score,
+                json.dumps(metadata or {}),
+                mol_binary(),
+            ),
+        )
+
+        pose_id = cursor.lastrowid
+
+        for tag in tags or []:
+            self.db.execute(
+                "INSERT INTO tag(tag_name, tag_pose) VALUES (?, ?)", (tag, pose_id)
+            )
+
+        if commit:
+            self.db.commit()
+
+        return pose_id
+
+
+### FRAGMENSTEIN
+
+
+class Wictor:
+
+    work_path = None
+
+    @classmethod
+    def enable_stdout(cls, level):
+        pass
+
+    @classmethod
+    def enable_logfile(cls, path, level):
+        pass
+
+
+class Laboratory:
+
+    Victor = Wictor
+
+    def __init__(self, pdbblock: str, covalent_resi=None, run_plip=False):
+        self.pdbblock = pdbblock
+
+    def place(self, queries, n_cores: int = 1, timeout: int = 300):
+
+        from pandas import DataFrame
+
+        start = time.perf_counter()
+
+        if PLACE_LATENCY:
+            time.sleep(PLACE_LATENCY)
+
+        rows = []
+
+        for name in queries["name"]:
+
+            subdir = Path(self.Victor.work_path) / name
+            subdir.mkdir(exist_ok=True, parents=True)
+
+            mol = Chem.Mol(mol_binary())
+            Chem.MolToMolFile(mol, str(subdir / f"{name}.minimised.mol"))
+
+            rows.append(
+                {
+                    "name": name,
+                    "error": "",
+                    "mode": "expansion",
+                    "∆∆G": random.uniform(-10, 2),
+                    "comRMSD": random.uniform(0, 3),
+                    "runtime": time.perf_counter() - start,
+                    "outcome": "acceptable",
+                    "min_binary": mol.ToBinary(),
+                }
+            )
+
+        return DataFrame(rows)
+
+
+def place_input_validator(queries):
+    return queries
+
+
+def install(place_latency: float = 0.0) -> None:
+    """Register the stand-ins as the `hippo` and `fragmenstein` packages"""
+
+    global PLACE_LATENCY
+    PLACE_LATENCY = place_latency
+
+    this = sys.modules[__name__]
+
+    hippo = types.ModuleType("hippo")
+    hippo.HIPPO = HIPPO
+    hippo.compound = types.ModuleType("hippo.compound")
+    hippo.compound.Compound = Compound
+
+    fragmenstein = types.ModuleType("fragmenstein")
+    fragmenstein.Wictor = Wictor
+    fragmenstein.Laboratory = Laboratory
+    fragmenstein.laboratory = types.ModuleType("fragmenstein.laboratory")
+    fragmenstein.laboratory.validator = types.ModuleType(
+        "fragmenstein.laboratory.validator"
+    )
+    fragmenstein.laboratory.validator.place_input_validator = place_input_validator
+
+    sys.modules.update(
+        {
+            "hippo": hippo,
+            "hippo.compound": hippo.compound,
+            "fragmenstein": fragmenstein,
+            "fragmenstein.laboratory": fragmenstein.laboratory,
+            "fragmenstein.laboratory.validator": fragmenstein.laboratory.validator,
+        }
+    )
+
+
+### SYNTHETIC DATA
+
+SUBSTITUENTS = ["C", "N", "O", "F"]
+
+
+def synthetic_smiles(i: int) -> str:
+    """Unique, valid SMILES for row i with some variation in size"""
+
+    code = "".join(
+        f"C({SUBSTITUENTS[(i >> (2 * k)) & 3]})" for k in range(10)
+    )
+
+    return f"c1ccccc1{code}{'C' * (i % 7)}"
+
+
+def write_input_csv(path: "Path", n_rows: int, hit_aliases: list[str], seed: int = 0) -> None:
+    """Write a BulkDock input CSV with 1-3 inspirations per row"""
+
+    rng = random.Random(seed)
+
+    with open(path, "wt") as f:
+        f.write("smiles,hit1,hit2,hit3\n")
+        for i in range(n_rows):
+            hits = rng.sample(hit_aliases, rng.randint(1, 3))
+            f.write(synthetic_smiles(i) + "," + ",".join(hits + [""] * (3 - len(hits))) + "\n")
+
+
+def create_hits(animal: HIPPO, target_dir: "Path", n_hits: int) -> list[str]:
+    """Register hit poses with apo-desolv protein files, returns their aliases"""
+
+    aliases = []
+
+    for i in range(n_hits):
+
+        alias = f"x{i:04}a"
+        subdir = target_dir / "aligned_files" / alias
+        subdir.mkdir(exist_ok=True, parents=True)
+
+        (subdir / f"{alias}_apo-desolv.pdb").write_text(
+            "ATOM      1  CA  ALA A   1       0.000   0.000   0.000  1.00  0.00           C\nEND\n"
+        )
+
+        animal.db.execute(
+            f"INSERT INTO pose({POSE_COLUMNS}) VALUES (NULL, ?, ?, NULL, NULL, NULL, NULL, '{{}}', ?)",
+            (alias, str(subdir / f"{alias}_hippo.pdb"), mol_binary()),
+        )
+
+        aliases.append(alias)
+
+    animal.db.commit()
+
+    return aliases
+
+
+def create_placed_poses(
+    animal: HIPPO,
+    scratch_dir: "Path",
+    n_poses: int,
+    poses_per_job: int = 1_000,
+    first_job_id: int = 1_000_000,
+    tag: str = "Fragmenstein placed",
+    seed: int = 0,
+) -> list[int]:
+    """Register placed poses as if by a series of placement jobs, returns the job IDs"""
+
+    rng = random.Random(seed)
+
+    values = animal.register_compounds(
+        smiles=[synthetic_smiles(i) for i in range(n_poses)]
+    )
+
+    compound_ids = dict(animal.db.execute("SELECT compound_inchikey, compound_id FROM compound"))
+
+    job_ids = []
+
+    for i in range(n_poses):
+
+        job_id = first_job_id + i // poses_per_job
+
+        if not job_ids or job_ids[-1] != job_id:
+            job_ids.append(job_id)
+
+        compound_id = compound_ids[values[i][0]]
+        name = f"C{compound_id}-P1"
+
+        animal.register_pose(
+            compound=compound_id,
+            target=1,
+            path=str(scratch_dir / str(job_id) / name / f"{name}.minimised.mol"),
+            reference=1,
+            tags=[tag],
+            energy_score=rng.uniform(-10, 2),
+            distance_score=rng.uniform(0, 3),
+            metadata=dict(fragmenstein_outcome=rng.choice(["acceptable", "too moved"])),
+            commit=False,
+        )
+
+    animal.db.commit()
+
+    return job_ids
@@ -1,6 +1,6 @@
 import mrich
 import typer
-from .bulkdock import BulkDock
+from .bulkdock import get_engine, read_config_dir
 from typing import Optional
 from typing_extensions import Annotated
 from .config import VARIABLES
@@ -10,7 +10,6 @@ HELP = """
 """
 
 app = typer.Typer(help=HELP, no_args_is_help=True)
-engine = BulkDock()
 
 
 @app.command()
@@ -19,7 +18,50 @@ def status():
 
     from .status import status
 
-    status()
+    status(scratch_dir=read_config_dir("DIR_SCRATCH"))
+
+
+@app.command()
+def report(
+    target: str,
+    file: str,
+    top: Annotated[
+        int, typer.Option(help="Number of slowest compounds and references to show")
+    ] = 10,
+):
+    """Summarise placement throughput, latencies and timeouts for an input file"""
+    get_engine().report(target, file, top=top)
+
+
+@app.command()
+def heal(
+    target: str,
+    file: str,
+    reference: Annotated[
+        str,
+        typer.Option(help="Name of the reference pose that the run was submitted with"),
+    ] = "",
+    stage: Annotated[
+        bool,
+        typer.Option(help="The run was submitted with --stage, also chain a merge job"),
+    ] = False,
+    throttle: Annotated[
+        int,
+        typer.Option(help="Maximum number of array tasks running at once, 0 for no limit"),
+    ] = 0,
+    dry_run: Annotated[
+        bool, typer.Option(help="Only report which batches did not finish")
+    ] = False,
+):
+    """Resubmit the batches of a placement run that did not finish, then combine again"""
+    get_engine().heal(
+        target,
+        file,
+        reference=reference,
+        stage=stage,
+        throttle=throttle,
+        dry_run=dry_run,
+    )
 
 
 @app.command()
@@ -44,7 +86,7 @@ def to_fragalysis(
     if posebusters:
         pose_filter_methods.append("posebusters")
 
-    engine.to_fragalysis(
+    get_engine().to_fragalysis(
         target=target,
         sdf_file=sdf_file,
         method=method,
@@ -65,7 +107,12 @@ def to_fragalysis(
 def place(
     target: str,
     file: str,
-    split: int = 1_000,
+    split: Annotated[
+        int | None,
+        typer.Option(
+            help="Split the input file into batches of this size, 1000 rows by default or 25 with --queue"
+        ),
+    ] = None,
     stagger: int = 0.25,
     dependency: int = 0,
     reference: Annotated[
@@ -74,6 +121,46 @@ def place(
             help="Name of reference pose, if none is specified will ensemble dock against inspirations"
         ),
     ] = "",
+    array: Annotated[
+        bool,
+        typer.Option(help="Submit the batches as a single SLURM job array"),
+    ] = False,
+    throttle: Annotated[
+        int,
+        typer.Option(
+            help="Maximum number of array tasks running at once, 0 for no limit"
+        ),
+    ] = 0,
+    stage: Annotated[
+        bool,
+        typer.Option(
+            help="Register compounds up front and stage poses per job, merging them into the HIPPO database afterwards"
+        ),
+    ] = False,
+    balance: Annotated[
+        bool,
+        typer.Option(
+            help="Split the input into batches of equal estimated cost rather than equal row counts"
+        ),
+    ] = False,
+    skip_cached: Annotated[
+        bool,
+        typer.Option(
+            help="Drop rows whose placements are all in the target's result cache, or that duplicate an earlier row"
+        ),
+    ] = False,
+    ntasks: Annotated[
+        int,
+        typer.Option(
+            help="Run each place job as this many srun tasks that share its placements"
+        ),
+    ] = 0,
+    queue: Annotated[
+        int,
+        typer.Option(
+            help="Submit this many worker jobs that claim batches from a shared queue until it is empty, instead of one job per batch"
+        ),
+    ] = 0,
 ):
     """Start a placement job.
 
@@ -85,13 +172,25 @@ def place(
     # :param name: or path to input file (must be in configured INPUTS directory)
     # :param split: split the input file into batches of this size
 
-    engine.submit_placement_jobs(
+    if split is None:
+        from .workqueue import QUEUE_SPLIT
+
+        split = QUEUE_SPLIT if queue else 1_000
+
+    get_engine().submit_placement_jobs(
         target,
         file,
         split=split,
         stagger=stagger,
         dependency=dependency,
         reference=reference,
+        array=array,
+        throttle=throttle,
+        stage=stage,
+        balance=balance,
+        skip_cached=skip_cached,
+        ntasks=ntasks,
+        queue=queue,
     )
 
 
@@ -108,25 +207,37 @@ def configure(
     mrich.var("variable", variable)
     mrich.var("value", value)
     assert variable in VARIABLES
-    engine.set_config_value(variable, value)
+    get_engine().set_config_value(variable, value)
 
 
 @app.command()
 def create_directories():
     """Create directories as configured"""
-    engine.create_directories()
+    get_engine().create_directories()
 
 
 @app.command()
 def extract(target: str):
     """Extract target zip file"""
-    engine.extract_target(target)
+    get_engine().extract_target(target)
 
 
 @app.command()
 def setup(target: str):
     """Setup HIPPO Database for a target"""
-    engine.setup_hippo(target)
+    get_engine().setup_hippo(target)
+
+
+@app.command()
+def pack_proteins(target: str):
+    """Rebuild the pack of protein PDBs that placement jobs read from"""
+    get_engine().pack_proteins(target)
+
+
+@app.command()
+def update_result_cache(target: str):
+    """Merge the result caches of placement jobs into the result cache that placement jobs read from"""
+    get_engine().update_result_cache(target)
 
 
 def main():
@@ -1,14 +1,13 @@
 import mrich
 import typer
 from typing_extensions import Annotated
-from .bulkdock import BulkDock
+from .bulkdock import get_engine
 
 HELP = """
 💪 BulkDock: INTERNAL CLI ONLY!
 """
 
 app = typer.Typer()
-engine = BulkDock()
 
 """Inner CLI for batch jobs"""
 
@@ -23,25 +22,238 @@ def place(
             help="Name of reference pose, if none is specified will ensemble dock against inspirations"
         ),
     ] = "",
+    workers: Annotated[
+        int,
+        typer.Option(
+            help="Number of concurrent placement processes, defaults to SLURM_CPUS_PER_TASK"
+        ),
+    ] = 0,
+    array: Annotated[
+        bool,
+        typer.Option(
+            help="FILE is a manifest of batch inputs, pick the one given by SLURM_ARRAY_TASK_ID"
+        ),
+    ] = False,
+    stage: Annotated[
+        bool,
+        typer.Option(
+            help="Stage poses in a per-job store instead of writing to the HIPPO database, compounds must be registered beforehand"
+        ),
+    ] = False,
+    shard: Annotated[
+        bool,
+        typer.Option(
+            help="Split the placements across the SLURM_NTASKS tasks of the job, relaunching with srun if needed"
+        ),
+    ] = False,
 ):
     """Run Bulkdock.place"""
     mrich.h3("bulkdock.batch.place")
     mrich.var("target", target)
     mrich.var("file", file)
     mrich.var("reference", reference)
-    engine.place(target, file, reference=reference)
+    mrich.var("workers", workers)
+    mrich.var("shard", shard)
+
+    if shard:
+        import os
+        import sys
+        from .shard import in_job_step
+
+        SLURM_NTASKS = int(os.environ.get("SLURM_NTASKS", 1))
+
+        # the batch script runs once, start one copy of this command per task
+        if SLURM_NTASKS > 1 and not in_job_step():
+            mrich.print("Launching", SLURM_NTASKS, "tasks with srun")
+            sys.stdout.flush()
+            os.execvp(
+                "srun",
+                [
+                    "srun",
+                    "--kill-on-bad-exit=1",
+                    sys.executable,
+                    "-m",
+                    "bulkdock.batch",
+                    *sys.argv[1:],
+                ],
+            )
+
+    if array:
+        import os
+
+        SLURM_ARRAY_TASK_ID = os.environ.get("SLURM_ARRAY_TASK_ID", None)
+        mrich.var("SLURM_ARRAY_TASK_ID", SLURM_ARRAY_TASK_ID)
+        assert SLURM_ARRAY_TASK_ID, "SLURM_ARRAY_TASK_ID not set"
+
+        with open(file, "rt") as f:
+            manifest = [line.strip() for line in f if line.strip()]
+
+        file = manifest[int(SLURM_ARRAY_TASK_ID)]
+        mrich.var("file", file)
+
+    get_engine().place(
+        target, file, reference=reference, n_workers=workers, stage=stage, shard=shard
+    )
+
+
+@app.command()
+def work(
+    target: str,
+    queue_path: str,
+    reference: Annotated[
+        str,
+        typer.Option(
+            help="Name of reference pose, if none is specified will ensemble dock against inspirations"
+        ),
+    ] = "",
+    workers: Annotated[
+        int,
+        typer.Option(
+            help="Number of concurrent placement processes, defaults to SLURM_CPUS_PER_TASK"
+        ),
+    ] = 0,
+    stage: Annotated[
+        bool,
+        typer.Option(
+            help="Stage poses in a per-job store instead of writing to the HIPPO database, compounds must be registered beforehand"
+        ),
+    ] = False,
+    lease: Annotated[
+        float,
+        typer.Option(
+            help="Seconds after which the batch of a worker that stopped renewing its lease is requeued"
+        ),
+    ] = 900,
+    max_failures: Annotated[
+        int,
+        typer.Option(help="Stop the worker after this many consecutive failed batches"),
+    ] = 3,
+):
+    """Run Bulkdock.place on batches claimed from a shared queue until it is empty"""
+
+    import os
+    import socket
+    from .workqueue import PlacementQueue, LeaseKeeper, BATCH_ERRORS
+
+    mrich.h3("bulkdock.batch.work")
+    mrich.var("target", target)
+    mrich.var("queue_path", queue_path)
+    mrich.var("reference", reference)
+    mrich.var("workers", workers)
+    mrich.var("lease", lease)
+    mrich.var("max_failures", max_failures)
+
+    engine = get_engine()
+
+    queue = PlacementQueue(queue_path)
+
+    worker = f"{os.environ.get('SLURM_JOB_ID')}@{socket.gethostname()}:{os.getpid()}"
+    mrich.var("worker", worker)
+
+    n_batches = 0
+    n_failures = 0
+
+    while claimed := queue.claim(worker, lease=lease):
+
+        batch_id, csv_path = claimed
+
+        mrich.h2(f"Batch {batch_id}: {csv_path.name}")
+
+        completed = False
+        count_attempt = True
+
+        keeper = LeaseKeeper(queue, batch_id, worker, lease=lease)
+
+        try:
+            if not csv_path.exists():
+                raise FileNotFoundError(csv_path)
+
+            with keeper:
+                engine.place(
+                    target, csv_path, reference=reference, n_workers=workers, stage=stage
+                )
+
+            completed = True
+            n_failures = 0
+
+        except KeyboardInterrupt:
+            if not keeper.lost:
+                raise
+
+            # the batch may have been claimed by another worker, which resumes it from the checkpoint
+            mrich.error(f"Stopped batch {batch_id} after losing its lease")
+
+        except BATCH_ERRORS as e:
+            mrich.error(f"Batch {batch_id} failed:", e)
+            n_failures += 1
+
+            # a run of failures points at the worker rather than the batches
+            count_attempt = n_failures < max_failures
+
+        except Exception as e:
+            # e.g. a missing HIPPO animal or reference, which would fail every batch
+            mrich.error(f"Stopping worker after an error on batch {batch_id}:", e)
+            count_attempt = False
+            raise
+
+        finally:
+            # batches of a worker that is killed go straight back to the queue
+            if completed:
+                queue.complete(batch_id, worker)
+            elif not keeper.lost:
+                queue.release(batch_id, worker, count_attempt=count_attempt)
+
+        n_batches += 1
+
+        mrich.var("queue", queue.counts())
+
+        if n_failures >= max_failures:
+            mrich.error(f"Stopping worker after {n_failures} consecutive failed batches")
+            queue.close()
+            raise typer.Exit(code=1)
+
+    mrich.success("Queue is empty, worked on", n_batches, "batches")
+
+    queue.close()
+
+
+@app.command()
+def register(target: str, manifest: str):
+    """Register the compounds of every batch in a manifest ahead of staged placements"""
+    mrich.h3("bulkdock.batch.register")
+    mrich.var("target", target)
+    mrich.var("manifest", manifest)
+    get_engine().register_compounds(target, manifest)
 
 
 @app.command()
-def combine(csv_file: str):
+def merge(target: str, csv_file: str):
+    """Merge poses from the staging stores of placement jobs into the HIPPO database"""
+    mrich.h3("bulkdock.batch.merge")
+    mrich.var("target", target)
+    mrich.var("csv_file", csv_file)
+    get_engine().merge_staged_poses(target, csv_file)
+
+
+@app.command()
+def combine(
+    csv_file: str,
+    manifest: Annotated[
+        str,
+        typer.Option(
+            help="Manifest of the batch inputs, to count the expected batches when rows were dropped before splitting"
+        ),
+    ] = "",
+):
     """Combine split SDF outputs from placement jobs"""
 
-    import subprocess
     from pandas import DataFrame
     from pathlib import Path
-    from rich.table import Table
     from math import ceil
-    from molparse.rdkit import sdf_combine
+    from .io import count_csv_rows, combine_sdfs
+    from .resultindex import combine_result_indexes, write_result_index
+
+    engine = get_engine()
 
     mrich.h3("bulkdock.batch.combine")
     mrich.var("csv_file", csv_file)
@@ -49,9 +261,7 @@ def combine(csv_file: str):
     csv_path = engine.get_infile_path(csv_file)
     mrich.var("csv_path", csv_path)
 
-    commands = [f"grep -v smiles {str(csv_path.resolve())} | wc -l"]
-    x = subprocess.run(commands, shell=True, stdout=subprocess.PIPE)
-    num_compounds = int(x.stdout.decode())
+    num_compounds = count_csv_rows(csv_path)
 
     mrich.var("num_compounds", num_compounds)
 
@@ -78,6 +288,12 @@ def combine(csv_file: str):
         mrich.warning("Only one matching output, not doing anything")
         return
 
+    # records of rows that were dropped from the input by the result cache
+    cached_file = engine.get_outfile_path(f"{key}_cached.sdf")
+
+    if not cached_file.exists():
+        cached_file = None
+
     df = []
     for file in files:
 
@@ -85,6 +301,9 @@ def combine(csv_file: str):
 
         file_name = file.name
 
+        if file == cached_file:
+            continue
+
         detail = file_name.removeprefix(key).removesuffix(".sdf")
 
         fields = [s for s in detail.split("_") if s]
@@ -115,7 +334,11 @@ def combine(csv_file: str):
 
     mrich.var("batch_size", batch_size)
 
-    expected_batch_count = ceil(num_compounds / batch_size)
+    if manifest:
+        with open(manifest, "rt") as f:
+            expected_batch_count = sum(1 for line in f if line.strip())
+    else:
+        expected_batch_count = ceil(num_compounds / batch_size)
 
     mrich.var("expected_batch_count", expected_batch_count)
 
@@ -125,12 +348,15 @@ def combine(csv_file: str):
     elif len(df) < expected_batch_count:
         mrich.warning("Missing batches")
 
+    summary = []
+
     for i in range(expected_batch_count):
 
         subdf = df[df["batch_index"] == i]
 
         if len(subdf) == 0:
             mrich.error(f"Missing batch {i}")
+            summary.append(dict(batch_index=i, job_id=None, file=None))
             continue
 
         elif len(subdf) > 1:
@@ -140,10 +366,33 @@ def combine(csv_file: str):
             row = subdf.iloc[0]
 
         files.append(row["file"])
+        summary.append(dict(batch_index=i, job_id=row["job_id"], file=row["file"]))
+
+    if cached_file:
+        files.append(cached_file)
+        summary.append(dict(batch_index=None, job_id=None, file=cached_file))
 
     out_path = engine.get_outfile_path(f"{key}_combined.sdf")
 
-    sdf_combine(files, out_path)
+    counts = dict(zip(files, combine_sdfs(files, out_path)))
+
+    # offsets of the batch indexes shifted into the combined output
+    write_result_index(out_path, combine_result_indexes(files))
+
+    # per-batch record counts
+
+    summary = DataFrame(summary)
+    summary["records"] = [counts.get(file, 0) for file in summary["file"]]
+    summary["file"] = [file.name if file else None for file in summary["file"]]
+
+    mrich.print(summary)
+
+    summary_path = engine.get_outfile_path(f"{key}_combined_summary.csv")
+    mrich.writing(summary_path)
+    summary.to_csv(summary_path, index=False)
+
+    mrich.var("#records", sum(counts.values()))
+    mrich.success("Combined", len(files), "batches into", out_path)
 
 
 @app.command()
@@ -159,6 +408,8 @@ def collate(
     mrich.var("json_path", json_path)
     mrich.var("tag", tag)
 
+    engine = get_engine()
+
     animal = engine.get_animal(target)
 
     subdir = engine.get_scratch_subdir(f"{target}_inputs")
@@ -174,22 +425,27 @@ def collate(
 
     mrich.var("job_ids", job_ids)
 
-    tagged_poses = animal.poses(tag=tag)
+    # poses placed by these jobs from the job ID index
 
-    mrich.var("tagged_poses", tagged_poses)
+    from .jobindex import PoseJobIndex, filter_pose_ids_by_tag
 
-    pose_ids = set()
-    for i, pose in mrich.track(enumerate(tagged_poses), prefix="Getting poses"):
+    index = PoseJobIndex(engine.get_pose_job_index_path(target))
 
-        mrich.set_progress_field("progress", f"{i+1}/{len(tagged_poses)}")
-        mrich.set_progress_field("found", len(pose_ids))
+    mrich.var("index", index.path)
 
-        job_id = int(Path(pose.path).parent.parent.name)
+    with mrich.loading("Updating job ID index..."):
+        index.update(animal)
 
-        if job_id not in job_ids:
-            continue
+    pose_ids = index.get_pose_ids(job_ids)
 
-        pose_ids.add(pose.id)
+    index.close()
+
+    mrich.var("#indexed poses", len(pose_ids))
+
+    if tag:
+        pose_ids = filter_pose_ids_by_tag(animal, pose_ids, tag)
+
+    assert pose_ids, "No poses found for these jobs"
 
     poses = animal.poses[pose_ids]
 
@@ -198,6 +454,10 @@ def collate(
     outfile = engine.get_outfile_path(outname)
     poses.write_sdf(outfile, name_col="id")
 
+    from .resultindex import write_result_index
+
+    write_result_index(outfile)
+
     return outfile
 
 
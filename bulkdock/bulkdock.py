@@ -1,14 +1,15 @@
 import mrich
 from pathlib import Path
 import json
-from rdkit import Chem
+
+CONFIG_PATH = (Path(__file__).parent / "../config.json").resolve()
 
 
 class BulkDock:
 
     def __init__(self):
 
-        self._config_path = (Path(__file__).parent / "../config.json").resolve()
+        self._config_path = CONFIG_PATH
 
         self.load_config()
 
@@ -37,13 +38,7 @@ class BulkDock:
         for key, value in config.items():
 
             if key.startswith("DIR_"):
-
-                path = Path(value)
-
-                if path.is_absolute():
-                    value = path
-                else:
-                    value = (Path(__file__).parent / value).resolve()
+                value = resolve_config_dir(value)
 
             self._config[key] = value
 
@@ -77,6 +72,25 @@ class BulkDock:
     def slurm_email_combine(self):
         return self.config["SLURM_EMAIL_COMBINE"]
 
+    @property
+    def retry_policy(self) -> "RetryPolicy":
+        """Placement retry policy, configured with the PLACE_* variables"""
+
+        from .retry import RetryPolicy
+
+        kwargs = {}
+
+        for variable, key, parse in [
+            ("PLACE_RETRIES", "n_retries", int),
+            ("PLACE_TIMEOUT", "timeout", float),
+            ("PLACE_TIMEOUT_FACTOR", "timeout_factor", float),
+            ("PLACE_MAX_TIMEOUTS", "max_timeouts", int),
+        ]:
+            if variable in self.config:
+                kwargs[key] = parse(self.config[variable])
+
+        return RetryPolicy(**kwargs)
+
     @property
     def fragalysis_export_ref_url(self):
         return self.config["FRAGALYSIS_EXPORT_REF_URL"]
@@ -150,6 +164,52 @@ class BulkDock:
 
         mrich.success(f"HIPPO set up for {target}")
 
+        self.pack_proteins(target, animal=animal)
+
+    def pack_proteins(self, target: str, animal: "HIPPO | None" = None) -> "Path":
+        """Build the target's pack of protein PDBs for the aliased (hit) poses"""
+
+        mrich.h3("BulkDock.pack_proteins")
+
+        from .proteins import ProteinPack
+
+        if animal is None:
+            animal = self.get_animal(target)
+
+        references = animal.db.execute(
+            "SELECT pose_id, pose_path FROM pose WHERE pose_alias IS NOT NULL AND pose_path IS NOT NULL"
+        ).fetchall()
+
+        pack = ProteinPack.build(self.get_protein_pack_dir(target), references)
+
+        mrich.writing(pack.pack_path)
+
+        pack.close()
+
+        return pack.pack_path
+
+    def update_result_cache(self, target: str) -> int:
+        """Merge the result caches of placement jobs into the result cache of a target
+
+        :returns: number of cached placements
+        """
+
+        from .resultcache import PlacementResultCache, find_job_result_caches
+
+        paths = find_job_result_caches(self.scratch_dir, target)
+
+        result_cache = PlacementResultCache(self.get_result_cache_path(target))
+
+        n_merged = result_cache.merge(paths)
+        count = len(result_cache)
+
+        result_cache.close()
+
+        mrich.var("#merged job result caches", n_merged)
+        mrich.var("#cached placements", count)
+
+        return count
+
     ### PLACEMENTS
 
     def submit_placement_jobs(
@@ -157,12 +217,25 @@ class BulkDock:
         target: str,
         infile: str,
         debug: bool = False,
-        split: int = 6_000,
+        split: int | None = None,
         stagger: float = 0.5,
         dependency: str | None = None,
         reference: str | None = None,
+        array: bool = False,
+        throttle: int | None = None,
+        stage: bool = False,
+        balance: bool = False,
+        skip_cached: bool = False,
+        ntasks: int = 0,
+        queue: int = 0,
     ):
 
+        if split is None:
+            from .workqueue import QUEUE_SPLIT
+
+            # the slowest batch bounds the run, unless the batches are small
+            split = QUEUE_SPLIT if queue else 6_000
+
         mrich.h2("BulkDock.submit_placement_jobs")
         mrich.var("target", target)
         mrich.var("infile", infile)
@@ -170,11 +243,18 @@ class BulkDock:
         mrich.var("stagger", stagger)
         mrich.var("dependency", dependency)
         mrich.var("reference", reference)
+        mrich.var("array", array)
+        mrich.var("throttle", throttle)
+        mrich.var("stage", stage)
+        mrich.var("balance", balance)
+        mrich.var("skip_cached", skip_cached)
+        mrich.var("ntasks", ntasks)
+        mrich.var("queue", queue)
 
         import os
-        import subprocess
         import time
-        from .io import split_input_csv
+        from .io import iter_split_input_csv, iter_balanced_split_input_csv
+        from .checkpoint import clear_checkpoint
 
         ### SOME CONFIGURATION VALIDATION
 
@@ -194,18 +274,97 @@ class BulkDock:
             "SLURM_PYTHON_SCRIPT" in self.config
         ), "variable SLURM_PYTHON_SCRIPT not configured"
 
+        assert not (
+            queue and ntasks > 1
+        ), "Queue workers are single tasks, use --ntasks without --queue"
+
         target = Path(target).name
 
-        ### SPLIT INPUT
+        inputs_dir = self.get_scratch_subdir(f"{target}_inputs")
+
+        ### DROP CACHED ROWS
+
+        split_path = orig_path
+
+        cached_sdf = self.get_outfile_path(
+            f"{orig_path.name.removesuffix('.csv')}_cached.sdf"
+        )
+
+        # cached poses are merged into the HIPPO database along with the staged placements
+        cached_staging_path = inputs_dir / f"staging_{orig_path.name.removesuffix('.csv')}_cached.sqlite"
+
+        for path in [cached_sdf, cached_staging_path]:
+            if path.exists():
+                mrich.warning("Removing cached records of a previous submission", path)
+                path.unlink()
 
-        if split:
-            csv_paths = split_input_csv(
+        n_rows = n_cached = n_duplicates = 0
+
+        if skip_cached:
+
+            # results of earlier placement jobs
+            self.update_result_cache(target)
+
+            from .resultcache import (
+                PlacementResultCache,
+                read_pose_ids_by_alias,
+                split_cached_rows,
+                stage_cached_records,
+            )
+
+            split_path = inputs_dir / "uncached" / orig_path.name
+            split_path.parent.mkdir(exist_ok=True)
+
+            result_cache = PlacementResultCache(self.get_result_cache_path(target))
+
+            n_rows, n_cached, n_duplicates = split_cached_rows(
                 orig_path,
+                split_path,
+                cache=result_cache,
+                pose_ids=read_pose_ids_by_alias(self.get_animal_path(target)),
+                cached_sdf=cached_sdf,
+                reference=reference or None,
+            )
+
+            result_cache.close()
+
+            if not n_cached:
+                cached_sdf.unlink()
+
+            elif stage:
+                stage_cached_records(
+                    cached_sdf, cached_staging_path, csv_name=orig_path.name
+                )
+
+        ### SPLIT INPUT
+
+        # batches are submitted as soon as they have been written
+        if split and balance:
+            csv_paths = iter_balanced_split_input_csv(
+                split_path,
                 split=split,
-                out_dir=self.get_scratch_subdir(f"{target}_inputs"),
+                out_dir=inputs_dir,
+                reference=bool(reference),
+            )
+        elif split:
+            csv_paths = iter_split_input_csv(
+                split_path,
+                split=split,
+                out_dir=inputs_dir,
             )
         else:
-            csv_paths = [orig_path]
+            csv_paths = [split_path]
+
+        # a new submission does not resume from ledgers of earlier batches with the same names
+        def clear_checkpoints(csv_paths):
+            for csv_path in csv_paths:
+                clear_checkpoint(self.get_checkpoint_dir(target, csv_path))
+                yield csv_path
+
+        csv_paths = clear_checkpoints(csv_paths)
+
+        # list of batch inputs, one per line
+        manifest_path = self.get_manifest_path(target, orig_path)
 
         ### SUBMIT SLURM JOBS
 
@@ -228,15 +387,60 @@ class BulkDock:
 
         mrich.var("submission directory", os.getcwd())
 
+        if skip_cached and n_cached + n_duplicates == n_rows:
+
+            mrich.success("All rows are cached or duplicates, nothing to place")
+
+            if stage and n_cached:
+
+                job_name = f"BulkDock.merge:{target}:{orig_path.name.removesuffix('.csv')}"
+
+                commands = [
+                    "sbatch",
+                    "--job-name",
+                    job_name,
+                    "--output=" f"{log_dir.resolve()}/%j.log",
+                    "--error=" f"{log_dir.resolve()}/%j.log",
+                ]
+
+                if dependency:
+                    commands.append(f"--dependency=afterany:{dependency}")
+
+                if submit_args:
+                    commands.append(submit_args)
+
+                commands += [
+                    template_script,
+                    "-m bulkdock.batch",
+                    "merge",
+                    target,
+                    infile,
+                ]
+
+                job_id = self.sbatch(commands)
+
+                mrich.success("Submitted merge job", job_id, f'"{job_name}"')
+
+            return None
+
         job_ids = []
 
-        for i, csv_path in enumerate(csv_paths):
+        place_dependency = f"afterany:{dependency}" if dependency else None
+
+        ### register compounds ahead of staged placement jobs
+
+        if stage:
+
+            # all batches are needed before the registration job
+            csv_paths = list(csv_paths)
 
-            if stagger and i > 0:
-                with mrich.clock("Staggering job submission..."):
-                    time.sleep(stagger)
+            with open(manifest_path, "wt") as manifest:
+                for csv_path in csv_paths:
+                    manifest.write(f"{csv_path.resolve()}\n")
 
-            job_name = f"BulkDock.place:{target}:{csv_path.name.removesuffix('.csv')}"
+            mrich.writing(manifest_path)
+
+            job_name = f"BulkDock.register:{target}:{orig_path.name.removesuffix('.csv')}"
 
             commands = [
                 "sbatch",
@@ -252,71 +456,490 @@ class BulkDock:
             if submit_args:
                 commands.append(submit_args)
 
+            commands += [
+                template_script,
+                "-m bulkdock.batch",
+                "register",
+                target,
+                str(manifest_path.resolve()),
+            ]
+
+            register_job_id = self.sbatch(commands)
+
+            mrich.success("Submitted register job", register_job_id, f'"{job_name}"')
+
+            place_dependency = f"afterok:{register_job_id}"
+
+        def place_commands(job_name):
+
+            commands = [
+                "sbatch",
+                "--job-name",
+                job_name,
+                "--output=" f"{log_dir.resolve()}/%j.log",
+                "--error=" f"{log_dir.resolve()}/%j.log",
+            ]
+
+            if place_dependency:
+                commands.append(f"--dependency={place_dependency}")
+
+            if submit_args:
+                commands.append(submit_args)
+
             if self.email_address and self.slurm_email_place:
                 commands.append(f"--mail-user={self.email_address}")
                 commands.append(f"--mail-type={self.slurm_email_place}")
 
+            # one allocation sharded across several tasks
+            if ntasks > 1:
+                commands.append(f"--ntasks={ntasks}")
+
+            return commands
+
+        if queue:
+
+            from .workqueue import PlacementQueue
+
+            csv_paths = list(csv_paths)
+
+            assert csv_paths, "No batches to submit"
+
+            with open(manifest_path, "wt") as manifest:
+                for csv_path in csv_paths:
+                    manifest.write(f"{csv_path.resolve()}\n")
+
+            mrich.writing(manifest_path)
+
+            # a fresh queue of the batches, which worker jobs claim until it is empty
+            queue_path = self.get_queue_path(target, orig_path)
+
+            for path in [queue_path, queue_path.with_name(queue_path.name + "-journal")]:
+                path.unlink(missing_ok=True)
+
+            batch_queue = PlacementQueue(queue_path)
+            batch_queue.add(csv_paths)
+            batch_queue.close()
+
+            mrich.writing(queue_path)
+
+            job_name = f"BulkDock.work:{target}:{orig_path.name.removesuffix('.csv')}"
+
+            array_range = f"0-{queue - 1}"
+
+            commands = place_commands(job_name)
+
+            commands.append(f"--array={array_range}")
+
+            commands += [
+                template_script,
+                "-m bulkdock.batch",
+                "work",
+                target,
+                str(queue_path.resolve()),
+            ]
+
+            if reference:
+                commands.append(f"--reference {reference}")
+
+            if stage:
+                commands.append("--stage")
+
+            job_id = self.sbatch(commands)
+
+            job_ids.append(job_id)
+
+            mrich.success(
+                "Submitted worker array job",
+                job_id,
+                f'"{job_name}"',
+                f"[{array_range}]",
+                f"for {len(csv_paths)} batches",
+            )
+
+        elif array:
+
+            csv_paths = list(csv_paths)
+
+            assert csv_paths, "No batches to submit"
+
+            with open(manifest_path, "wt") as manifest:
+                for csv_path in csv_paths:
+                    manifest.write(f"{csv_path.resolve()}\n")
+
+            mrich.writing(manifest_path)
+
+            job_name = f"BulkDock.place:{target}:{orig_path.name.removesuffix('.csv')}"
+
+            array_range = f"0-{len(csv_paths) - 1}"
+
+            if throttle:
+                array_range = f"{array_range}%{throttle}"
+
+            commands = place_commands(job_name)
+
+            commands.append(f"--array={array_range}")
+
             commands += [
                 template_script,
                 "-m bulkdock.batch",
                 "place",
                 target,
-                str(csv_path.resolve()),
+                str(manifest_path.resolve()),
+                "--array",
             ]
 
             if reference:
                 commands.append(f"--reference {reference}")
 
-            x = subprocess.run(
-                commands, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            if stage:
+                commands.append("--stage")
+
+            if ntasks > 1:
+                commands.append("--shard")
+
+            job_id = self.sbatch(commands)
+
+            job_ids.append(job_id)
+
+            mrich.success(
+                "Submitted place array job", job_id, f'"{job_name}"', f"[{array_range}]"
+            )
+
+        else:
+
+            manifest = open(manifest_path, "wt")
+
+            for i, csv_path in enumerate(csv_paths):
+
+                manifest.write(f"{csv_path.resolve()}\n")
+                manifest.flush()
+
+                if stagger and i > 0:
+                    with mrich.clock("Staggering job submission..."):
+                        time.sleep(stagger)
+
+                job_name = (
+                    f"BulkDock.place:{target}:{csv_path.name.removesuffix('.csv')}"
+                )
+
+                commands = place_commands(job_name)
+
+                commands += [
+                    template_script,
+                    "-m bulkdock.batch",
+                    "place",
+                    target,
+                    str(csv_path.resolve()),
+                ]
+
+                if reference:
+                    commands.append(f"--reference {reference}")
+
+                if stage:
+                    commands.append("--stage")
+
+                if ntasks > 1:
+                    commands.append("--shard")
+
+                job_id = self.sbatch(commands)
+
+                job_ids.append(job_id)
+
+                mrich.success("Submitted place job", job_id, f'"{job_name}"')
+
+            manifest.close()
+
+            mrich.writing(manifest_path)
+
+        mrich.var("job_ids", " ".join(str(i) for i in job_ids))
+
+        ### submit merge job to import staged poses after completion
+
+        if stage:
+
+            job_name = f"BulkDock.merge:{target}:{orig_path.name.removesuffix('.csv')}"
+
+            commands = [
+                "sbatch",
+                "--job-name",
+                job_name,
+                "--output=" f"{log_dir.resolve()}/%j.log",
+                "--error=" f"{log_dir.resolve()}/%j.log",
+                f"--dependency=afterany:{':'.join(str(i) for i in job_ids)}",
+            ]
+
+            if submit_args:
+                commands.append(submit_args)
+
+            commands += [
+                template_script,
+                "-m bulkdock.batch",
+                "merge",
+                target,
+                infile,
+            ]
+
+            job_id = self.sbatch(commands)
+
+            mrich.success("Submitted merge job", job_id, f'"{job_name}"')
+
+        ### submit combine job to run after completion
+
+        job_name = f"BulkDock.combine:{target}:{orig_path.name.removesuffix('.csv')}"
+
+        commands = [
+            "sbatch",
+            "--job-name",
+            job_name,
+            "--output=" f"{log_dir.resolve()}/%j.log",
+            "--error=" f"{log_dir.resolve()}/%j.log",
+            f"--dependency=afterany:{':'.join(str(i) for i in job_ids)}",
+        ]
+
+        if submit_args:
+            commands.append(submit_args)
+
+        if self.email_address and self.slurm_email_combine:
+            commands.append(f"--mail-user={self.email_address}")
+            commands.append(f"--mail-type={self.slurm_email_combine}")
+
+        commands += [
+            template_script,
+            "-m bulkdock.batch",
+            "combine",
+            infile,
+            f"--manifest {manifest_path.resolve()}",
+        ]
+
+        job_id = self.sbatch(commands)
+
+        mrich.success("Submitted combine job", job_id, f'"{job_name}"')
+
+    def heal(
+        self,
+        target: str,
+        infile: str,
+        reference: str | None = None,
+        stage: bool = False,
+        throttle: int | None = None,
+        dry_run: bool = False,
+    ) -> "DataFrame":
+        """Resubmit the batches of a placement run that did not finish and combine them again
+
+        A batch is finished once a job has recorded the end of its placements in the checkpoint ledger, no placement has failed without being quarantined, and its output SDF holds a record of every other placement in the batch. The other batches are resubmitted as a job array over a manifest of just those batches, each job skips the placements that are already in the ledger. A fresh combine job is chained after the array.
+
+        :param target: target of the placement run
+        :param infile: input file of the placement run
+        :param reference: reference pose alias that the run was submitted with
+        :param stage: the run was submitted with `--stage`, also chains a merge job
+        :param throttle: maximum number of array tasks running at once
+        :param dry_run: only report the state of the batches
+        :returns: DataFrame with one row per batch
+        """
+
+        mrich.h2("BulkDock.heal")
+        mrich.var("target", target)
+        mrich.var("infile", infile)
+        mrich.var("reference", reference)
+        mrich.var("stage", stage)
+
+        import os
+        from pandas import DataFrame
+        from .checkpoint import PlacementCheckpoint
+        from .io import count_csv_rows, count_sdf_records
+
+        target = Path(target).name
+
+        key = Path(infile).name.removesuffix(".csv")
+
+        manifest_path = self.get_manifest_path(target, infile)
+
+        assert manifest_path.exists(), f"No manifest for this run: {manifest_path}"
+
+        csv_paths = [
+            Path(line.strip()) for line in open(manifest_path, "rt") if line.strip()
+        ]
+
+        mrich.var("#batches", len(csv_paths))
+
+        # compare the batch inputs, outputs and ledgers
+
+        df = []
+
+        for csv_path in mrich.track(csv_paths, prefix="Checking batches"):
+
+            checkpoint = PlacementCheckpoint(
+                self.get_checkpoint_dir(target, csv_path), job_id="heal"
             )
 
-            if x.returncode != 0:
-                mrich.print(x.stdout)
-                mrich.print(x.stderr)
-                raise Exception(
-                    f"Could not submit slurm job with command: {' '.join(commands)}"
-                )            
+            outfile = checkpoint.outfile
+
+            rows = count_csv_rows(csv_path)
+            records = count_sdf_records(outfile) if outfile else 0
+
+            # recorded by the job that finished the batch, otherwise one per row with a reference
+            expected = checkpoint.placements
+
+            if expected is None and reference:
+                expected = rows
+
+            # a deleted or truncated output does not count as finished
+            if outfile and checkpoint.is_complete(records, expected):
+                state = "finished"
+            elif outfile or len(checkpoint):
+                state = "incomplete"
+            else:
+                state = "missing"
+
+            df.append(
+                dict(
+                    batch=csv_path.name,
+                    rows=rows,
+                    expected=expected,
+                    placed=len(checkpoint),
+                    records=records,
+                    failed=len(checkpoint.failed),
+                    quarantined=len(checkpoint.quarantined),
+                    jobs=len(set(checkpoint.job_ids)),
+                    state=state,
+                    csv_path=csv_path,
+                )
+            )
+
+        df = DataFrame(df)
+
+        mrich.print(df.drop(columns=["csv_path"]))
+
+        for state, count in df["state"].value_counts().items():
+            mrich.var(state, count)
+
+        unfinished = df[df["state"] != "finished"]
+
+        if unfinished.empty:
+            mrich.success("All batches have finished")
+            return df
+
+        if dry_run:
+            return df
+
+        ### SUBMIT SLURM JOBS
+
+        assert (
+            "SLURM_PYTHON_SCRIPT" in self.config
+        ), "variable SLURM_PYTHON_SCRIPT not configured"
+
+        template_script = self.config["SLURM_PYTHON_SCRIPT"]
+
+        try:
+            log_dir = Path(self.config["DIR_SLURM_LOGS"])
+        except KeyError:
+            log_dir = self.get_scratch_subdir("logs")
+
+        try:
+            submit_args = self.config["SLURM_SUBMIT_ARGS"]
+        except KeyError:
+            submit_args = ""
+
+        # change to bulkdock root directory
+        os.chdir(Path(__file__).parent.parent)
+
+        heal_manifest_path = manifest_path.with_name(f"{key}.heal.manifest")
+
+        with open(heal_manifest_path, "wt") as manifest:
+            for csv_path in unfinished["csv_path"]:
+                manifest.write(f"{csv_path.resolve()}\n")
+
+        mrich.writing(heal_manifest_path)
+
+        job_name = f"BulkDock.place:{target}:{key}"
+
+        array_range = f"0-{len(unfinished) - 1}"
+
+        if throttle:
+            array_range = f"{array_range}%{throttle}"
 
-            job_id = int(x.stdout.decode().strip().split()[-1])
-            
-            with open("sbatch.log", "ta") as file:
-                file.write(f"# {job_id}\n")
-                file.write(" ".join(commands))
-                file.write("\n")
+        commands = [
+            "sbatch",
+            "--job-name",
+            job_name,
+            "--output=" f"{log_dir.resolve()}/%j.log",
+            "--error=" f"{log_dir.resolve()}/%j.log",
+            f"--array={array_range}",
+        ]
+
+        if submit_args:
+            commands.append(submit_args)
+
+        if self.email_address and self.slurm_email_place:
+            commands.append(f"--mail-user={self.email_address}")
+            commands.append(f"--mail-type={self.slurm_email_place}")
+
+        commands += [
+            template_script,
+            "-m bulkdock.batch",
+            "place",
+            target,
+            str(heal_manifest_path.resolve()),
+            "--array",
+        ]
+
+        if reference:
+            commands.append(f"--reference {reference}")
+
+        if stage:
+            commands.append("--stage")
+
+        place_job_id = self.sbatch(commands)
+
+        mrich.success(
+            "Submitted place array job", place_job_id, f'"{job_name}"', f"[{array_range}]"
+        )
+
+        ### merge and combine after the resubmitted batches
+
+        if stage:
+            after_jobs = [("merge", [target, infile]), ("combine", [infile])]
+        else:
+            after_jobs = [("combine", [infile])]
+
+        for command, args in after_jobs:
+
+            job_name = f"BulkDock.{command}:{target}:{key}"
+
+            commands = [
+                "sbatch",
+                "--job-name",
+                job_name,
+                "--output=" f"{log_dir.resolve()}/%j.log",
+                "--error=" f"{log_dir.resolve()}/%j.log",
+                f"--dependency=afterany:{place_job_id}",
+            ]
+
+            if submit_args:
+                commands.append(submit_args)
 
-            job_ids.append(job_id)
+            if command == "combine" and self.email_address and self.slurm_email_combine:
+                commands.append(f"--mail-user={self.email_address}")
+                commands.append(f"--mail-type={self.slurm_email_combine}")
 
-            mrich.success("Submitted place job", job_id, f'"{job_name}"')
+            commands += [template_script, "-m bulkdock.batch", command, *args]
 
-        mrich.var("job_ids", " ".join(str(i) for i in job_ids))
+            if command == "combine":
+                commands.append(f"--manifest {manifest_path.resolve()}")
 
-        ### submit combine job to run after completion
+            job_id = self.sbatch(commands)
 
-        job_name = f"BulkDock.combine:{target}:{orig_path.name.removesuffix('.csv')}"
+            mrich.success(f"Submitted {command} job", job_id, f'"{job_name}"')
 
-        commands = [
-            "sbatch",
-            "--job-name",
-            job_name,
-            "--output=" f"{log_dir.resolve()}/%j.log",
-            "--error=" f"{log_dir.resolve()}/%j.log",
-            f"--dependency=afterany:{':'.join(str(i) for i in job_ids)}",
-        ]
+        return df
 
-        if submit_args:
-            commands.append(submit_args)
+    def sbatch(self, commands: list[str]) -> int:
+        """Submit a SLURM job and log the command to sbatch.log
 
-        if self.email_address and self.slurm_email_combine:
-            commands.append(f"--mail-user={self.email_address}")
-            commands.append(f"--mail-type={self.slurm_email_combine}")
+        :returns: the SLURM job ID
+        """
 
-        commands += [
-            template_script,
-            "-m bulkdock.batch",
-            "combine",
-            infile,
-        ]
+        import subprocess
 
         x = subprocess.run(
             commands, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE
@@ -329,16 +952,25 @@ class BulkDock:
                 f"Could not submit slurm job with command: {' '.join(commands)}"
             )
 
+        job_id = int(x.stdout.decode().strip().split()[-1])
+
         with open("sbatch.log", "ta") as file:
             file.write(f"# {job_id}\n")
             file.write(" ".join(commands))
             file.write("\n")
 
-        job_id = int(x.stdout.decode().strip().split()[-1])
-        mrich.success("Submitted combine job", job_id, f'"{job_name}"')
+        return job_id
 
     def place(
-        self, target: str, file: str, debug: bool = False, reference: str | None = None
+        self,
+        target: str,
+        file: str,
+        debug: bool = False,
+        reference: str | None = None,
+        n_workers: int | None = None,
+        checkpoint_every: int = 10,
+        stage: bool = False,
+        shard: bool = False,
     ):
 
         mrich.h3("BulkDock.place")
@@ -347,24 +979,40 @@ class BulkDock:
         mrich.var("file", file)
 
         import os
-        from .io import parse_input_csv
-        from .fstein import fragmenstein_place
+        import sys
+        import time
+        import signal
+        from .io import (
+            parse_input_csv,
+            count_sdf_records,
+            truncate_partial_sdf,
+            AppendSDWriter,
+            InspirationCache,
+        )
+        from rdkit.Chem import SDWriter
+        from .checkpoint import PlacementCheckpoint, placement_key
+        from .retry import PlacementQuarantine
+        from .telemetry import ProgressLog, LockWaitCounter, PlacementTelemetry
+        from .staging import StagingStore
+        from .shard import PlacementShard, find_partial_sdfs, merge_partial_sdfs
+        from .resultindex import write_result_index
+        from .proteins import get_protein_path, PACK_NAME
+        from .resultcache import (
+            PlacementResultCache,
+            placement_cache_key,
+            result_from_mol,
+            write_cached_result,
+        )
+        from .fstein import (
+            create_placement_task,
+            fragmenstein_place_concurrent,
+            recover_placement_result,
+        )
 
         csv_path = Path(file)
 
         assert csv_path.exists()
 
-        animal = self.get_animal(target)
-
-        assert animal, "Could not initialise hippo.HIPPO animal object"
-
-        data = parse_input_csv(
-            animal=animal,
-            file=csv_path,
-            debug=debug,
-            reference=reference,
-        )
-
         SLURM_JOB_ID = os.environ.get("SLURM_JOB_ID", None)
         mrich.var("SLURM_JOB_ID", SLURM_JOB_ID)
 
@@ -388,72 +1036,523 @@ class BulkDock:
 
         assert SLURM_JOB_ID
 
+        if not n_workers:
+            n_workers = int(SLURM_CPUS_PER_TASK or 1)
+
+        mrich.var("n_workers", n_workers)
+
         job_scratch_dir = self.get_scratch_subdir(SLURM_JOB_ID)
 
         mrich.var("job_scratch_dir", job_scratch_dir)
 
-        count = 0
+        key = csv_path.name.removesuffix(".csv")
+
+        # this task's share of the placements when run with srun
+        if shard:
+            shard = PlacementShard.from_env(job_scratch_dir, key)
+        else:
+            shard = PlacementShard(job_scratch_dir, key)
+
+        mrich.var("shard", shard)
 
-        outname = csv_path.name.replace(".csv", f"_{SLURM_JOB_ID}.sdf")
-        outfile = self.get_outfile_path(outname)
+        # resume from a previous job's checkpoint
 
-        writer = Chem.SDWriter(str(outfile.resolve()))
+        checkpoint = PlacementCheckpoint(
+            self.get_checkpoint_dir(target, csv_path),
+            job_id=SLURM_JOB_ID,
+            flush_every=checkpoint_every,
+            suffix=shard.suffix,
+        )
 
-        for i, d in enumerate(data):
+        outfile = checkpoint.outfile
 
-            mrich.h2(f"Placement task {i+1}/{len(data)}")
+        if outfile and checkpoint.is_complete(count_sdf_records(outfile)):
+            mrich.success("Batch has already been placed", outfile)
+            return outfile
 
-            compound = d["compound"]
-            reference = d["reference"]
-            inspirations = d["inspirations"]
+        # successes are taken from the outputs, in case they were truncated or deleted
+        checkpoint.forget_successes()
 
-            mrich.var("compound", compound)
-            mrich.var("reference", reference)
-            mrich.var("inspirations", inspirations.aliases)
+        # staged jobs only read from the HIPPO database
+        animal = self.get_animal(target, update_legacy=not stage and shard.is_root)
 
-            create_inspiration_sdf: bool = False
+        assert animal, "Could not initialise hippo.HIPPO animal object"
 
-            metadata = dict(
-                SLURM_JOB_ID=SLURM_JOB_ID,
-                SLURM_JOB_NAME=SLURM_JOB_NAME,
-                csv_name=csv_path.name,
-            )
+        if stage:
+            inchikeys_path = self.get_inchikeys_path(csv_path)
+            assert (
+                inchikeys_path.exists()
+            ), f"Compounds have not been registered: {inchikeys_path}"
+            inchikeys = json.load(open(inchikeys_path, "rt"))
+        else:
+            inchikeys = None
+
+        scratch_dirs = [job_scratch_dir] + [
+            self.scratch_dir / job_id
+            for job_id in checkpoint.job_ids
+            if job_id != SLURM_JOB_ID and (self.scratch_dir / job_id).exists()
+        ]
 
-            # create ref hits file
-            if create_inspiration_sdf:
-                ref_hits_path = self.create_inspiration_sdf(target, inspirations)
-                mrich.var("ref_hits_path", ref_hits_path)
+        if not shard.enabled:
 
-            # create protein file
-            protein_path = reference.path.replace("_hippo.pdb", ".pdb").replace(
-                ".pdb", "_apo-desolv.pdb"
-            )
-            mrich.var("protein_path", protein_path)
+            if outfile:
+                mrich.print("Resuming from", outfile)
+                truncate_partial_sdf(outfile)
+                checkpoint.scan_sdf(outfile)
+                writer = AppendSDWriter(outfile)
+
+            else:
+                outname = csv_path.name.replace(".csv", f"_{SLURM_JOB_ID}.sdf")
+                outfile = self.get_outfile_path(outname)
+                writer = SDWriter(str(outfile.resolve()))
+
+            checkpoint.start(outfile)
+
+        else:
+
+            if not outfile:
+                outname = csv_path.name.replace(".csv", f"_{SLURM_JOB_ID}.sdf")
+                outfile = self.get_outfile_path(outname)
+
+            # partial outputs of earlier sharded jobs that were not merged
+            partials = find_partial_sdfs(scratch_dirs, key)
+
+            # rank 0 prepares the outputs and registers the compounds once for all ranks
+            if shard.is_root:
+
+                try:
+                    for path in [outfile] + partials:
+                        if path.exists():
+                            truncate_partial_sdf(path)
 
-            result = fragmenstein_place(
+                    if inchikeys is None:
+                        from pandas import read_csv
+
+                        mrich.h1("Compound Registration")
+                        values = animal.register_compounds(
+                            smiles=read_csv(csv_path)["smiles"].values
+                        )
+                        inchikeys = [inchikey for inchikey, smiles in values]
+
+                except Exception as e:
+                    shard.mark_ready(error=repr(e))
+                    raise
+
+                checkpoint.start(outfile)
+                shard.mark_ready(inchikeys)
+
+            else:
+                inchikeys = shard.wait_ready()
+
+            for path in [outfile] + partials:
+                if path.exists():
+                    mrich.print("Resuming from", path)
+                    checkpoint.scan_sdf(path)
+
+            # placements of this rank are merged into the output by rank 0
+            if shard.partial_path.exists():
+                writer = AppendSDWriter(shard.partial_path)
+            else:
+                writer = SDWriter(str(shard.partial_path.resolve()))
+
+            mrich.var("partial output", shard.partial_path)
+
+        inspiration_cache = InspirationCache(animal)
+
+        # count database lock retries while HIPPO is being used
+        lock_waits = LockWaitCounter()
+
+        with lock_waits:
+            data = parse_input_csv(
                 animal=animal,
-                scratch_dir=job_scratch_dir,
-                compound=compound,
+                file=csv_path,
+                debug=debug,
                 reference=reference,
-                inspirations=inspirations,
-                protein_path=protein_path,
-                metadata=metadata,
+                cache=inspiration_cache,
+                inchikeys=inchikeys,
+            )
+
+        # recorded when the batch is finished, to check the output against
+        n_placements = len(
+            {
+                placement_key(d["compound"].id, d["reference"].id, d["inspirations"].ids)
+                for d in data
+            }
+        )
+
+        # all placements of a compound are made by the same rank
+        if shard.enabled:
+            data = shard.select(data, key=lambda d: d["compound"].id)
+            mrich.var("#placements in shard", len(data))
+
+        # placements that failed deterministically in any job for this target
+        quarantine = PlacementQuarantine(
+            self.get_scratch_subdir(f"{target}_quarantine"),
+            job_id=f"{SLURM_JOB_ID}{shard.suffix}",
+        )
+
+        retry_policy = self.retry_policy
+        mrich.var("retry_policy", retry_policy)
+
+        # flush results and checkpoint when SLURM terminates the job
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+        if stage:
+            staging = StagingStore(job_scratch_dir / f"staging{shard.suffix}.sqlite")
+            staging.set_meta(job_id=SLURM_JOB_ID, target=target, csv_name=csv_path.name)
+            mrich.var("staging", staging.path)
+        else:
+            staging = None
+
+        # prepared proteins, read from their PDB files if there is no pack
+        protein_pack_dir = self.get_protein_pack_dir(target)
+
+        if (protein_pack_dir / PACK_NAME).exists():
+            protein_pack = str(protein_pack_dir)
+        else:
+            mrich.warning("No protein pack, run 'pack-proteins' to build it")
+            protein_pack = None
+
+        mrich.var("protein_pack", protein_pack)
+
+        # results of identical placements from earlier runs, only read as every job would contend for it otherwise
+        result_cache_path = self.get_result_cache_path(target)
+
+        if result_cache_path.exists():
+            result_cache = PlacementResultCache(result_cache_path, readonly=True)
+        else:
+            result_cache = None
+
+        # new results are merged into the target's cache when the next run is submitted
+        job_result_cache = PlacementResultCache(
+            self.get_job_result_cache_path(SLURM_JOB_ID, target, suffix=shard.suffix)
+        )
+
+        # queue the placement tasks
+
+        tasks = []
+        queued_keys = set()
+        skipped = 0
+        quarantined = 0
+        duplicates = 0
+        cached = 0
+        recovered = 0
+
+        with lock_waits:
+
+            for d in mrich.track(data, prefix="Preparing placement tasks"):
+
+                compound = d["compound"]
+                reference = d["reference"]
+                inspirations = d["inspirations"]
+
+                task_key = placement_key(compound.id, reference.id, inspirations.ids)
+
+                if task_key in checkpoint:
+                    skipped += 1
+                    continue
+
+                if task_key in quarantine:
+                    checkpoint.record(task_key, False, quarantined=True)
+                    quarantined += 1
+                    continue
+
+                cache_key = placement_cache_key(
+                    d["smiles"], reference.id, inspirations.ids
+                )
+
+                if cache_key in queued_keys:
+                    duplicates += 1
+                    continue
+
+                mol = result_cache.get(cache_key) if result_cache else None
+
+                if mol is not None:
+
+                    write_cached_result(
+                        mol,
+                        writer,
+                        name=f"{compound}-{reference}-{task_key[2]}",
+                        compound_id=compound.id,
+                        reference_id=reference.id,
+                        inspiration_ids=inspirations.ids,
+                    )
+
+                    if staging:
+                        staging.add_pose(
+                            task=dict(
+                                compound_id=compound.id,
+                                reference_id=reference.id,
+                                inspiration_ids=str(inspirations.ids),
+                            ),
+                            result=result_from_mol(mol),
+                            path=mol.GetProp("path"),
+                            metadata=dict(SLURM_JOB_ID=SLURM_JOB_ID, csv_name=csv_path.name),
+                        )
+
+                    checkpoint.record(task_key, True)
+                    queued_keys.add(cache_key)
+                    cached += 1
+                    continue
+
+                task_start = time.perf_counter()
+
+                create_inspiration_sdf: bool = False
+
+                # create ref hits file
+                if create_inspiration_sdf:
+                    ref_hits_path = self.create_inspiration_sdf(target, inspirations)
+                    mrich.var("ref_hits_path", ref_hits_path)
+
+                # create protein file
+                protein_path = get_protein_path(reference.path)
+
+                task = create_placement_task(
+                    compound=compound,
+                    reference=reference,
+                    inspirations=inspirations,
+                    protein_path=protein_path,
+                    hits=inspiration_cache.get_mols(inspirations),
+                )
+
+                task["db_time"] = time.perf_counter() - task_start
+                task["cache_key"] = cache_key
+                task["protein_pack"] = protein_pack
+
+                if recover_placement_result(
+                    task, scratch_dirs=scratch_dirs, writer=writer
+                ):
+                    checkpoint.record(task_key, True)
+                    recovered += 1
+                    continue
+
+                tasks.append(task)
+                queued_keys.add(cache_key)
+
+        mrich.var("skipped (checkpointed)", skipped)
+        mrich.var("skipped (quarantined)", quarantined)
+        mrich.var("skipped (duplicates)", duplicates)
+        mrich.var("emitted from result cache", cached)
+        mrich.var("recovered from scratch", recovered)
+
+        mrich.var("database lock retries", lock_waits.count)
+
+        # group tasks by protein conformation
+        tasks = sorted(tasks, key=lambda t: t["protein_path"])
+
+        progress = ProgressLog(self.get_progress_path(SLURM_JOB_ID, suffix=shard.suffix))
+
+        telemetry = PlacementTelemetry(
+            self.get_telemetry_dir(target) / f"{key}_{SLURM_JOB_ID}{shard.suffix}",
+            job_id=SLURM_JOB_ID,
+        )
+
+        progress.start(
+            total=len(tasks),
+            csv_name=csv_path.name,
+            outfile=str(outfile),
+            n_workers=n_workers,
+            skipped=skipped,
+            skipped_quarantined=quarantined,
+            duplicates=duplicates,
+            cached=cached,
+            recovered=recovered,
+            lock_waits=lock_waits.count,
+        )
+
+        summary = None
+
+        try:
+            summary = fragmenstein_place_concurrent(
+                tasks=tasks,
+                scratch_dir=job_scratch_dir,
                 writer=writer,
+                n_workers=n_workers,
+                retry_policy=retry_policy,
+                quarantine=quarantine,
+                checkpoint=checkpoint,
+                progress=progress,
+                lock_waits=lock_waits.count,
+                staging=staging,
+                telemetry=telemetry,
+                result_cache=job_result_cache,
+                metadata=dict(
+                    SLURM_JOB_ID=SLURM_JOB_ID,
+                    SLURM_JOB_NAME=SLURM_JOB_NAME,
+                    csv_name=csv_path.name,
+                ),
+            )
+
+        finally:
+            checkpoint.flush(writer)
+            writer.close()
+
+            if staging:
+                staging.close()
+
+            if result_cache:
+                result_cache.close()
+
+            job_result_cache.close()
+
+            telemetry.write()
+
+            # release rank 0 even if this rank failed
+            if shard.enabled and summary is None:
+                shard.mark_done(count=0, success=False)
+
+        progress.end(total=len(tasks), **summary)
+
+        count = summary["count"] + recovered + cached
+
+        if summary["quarantined"]:
+            mrich.var("newly quarantined", summary["quarantined"])
+
+        lab_cache_lookups = summary["lab_cache_hits"] + summary["lab_cache_misses"]
+        if lab_cache_lookups:
+            mrich.var(
+                "Laboratory cache hit rate",
+                f"{summary['lab_cache_hits'] / lab_cache_lookups * 100:.1f} % ({summary['lab_cache_hits']}/{lab_cache_lookups})",
             )
 
-            if result:
-                count += 1
+        if shard.enabled:
 
-        writer.close()
+            shard.mark_done(count=count, success=True)
+
+            # the output is merged and returned by rank 0
+            if not shard.is_root:
+                mrich.success(f"Rank {shard.rank} determined {count} poses")
+                return None
+
+            markers = shard.wait_done()
+
+            count = sum(marker["count"] for marker in markers)
+
+            partials += [
+                path
+                for path in map(shard.get_partial_path, range(shard.n_tasks))
+                if path not in partials
+            ]
+
+            n_records = merge_partial_sdfs(outfile, partials)
+
+            mrich.var("#records in output", n_records)
+
+        # columnar copy of the output's properties
+        if outfile.exists():
+            write_result_index(outfile)
+
+        checkpoint.finish(placements=n_placements)
+
+        # placements of earlier jobs on this batch
+        n_records = count_sdf_records(outfile) if outfile.exists() else 0
 
         if count:
-            mrich.h1(f"Determined {len(poses)} Poses\n{outfile}")
+            mrich.h1(f"Determined {count} Poses\n{outfile}")
+            return outfile
+
+        elif n_records:
+            mrich.success(f"No new poses, {n_records} in", outfile)
             return outfile
 
         else:
             mrich.error(f"Determined 0 Poses")
             return None
 
+    def register_compounds(self, target: str, manifest: str) -> None:
+        """Register the compounds of every batch in a manifest ahead of staged placement jobs
+
+        The InChIKeys of each batch are written next to its CSV so that the placement jobs can resolve the compounds without writing to the database.
+        """
+
+        mrich.h3("BulkDock.register_compounds")
+
+        mrich.var("target", target)
+        mrich.var("manifest", manifest)
+
+        from pandas import read_csv
+
+        animal = self.get_animal(target)
+
+        assert animal, "Could not initialise hippo.HIPPO animal object"
+
+        csv_paths = [Path(line.strip()) for line in open(manifest, "rt") if line.strip()]
+
+        for csv_path in mrich.track(csv_paths, prefix="Registering compounds"):
+
+            df = read_csv(csv_path)
+
+            # one bulk registration per batch
+            values = animal.register_compounds(smiles=df["smiles"].values)
+
+            inchikeys_path = self.get_inchikeys_path(csv_path)
+            mrich.writing(inchikeys_path)
+            json.dump([inchikey for inchikey, smiles in values], open(inchikeys_path, "wt"))
+
+        mrich.success("Registered compounds for", len(csv_paths), "batches")
+
+    def merge_staged_poses(self, target: str, infile: str) -> int:
+        """Register the poses from the staging stores of a placement run into the HIPPO database"""
+
+        mrich.h3("BulkDock.merge_staged_poses")
+
+        mrich.var("target", target)
+        mrich.var("infile", infile)
+
+        from .staging import find_staging_stores, merge_staging_stores
+        from .jobindex import PoseJobIndex
+
+        animal = self.get_animal(target)
+
+        assert animal, "Could not initialise hippo.HIPPO animal object"
+
+        key = Path(infile).name.removesuffix(".csv")
+
+        paths = find_staging_stores(self.scratch_dir, key)
+
+        mrich.var("#staging stores", len(paths))
+
+        index = PoseJobIndex(self.get_pose_job_index_path(target))
+
+        count = merge_staging_stores(animal, paths, index=index)
+
+        index.close()
+
+        mrich.success("Merged", count, "poses into", animal)
+
+        return count
+
+    def report(self, target: str, infile: str, top: int = 10) -> "DataFrame":
+        """Summarise the per-placement telemetry of a placement run"""
+
+        mrich.h3("BulkDock.report")
+
+        mrich.var("target", target)
+        mrich.var("infile", infile)
+
+        from .telemetry import find_telemetry_tables, load_telemetry_tables, report_telemetry
+
+        key = Path(infile).name.removesuffix(".csv")
+
+        paths = find_telemetry_tables(self.get_telemetry_dir(target), key)
+
+        mrich.var("#telemetry tables", len(paths))
+
+        df = load_telemetry_tables(paths)
+
+        report_telemetry(df, top=top)
+
+        # scores of the combined output, without parsing the SDF
+        combined_path = self.output_dir / f"{key}_combined.sdf"
+
+        if combined_path.exists():
+
+            from .resultindex import get_result_index, report_results
+
+            report_results(get_result_index(combined_path), top=top)
+
+        return df
+
     def create_inspiration_sdf(self, target: str, inspirations: "PoseSet") -> "Path":
 
         subdir = self.get_scratch_subdir(f"{target}_inspiration_sdfs")
@@ -530,75 +1629,62 @@ class BulkDock:
         if not animal:
             return
 
-        # get pose IDs from SDF file
-
-        import subprocess
-
-        command = f'grep "RDKit          3D" -B1 {inpath.resolve()} --no-group-separator | grep -v "RDKit"'
+        # get pose IDs and threshold the properties from the SDF file
 
-        process = subprocess.run([command], shell=True, stdout=subprocess.PIPE)
+        from .filters import prefilter_sdf_properties
 
-        pose_ids = set(int(i.strip()) for i in process.stdout.decode().split("\n") if i)
+        pose_ids, passed_ids, unknown_ids = prefilter_sdf_properties(
+            inpath,
+            max_energy_score=max_energy_score,
+            max_distance_score=max_distance_score,
+            require_outcome=require_outcome,
+        )
 
         mrich.debug("pose_ids=", pose_ids)
 
         mrich.var("#pose_ids", len(pose_ids))
 
-        poses = animal.poses[pose_ids]
-
-        mrich.var("unfiltered poses", poses)
-
         if max_energy_score or max_distance_score or require_outcome:
 
-            new_pose_ids = set()
+            if not passed_ids and not unknown_ids:
+                mrich.error("No poses left after applying filters")
+                return None
 
-            for i, pose in mrich.track(
-                enumerate(poses), prefix="Filtering poses", total=len(poses)
-            ):
+            new_pose_ids = set(passed_ids)
 
-                mrich.set_progress_field("progress", f"{i+1}/{len(poses)}")
-                mrich.set_progress_field("ok", len(new_pose_ids))
+            # only poses without usable SDF properties are checked in the database
+            if unknown_ids:
 
-                if max_energy_score and pose.energy_score > max_energy_score:
-                    if debug:
-                        mrich.debug(
-                            f"Filtered out {pose} due to {pose.energy_score=:.3f} > {max_energy_score}:"
-                        )
-                    continue
+                poses = animal.poses[unknown_ids]
 
-                if max_distance_score and pose.distance_score > max_distance_score:
-                    if debug:
-                        mrich.debug(
-                            f"Filtered out {pose} due to {pose.distance_score=:.3f} > {max_distance_score}:"
-                        )
-                    continue
+                for i, pose in mrich.track(
+                    enumerate(poses), prefix="Checking poses", total=len(poses)
+                ):
 
-                outcome = pose.metadata["fragmenstein_outcome"]
-                if isinstance(outcome, list):
-                    outcome = outcome[0]
-                # .removeprefix("['").removesuffix("']")
+                    mrich.set_progress_field("progress", f"{i+1}/{len(poses)}")
 
-                if require_outcome and outcome != require_outcome:
-                    if debug:
-                        mrich.debug(
-                            f"Filtered out {pose} due to fragmenstein_outcome={outcome} != {require_outcome}:"
-                        )
-                    continue
+                    if self.pose_passes_thresholds(
+                        pose,
+                        max_energy_score=max_energy_score,
+                        max_distance_score=max_distance_score,
+                        require_outcome=require_outcome,
+                        debug=debug,
+                    ):
+                        new_pose_ids.add(pose.id)
+
+            mrich.var("#pre-filtered poses", len(new_pose_ids))
 
-                if pose_filter_methods:
-                    for filter_method in pose_filter_methods:
-                        func = getattr(pose, filter_method)
-                        passed = func(debug=debug)
-                        if not passed:
-                            if debug:
-                                mrich.debug(
-                                    f"Filtered out {pose} due to {filter_method}:"
-                                )
-                            continue
+            if new_pose_ids and pose_filter_methods:
 
-                mrich.success(pose, "OK")
+                from .filters import run_pose_filters
 
-                new_pose_ids.add(pose.id)
+                new_pose_ids = run_pose_filters(
+                    animal_name=f"{target}_bulkdock",
+                    animal_path=self.get_animal_path(target),
+                    pose_ids=new_pose_ids,
+                    filter_methods=pose_filter_methods,
+                    debug=debug,
+                )
 
             if not new_pose_ids:
                 mrich.error("No poses left after applying filters")
@@ -606,6 +1692,10 @@ class BulkDock:
 
             poses = animal.poses[new_pose_ids]
 
+        else:
+
+            poses = animal.poses[pose_ids]
+
         mrich.var("filtered poses", poses)
 
         if output:
@@ -648,6 +1738,45 @@ class BulkDock:
         else:
             mrich.success(f"Created Fragalysis-compatible SDF")
 
+    def pose_passes_thresholds(
+        self,
+        pose: "Pose",
+        *,
+        max_energy_score: float | None = None,
+        max_distance_score: float | None = None,
+        require_outcome: str | None = None,
+        debug: bool = False,
+    ) -> bool:
+        """Check the score and outcome thresholds against the database values of a pose"""
+
+        if max_energy_score and pose.energy_score > max_energy_score:
+            if debug:
+                mrich.debug(
+                    f"Filtered out {pose} due to {pose.energy_score=:.3f} > {max_energy_score}:"
+                )
+            return False
+
+        if max_distance_score and pose.distance_score > max_distance_score:
+            if debug:
+                mrich.debug(
+                    f"Filtered out {pose} due to {pose.distance_score=:.3f} > {max_distance_score}:"
+                )
+            return False
+
+        outcome = pose.metadata["fragmenstein_outcome"]
+        if isinstance(outcome, list):
+            outcome = outcome[0]
+        # .removeprefix("['").removesuffix("']")
+
+        if require_outcome and outcome != require_outcome:
+            if debug:
+                mrich.debug(
+                    f"Filtered out {pose} due to fragmenstein_outcome={outcome} != {require_outcome}:"
+                )
+            return False
+
+        return True
+
     ### CONFIG
 
     def load_config(self):
@@ -721,6 +1850,50 @@ class BulkDock:
 
         return outfile_path
 
+    def get_checkpoint_dir(self, target: str, csv_path: Path) -> Path:
+        """Directory of the checkpoint ledgers of an input batch"""
+        return self.get_scratch_subdir(f"{Path(target).name}_checkpoints") / Path(
+            csv_path
+        ).name.removesuffix(".csv")
+
+    def get_manifest_path(self, target: str, infile: str) -> Path:
+        """Path of the list of batch inputs for a placement run"""
+        key = Path(infile).name.removesuffix(".csv")
+        return self.get_scratch_subdir(f"{Path(target).name}_inputs") / f"{key}.manifest"
+
+    def get_queue_path(self, target: str, infile: str) -> Path:
+        """Path of the shared queue of batch inputs for a placement run"""
+        key = Path(infile).name.removesuffix(".csv")
+        return self.get_scratch_subdir(f"{Path(target).name}_inputs") / f"{key}.queue.sqlite"
+
+    def get_inchikeys_path(self, csv_path: Path) -> Path:
+        """Path of the InChIKeys of a batch input written by :meth:`register_compounds`"""
+        return csv_path.with_name(csv_path.name.removesuffix(".csv") + ".inchikeys.json")
+
+    def get_progress_path(self, job_id: str, suffix: str = "") -> Path:
+        """Path of the JSON-lines progress sidecar of a placement job, or of one of its sharded tasks"""
+        return self.scratch_dir / str(job_id) / f"progress{suffix}.jsonl"
+
+    def get_telemetry_dir(self, target: str) -> Path:
+        """Directory of the per-placement telemetry tables of a target"""
+        return self.get_scratch_subdir(f"{Path(target).name}_telemetry")
+
+    def get_protein_pack_dir(self, target: str) -> Path:
+        """Directory of the protein pack of a target"""
+        return self.get_scratch_subdir(f"{Path(target).name}_proteins")
+
+    def get_result_cache_path(self, target: str) -> Path:
+        """Path of the placement result cache of a target"""
+        return self.scratch_dir / f"{Path(target).name}_result_cache.sqlite"
+
+    def get_job_result_cache_path(self, job_id: str, target: str, suffix: str = "") -> Path:
+        """Path of the result cache that a placement job adds its results to"""
+        return self.scratch_dir / str(job_id) / f"{Path(target).name}_result_cache{suffix}.sqlite"
+
+    def get_pose_job_index_path(self, target: str) -> Path:
+        """Path of the sidecar index from SLURM job IDs to pose IDs"""
+        return self.scratch_dir / f"{Path(target).name}_pose_job_index.sqlite"
+
     def get_animal_path(self, target: str) -> Path:
 
         assert (
@@ -788,3 +1961,42 @@ class BulkDock:
         subdir = self.scratch_dir / subdir_name
         subdir.mkdir(exist_ok=True)
         return subdir
+
+
+def resolve_config_dir(value: str) -> Path:
+    """Resolve a configured directory, relative paths are relative to the package"""
+
+    path = Path(value)
+
+    if path.is_absolute():
+        return path
+
+    return (Path(__file__).parent / value).resolve()
+
+
+def read_config_dir(variable: str) -> Path:
+    """Read a directory from the config file without creating the engine, e.g. for commands that only need the scratch directory
+
+    :param variable: config variable, e.g. `DIR_SCRATCH`
+    """
+
+    if CONFIG_PATH.exists():
+        config = json.load(open(CONFIG_PATH, "rt"))
+    else:
+        from .config import DEFAULTS as config
+
+    return resolve_config_dir(config[variable])
+
+
+_ENGINE = None
+
+
+def get_engine() -> BulkDock:
+    """The `BulkDock` engine shared by the CLI commands, created on first use"""
+
+    global _ENGINE
+
+    if _ENGINE is None:
+        _ENGINE = BulkDock()
+
+    return _ENGINE
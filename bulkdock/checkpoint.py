@@ -0,0 +1,278 @@
+import mrich
+import re
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+
+class PlacementCheckpoint:
+    """Ledger of completed (compound, reference, inspirations) placements for a single input batch
+
+    Every job that works on the batch appends to its own JSON-lines file in the checkpoint directory, the union of all of them is the set of completed placements. Only successful and quarantined placements count as completed, other failures are placed again when the batch is resumed.
+
+    :param directory: checkpoint directory for this batch
+    :param job_id: SLURM job ID of the current job
+    :param flush_every: number of recorded placements between flushes
+    :param suffix: suffix of this job's ledger, e.g. the rank of a sharded task
+    """
+
+    def __init__(
+        self, directory: "Path", job_id: str, flush_every: int = 10, suffix: str = ""
+    ):
+
+        self._directory = Path(directory)
+        self._directory.mkdir(exist_ok=True, parents=True)
+
+        self._job_id = str(job_id)
+        self._suffix = suffix
+        self._flush_every = flush_every
+
+        self._completed = set()
+        self._failed = set()
+        self._quarantined = set()
+        self._finished = False
+        self._placements = None
+        self._job_ids = []
+        self._outfiles = []
+        self._pending = []
+
+        self.load()
+
+    ### PROPERTIES
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def ledger_path(self) -> Path:
+        return self.directory / f"{self._job_id}{self._suffix}.jsonl"
+
+    @property
+    def completed(self) -> set[tuple[int, int, str]]:
+        return self._completed
+
+    @property
+    def failed(self) -> set[tuple[int, int, str]]:
+        """Placements that failed without being quarantined and have not succeeded since"""
+        return self._failed
+
+    @property
+    def quarantined(self) -> set[tuple[int, int, str]]:
+        return self._quarantined
+
+    @property
+    def finished(self) -> bool:
+        """True if a job has placed the whole batch"""
+        return self._finished
+
+    @property
+    def placements(self) -> int | None:
+        """Number of placements in the batch, recorded by the job that finished it"""
+        return self._placements
+
+    @property
+    def job_ids(self) -> list[str]:
+        """Job IDs which have previously worked on this batch"""
+        return self._job_ids
+
+    @property
+    def outfile(self) -> Path | None:
+        """Most recent output SDF recorded in the ledger that still exists"""
+        for outfile in reversed(self._outfiles):
+            if outfile.exists():
+                return outfile
+        return None
+
+    @property
+    def due(self) -> bool:
+        return len(self._pending) >= self._flush_every
+
+    ### METHODS
+
+    def load(self) -> None:
+
+        for path in sorted(self.directory.glob("*.jsonl")):
+
+            with open(path, "rt") as f:
+                for line in f:
+
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # partially written line from a killed job
+                        continue
+
+                    if "finished" in entry:
+                        self._finished = True
+                        self._placements = entry.get("placements", self._placements)
+                    elif "outfile" in entry:
+                        self._job_ids.append(str(entry["job_id"]))
+                        self._outfiles.append(Path(entry["outfile"]))
+                    else:
+                        key = (
+                            int(entry["compound_id"]),
+                            int(entry["reference_id"]),
+                            entry.get("inspirations", ""),
+                        )
+                        if entry.get("success", True) or entry.get("quarantined"):
+                            self._completed.add(key)
+                        else:
+                            self._failed.add(key)
+                        if entry.get("quarantined"):
+                            self._quarantined.add(key)
+
+        self._failed -= self._completed
+
+        if self._completed:
+            mrich.var("checkpointed placements", len(self._completed))
+
+    def scan_sdf(self, path: "Path") -> int:
+        """Add placements present in an existing output SDF
+
+        :returns: number of records found
+        """
+
+        from .io import iter_sdf_properties
+
+        count = 0
+
+        for record in iter_sdf_properties(
+            path, ["compound_id", "reference_id", "inspiration_ids"]
+        ):
+            try:
+                key = placement_key(
+                    record["compound_id"],
+                    record["reference_id"],
+                    record["inspiration_ids"],
+                )
+            except (KeyError, ValueError):
+                continue
+            self._completed.add(key)
+            count += 1
+
+        mrich.var(f"records in {path.name}", count)
+
+        return count
+
+    def forget_successes(self) -> None:
+        """Forget the successful placements in the ledger, so that they are taken from the output SDFs with :meth:`scan_sdf`
+
+        The output SDF is flushed before the ledger, so it only differs if it was truncated or deleted since.
+        """
+        self._completed = set(self._quarantined)
+
+    def is_complete(self, n_records: int, expected: int | None = None) -> bool:
+        """True if a job has finished the batch, none of its placements are left to retry and its output accounts for every placement that was not quarantined
+
+        Used both to skip finished batches in place jobs and to decide which batches `heal` resubmits.
+
+        :param n_records: number of records in the output SDF
+        :param expected: number of placements in the batch, defaults to the number recorded by the job that finished it
+        """
+
+        # failures are placed again when the batch is resumed
+        if not self._finished or self._failed:
+            return False
+
+        if expected is None:
+            expected = self._placements
+
+        if expected is None:
+            return True
+
+        return n_records + len(self._quarantined) >= expected
+
+    def start(self, outfile: "Path") -> None:
+        """Record the output file of the current job"""
+        self._write([dict(job_id=self._job_id, outfile=str(outfile.resolve()))])
+
+    def finish(self, placements: int | None = None) -> None:
+        """Record that the current job has placed the whole batch
+
+        :param placements: number of distinct placements in the batch, see :func:`placement_key`
+        """
+        self._write([dict(job_id=self._job_id, finished=True, placements=placements)])
+
+    def record(
+        self, key: tuple[int, int, str], success: bool, quarantined: bool = False
+    ) -> None:
+        """Record a finished placement
+
+        :param key: key of the placement, see :func:`placement_key`
+        """
+
+        if success or quarantined:
+            self._completed.add(key)
+            self._failed.discard(key)
+        else:
+            self._failed.add(key)
+
+        if quarantined:
+            self._quarantined.add(key)
+
+        self._pending.append(
+            dict(
+                compound_id=key[0],
+                reference_id=key[1],
+                inspirations=key[2],
+                success=success,
+                quarantined=quarantined,
+            )
+        )
+
+    def flush(self, writer: "SDWriter | None" = None) -> None:
+        """Flush the SDF writer and then the pending ledger entries"""
+
+        if writer:
+            writer.flush()
+
+        if self._pending:
+            self._write(self._pending)
+            self._pending = []
+
+    def _write(self, entries: list[dict]) -> None:
+        with open(self.ledger_path, "at") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+
+    def __contains__(self, key: tuple[int, int, str]) -> bool:
+        return key in self._completed
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+
+def clear_checkpoint(directory: "Path") -> None:
+    """Delete the checkpoint ledgers of a batch, so that the next job starts it afresh"""
+
+    directory = Path(directory)
+
+    if not directory.exists():
+        return
+
+    mrich.warning("Clearing checkpoint of an earlier submission", directory)
+    shutil.rmtree(directory)
+
+
+def placement_key(
+    compound_id: int, reference_id: int, inspiration_ids: "list[int] | str"
+) -> tuple[int, int, str]:
+    """Key of a placement in the checkpoint ledgers and the quarantine
+
+    The same compound can be placed against the same reference with different inspirations, so they are part of the key as a short hash.
+
+    :param inspiration_ids: IDs of the inspiration poses, or their string representation as in the output SDFs
+    """
+
+    if isinstance(inspiration_ids, str):
+        inspiration_ids = re.findall(r"\d+", inspiration_ids)
+
+    content = ",".join(str(i) for i in sorted(int(i) for i in inspiration_ids))
+
+    return (
+        int(compound_id),
+        int(reference_id),
+        hashlib.sha1(content.encode()).hexdigest()[:8],
+    )
@@ -13,6 +13,10 @@ VARIABLES = [
     "EMAIL_ADDRESS",
     "SLURM_EMAIL_PLACE",
     "SLURM_EMAIL_COMBINE",
+    "PLACE_RETRIES",
+    "PLACE_TIMEOUT",
+    "PLACE_TIMEOUT_FACTOR",
+    "PLACE_MAX_TIMEOUTS",
 ]
 
 DEFAULTS = {
@@ -24,3 +28,12 @@ DEFAULTS = {
     "SLURM_EMAIL_PLACE": "FAIL,REQUEUE,INVALID_DEPEND",
     "SLURM_EMAIL_COMBINE": "END,FAIL,INVALID_DEPEND,REQUEUE",
 }
+
+# Fragmenstein settings used for placements, part of the result cache key
+FRAGMENSTEIN_SETTINGS = {
+    "monster_joining_cutoff": 5,  # Å
+    "monster_throw_on_discard": True,
+    "quick_reanimation": False,
+    "covalent_resi": None,
+    "run_plip": False,
+}
@@ -0,0 +1,254 @@
+import mrich
+
+
+def prefilter_sdf_properties(
+    path: "Path",
+    *,
+    max_energy_score: float | None = None,
+    max_distance_score: float | None = None,
+    require_outcome: str | None = None,
+) -> "tuple[set[int], set[int], set[int]]":
+    """Apply the score and outcome thresholds to the properties of an SDF in a single streaming pass
+
+    Record names must be pose IDs. Records with a missing or unparseable property that is needed for a threshold can not be decided here and need to be checked against the database.
+
+    :param path: SDF file to read
+    :param max_energy_score: maximum `energy_score`
+    :param max_distance_score: maximum `distance_score`
+    :param require_outcome: required `fragmenstein_outcome`
+    :returns: tuple of all pose IDs, pose IDs that passed the thresholds and pose IDs that need a database check
+    """
+
+    import numpy as np
+    from .resultindex import load_result_index
+
+    index = load_result_index(path)
+
+    if index is not None:
+        mrich.print("Reading properties from the results index")
+        ids, energy_scores, distance_scores, outcomes = _read_index_properties(index)
+    else:
+        ids, energy_scores, distance_scores, outcomes = _read_sdf_properties(path)
+
+    ids = np.array(ids, dtype=np.int64)
+    energy_scores = np.array(energy_scores, dtype=np.float64)
+    distance_scores = np.array(distance_scores, dtype=np.float64)
+    outcomes = np.array(outcomes, dtype=object)
+
+    failed = np.zeros(len(ids), dtype=bool)
+    unknown = np.zeros(len(ids), dtype=bool)
+
+    if max_energy_score:
+        missing = np.isnan(energy_scores)
+        failed |= ~missing & (energy_scores > max_energy_score)
+        unknown |= missing
+
+    if max_distance_score:
+        missing = np.isnan(distance_scores)
+        failed |= ~missing & (distance_scores > max_distance_score)
+        unknown |= missing
+
+    if require_outcome:
+        missing = np.equal(outcomes, None)
+        failed |= ~missing & (outcomes != require_outcome)
+        unknown |= missing
+
+    unknown &= ~failed
+
+    mrich.var("#records", len(ids))
+    mrich.var("#failed thresholds", int(failed.sum()))
+    mrich.var("#undecided", int(unknown.sum()))
+
+    return (
+        set(ids.tolist()),
+        set(ids[~failed & ~unknown].tolist()),
+        set(ids[unknown].tolist()),
+    )
+
+
+def _read_sdf_properties(path: "Path") -> tuple[list, list, list, list]:
+    """Pose IDs, scores and outcomes streamed from the SDF"""
+
+    from .io import iter_sdf_properties
+
+    properties = ["energy_score", "distance_score", "fragmenstein_outcome"]
+
+    ids = []
+    energy_scores = []
+    distance_scores = []
+    outcomes = []
+
+    skipped = 0
+
+    for record in iter_sdf_properties(path, properties):
+
+        try:
+            ids.append(int(record["_Name"]))
+        except ValueError:
+            skipped += 1
+            continue
+
+        energy_scores.append(_to_float(record.get("energy_score")))
+        distance_scores.append(_to_float(record.get("distance_score")))
+        outcomes.append(_to_outcome(record.get("fragmenstein_outcome")))
+
+    if skipped:
+        mrich.warning(f"Ignored {skipped} records without a pose ID name")
+
+    return ids, energy_scores, distance_scores, outcomes
+
+
+def _read_index_properties(df: "DataFrame") -> tuple[list, list, list, list]:
+    """Pose IDs, scores and outcomes from the columns of a results index"""
+
+    from pandas import to_numeric, isna
+
+    ids = to_numeric(df["name"], errors="coerce")
+
+    skipped = int(ids.isna().sum())
+
+    if skipped:
+        mrich.warning(f"Ignored {skipped} records without a pose ID name")
+
+    df = df[ids.notna()]
+
+    return (
+        ids.dropna().astype("int64").tolist(),
+        df["energy_score"].astype("float64").tolist(),
+        df["distance_score"].astype("float64").tolist(),
+        [
+            None if isna(value) else _to_outcome(value)
+            for value in df["fragmenstein_outcome"].astype(object)
+        ],
+    )
+
+
+def _to_float(value: str | None) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _to_outcome(value: str | None) -> str | None:
+    if value is None or value == "N/A":
+        return None
+    return value.removeprefix("['").removesuffix("']")
+
+
+def run_pose_filters(
+    *,
+    animal_name: str,
+    animal_path: "Path",
+    pose_ids: "set[int]",
+    filter_methods: list[str],
+    n_workers: int | None = None,
+    chunk_size: int = 50,
+    debug: bool = False,
+) -> "set[int]":
+    """Run `Pose` filter methods (e.g. posebusters) across a pool of worker processes
+
+    Each worker opens its own connection to the HIPPO database and processes chunks of pose IDs.
+
+    :param animal_name: name of the `HIPPO` object
+    :param animal_path: path to the HIPPO database
+    :param pose_ids: IDs of the poses to filter
+    :param filter_methods: names of `Pose` methods that return True if the pose passed
+    :param n_workers: number of worker processes, defaults to `SLURM_CPUS_PER_TASK` or the number of CPUs
+    :param chunk_size: number of poses sent to a worker at a time
+    :returns: IDs of the poses that passed all the filters
+    """
+
+    import os
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if not n_workers:
+        n_workers = int(os.environ.get("SLURM_CPUS_PER_TASK", 0) or os.cpu_count())
+
+    pose_ids = sorted(pose_ids)
+
+    chunks = [
+        pose_ids[i : i + chunk_size] for i in range(0, len(pose_ids), chunk_size)
+    ]
+
+    mrich.var("filter_methods", filter_methods)
+    mrich.var("n_workers", n_workers)
+    mrich.var("#chunks", len(chunks))
+
+    passed_ids = set()
+    timings = {method: 0.0 for method in filter_methods}
+    failures = {method: 0 for method in filter_methods}
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_pose_filter_worker,
+        initargs=(animal_name, str(animal_path)),
+    ) as pool:
+
+        futures = [
+            pool.submit(_filter_pose_chunk, chunk, filter_methods, debug)
+            for chunk in chunks
+        ]
+
+        for future in mrich.track(
+            as_completed(futures), prefix="Filtering poses", total=len(futures)
+        ):
+
+            passed, chunk_timings, chunk_failures = future.result()
+
+            passed_ids.update(passed)
+
+            for method in filter_methods:
+                timings[method] += chunk_timings[method]
+                failures[method] += chunk_failures[method]
+
+            mrich.set_progress_field("ok", len(passed_ids))
+
+    for method in filter_methods:
+        mrich.var(
+            f"{method}",
+            f"{failures[method]} failed, {timings[method]:.1f} s total ({timings[method] / max(1, len(pose_ids)):.2f} s/pose)",
+        )
+
+    return passed_ids
+
+
+_ANIMAL = None
+
+
+def _init_pose_filter_worker(animal_name: str, animal_path: str) -> None:
+
+    import hippo
+
+    global _ANIMAL
+    _ANIMAL = hippo.HIPPO(animal_name, animal_path, update_legacy=False)
+
+
+def _filter_pose_chunk(
+    pose_ids: list[int], filter_methods: list[str], debug: bool
+) -> "tuple[list[int], dict[str, float], dict[str, int]]":
+
+    import time
+
+    passed_ids = []
+    timings = {method: 0.0 for method in filter_methods}
+    failures = {method: 0 for method in filter_methods}
+
+    for pose in _ANIMAL.poses[pose_ids]:
+
+        for filter_method in filter_methods:
+
+            start = time.perf_counter()
+            passed = getattr(pose, filter_method)(debug=debug)
+            timings[filter_method] += time.perf_counter() - start
+
+            if not passed:
+                if debug:
+                    mrich.debug(f"Filtered out {pose} due to {filter_method}:")
+                failures[filter_method] += 1
+                break
+
+        else:
+            passed_ids.append(pose.id)
+
+    return passed_ids, timings, failures
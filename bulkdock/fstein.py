@@ -1,4 +1,6 @@
 import mrich
+import time
+import signal
 import logging
 from pathlib import Path
 
@@ -8,10 +10,18 @@ from fragmenstein import Wictor, Laboratory  # , Igor
 mrich.debug("from fragmenstein.laboratory.validator import place_input_validator")
 from fragmenstein.laboratory.validator import place_input_validator
 
+from collections import OrderedDict
 from pandas import DataFrame
 from .io import mols_to_sdf
+from .retry import RetryPolicy, is_timeout
+from .checkpoint import placement_key
+from .config import FRAGMENSTEIN_SETTINGS
+from .proteins import read_pdbblock
 from rdkit import Chem
 
+# result fields that are sent back from placement workers
+RESULT_KEYS = ["name", "error", "mode", "∆∆G", "comRMSD", "runtime", "outcome", "min_binary"]
+
 
 def fragmenstein_place(
     *,
@@ -31,19 +41,284 @@ def fragmenstein_place(
 
     metadata = metadata or {}
 
+    task = create_placement_task(
+        compound=compound,
+        reference=reference,
+        inspirations=inspirations,
+        protein_path=protein_path,
+    )
+
+    result = run_placement_task(
+        task,
+        scratch_dir=scratch_dir,
+        n_cores=n_cores,
+        n_retries=n_retries,
+        timeout=timeout,
+        write_hit_mols=write_hit_mols,
+    )
+
+    return write_placement_result(
+        task, result, scratch_dir=scratch_dir, writer=writer
+    )
+
+
+def fragmenstein_place_concurrent(
+    *,
+    tasks: list[dict],
+    scratch_dir: "Path",
+    writer: "SDWriter",
+    n_workers: int = 1,
+    n_retries: int = 3,
+    timeout: int = 300,
+    write_hit_mols: bool = True,
+    lab_cache_size: int = 8,
+    retry_policy: "RetryPolicy | None" = None,
+    quarantine: "PlacementQuarantine | None" = None,
+    checkpoint: "PlacementCheckpoint | None" = None,
+    progress: "ProgressLog | None" = None,
+    lock_waits: int = 0,
+    staging: "StagingStore | None" = None,
+    telemetry: "PlacementTelemetry | None" = None,
+    result_cache: "PlacementResultCache | None" = None,
+    metadata: dict | None = None,
+) -> dict:
+    """Run placement tasks across a pool of worker processes
+
+    Each worker runs a single-row placement at a time, results are written to the shared `SDWriter` by this process as soon as they finish.
+
+    :param tasks: list of picklable placement tasks, see :func:`create_placement_task`
+    :param scratch_dir: job scratch directory
+    :param writer: `SDWriter` to write successful placements to
+    :param n_workers: number of worker processes, if less than two the tasks are run in this process
+    :param lab_cache_size: maximum number of `Laboratory` objects cached by each process
+    :param retry_policy: optional :class:`.RetryPolicy`, otherwise `n_retries` attempts with a fixed `timeout`
+    :param quarantine: optional :class:`.PlacementQuarantine` to record deterministic failures in
+    :param checkpoint: optional :class:`.PlacementCheckpoint` to record finished placements in
+    :param progress: optional :class:`.ProgressLog` sidecar to record each placement in
+    :param lock_waits: number of database lock retries so far, recorded in the progress sidecar
+    :param staging: optional :class:`.StagingStore` to stage successful placements in for a later merge into the HIPPO database
+    :param telemetry: optional :class:`.PlacementTelemetry` table to record the stage timings of each placement in
+    :param result_cache: optional :class:`.PlacementResultCache` to add successful placements to
+    :param metadata: pose metadata recorded in the staging store
+    :returns: summary dictionary with the number of successful and quarantined placements and `Laboratory` cache statistics
+    """
+
+    summary = dict(count=0, quarantined=0, lab_cache_hits=0, lab_cache_misses=0)
+
+    kwargs = dict(
+        scratch_dir=scratch_dir,
+        n_cores=1,
+        n_retries=n_retries,
+        timeout=timeout,
+        write_hit_mols=write_hit_mols,
+        lab_cache_size=lab_cache_size,
+        retry_policy=retry_policy,
+    )
+
+    # closed here rather than by the garbage collector, so that an exit does not wait for the pool
+    results = iter_placement_results(tasks, n_workers=n_workers, **kwargs)
+
+    try:
+
+        for i, (task, result) in enumerate(results):
+
+            mrich.h2(f"Placement task {i+1}/{len(tasks)}")
+
+            mrich.var("name", task["name"])
+            mrich.var("protein_path", task["protein_path"])
+
+            if result and result["lab_cache_hit"]:
+                summary["lab_cache_hits"] += 1
+            elif result:
+                summary["lab_cache_misses"] += 1
+
+            write_start = time.perf_counter()
+
+            success = write_placement_result(
+                task,
+                result,
+                scratch_dir=scratch_dir,
+                writer=writer,
+                result_cache=result_cache,
+            )
+
+            quarantined = False
+
+            if success:
+                summary["count"] += 1
+
+            elif quarantine is not None and result and result.get("quarantine"):
+                quarantine.add(task, result)
+                summary["quarantined"] += 1
+                quarantined = True
+
+            if success and staging is not None:
+                name = task["name"]
+                staging.add_pose(
+                    task=task,
+                    result=result,
+                    path=scratch_dir / name / f"{name}.minimised.mol",
+                    metadata=metadata,
+                )
+
+            if telemetry is not None:
+                telemetry.add(
+                    task=task,
+                    result=result,
+                    success=success,
+                    write_time=time.perf_counter() - write_start,
+                )
+
+            if progress is not None:
+                progress.task(
+                    index=i + 1,
+                    total=len(tasks),
+                    task=task,
+                    result=result,
+                    success=success,
+                    lock_waits=lock_waits,
+                )
+
+            if checkpoint is not None:
+                checkpoint.record(
+                    placement_key(
+                        task["compound_id"], task["reference_id"], task["inspiration_ids"]
+                    ),
+                    success,
+                    quarantined=quarantined,
+                )
+                if checkpoint.due:
+                    checkpoint.flush(writer)
+
+            if telemetry is not None and telemetry.due:
+                telemetry.write()
+
+    finally:
+        results.close()
+
+    return summary
+
+
+def iter_placement_results(tasks: list[dict], n_workers: int = 1, **kwargs):
+    """Yield (task, result) tuples in order of completion"""
+
+    if n_workers < 2:
+        for task in tasks:
+            yield task, run_placement_task(task, **kwargs)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    mrich.var("n_workers", n_workers)
+
+    pool = ProcessPoolExecutor(max_workers=n_workers, initializer=init_placement_worker)
+
+    try:
+
+        futures = {
+            pool.submit(run_placement_task, task, **kwargs): task for task in tasks
+        }
+
+        for future in as_completed(futures):
+
+            task = futures.pop(future)
+
+            try:
+                result = future.result()
+            except Exception as e:
+                mrich.error(f"Placement worker failed for {task['name']}: {e}")
+                result = None
+
+            yield task, result
+
+    except BaseException:
+        # e.g. the SystemExit of a SIGTERM, the queued placements are dropped so that the job can flush its outputs
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    pool.shutdown()
+
+
+def init_placement_worker() -> None:
+    """Restore the default SIGTERM handling in worker processes, which would otherwise inherit the handler of the place job"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def create_placement_task(
+    *,
+    compound: "Compound",
+    reference: "Pose",
+    inspirations: "PoseSet",
+    protein_path: "Path",
+    hits: "list[Chem.Mol] | None" = None,
+) -> dict:
+    """Extract everything a placement worker needs from the HIPPO objects
+
+    :param hits: pre-loaded inspiration molecules, otherwise loaded from the `PoseSet`
+    """
+
+    if hits is None:
+        hits = [pose.mol for pose in inspirations]
+
+    # the same compound and reference can be placed with different inspirations
+    key = placement_key(compound.id, reference.id, inspirations.ids)
+
+    return dict(
+        name=f"{compound}-{reference}-{key[2]}",
+        smiles=compound.smiles,
+        hits=hits,
+        protein_path=str(protein_path),
+        compound_id=compound.id,
+        reference_id=reference.id,
+        inspiration_ids=str(inspirations.ids),
+    )
+
+
+def run_placement_task(
+    task: dict,
+    *,
+    scratch_dir: "Path",
+    n_cores: int = 1,
+    n_retries: int = 3,
+    timeout: int = 300,
+    write_hit_mols: bool = True,
+    lab_cache_size: int = 8,
+    retry_policy: "RetryPolicy | None" = None,
+) -> dict:
+    """Run a Fragmenstein placement, safe to call from a worker process
+
+    :param retry_policy: :class:`.RetryPolicy` deciding on retries and timeouts, defaults to `n_retries` attempts with a fixed `timeout`
+    :returns: dictionary of placement result fields and run statistics, which only contains the statistics if the placement gave a null result
+    """
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy(
+            n_retries=n_retries,
+            timeout=timeout,
+            min_timeout=timeout,
+            max_timeout=timeout,
+            max_timeouts=n_retries,
+        )
+
+    setup_start = time.perf_counter()
+
     # set up lab
-    laboratory = setup_wictor_laboratory(
-        scratch_dir=scratch_dir, protein_path=protein_path
+    LAB_CACHE.maxsize = lab_cache_size
+    laboratory, lab_cache_hit = LAB_CACHE.get(
+        scratch_dir=scratch_dir,
+        protein_path=task["protein_path"],
+        reference_id=task["reference_id"],
+        protein_pack=task.get("protein_pack"),
     )
 
     # create inputs
-    queries = create_fragmenstein_queries_df(
-        compound=compound, reference=reference, inspirations=inspirations
-    )
+    queries = create_fragmenstein_queries_df(task)
 
     # validate inputs
     queries = place_input_validator(queries)
 
+    setup_time = time.perf_counter() - setup_start
+
     name = queries.at[0, "name"]
     smiles = queries.at[0, "smiles"]
     subdir = scratch_dir / name
@@ -53,15 +328,22 @@ def fragmenstein_place(
     mrich.var("smiles", smiles)
     mrich.var("scratch_dir", scratch_dir)
     mrich.var("subdir", subdir)
-    mrich.var("protein_path", protein_path)
+    mrich.var("protein_path", task["protein_path"])
+
+    result = None
+    attempts = 0
+    timeouts = 0
+    start = time.perf_counter()
+
+    for attempt in range(retry_policy.n_retries):
 
-    for attempt in range(n_retries):
+        attempts += 1
 
-        # run the placement
+        # run the placement, Fragmenstein minimises as part of this
         result = laboratory.place(
             queries,
             n_cores=n_cores,
-            timeout=timeout,
+            timeout=retry_policy.get_timeout(attempt),
         )
 
         # process outputs
@@ -74,10 +356,17 @@ def fragmenstein_place(
 
         result = result.iloc[0].to_dict()
 
-        if result["outcome"] == "crashed" and result["error"] == "TimeoutError":
+        if is_timeout(result):
             mrich.error("Placement timed out")
+            timeouts += 1
+
+        if retry_policy.should_retry(result, timeouts):
+            mrich.warning(f"Retrying placement ({result['error']})")
             continue
 
+        if is_timeout(result):
+            break
+
         mrich.h3("Placement Result")
 
         mrich.var("name", result.get("name", "N/A"))
@@ -94,19 +383,53 @@ def fragmenstein_place(
 
         break
 
-    ## into HIPPO database
+    place_time = time.perf_counter() - start
+
+    # lookup, validation and every attempt of the placement
+    wall_time = time.perf_counter() - setup_start
+
+    stats = dict(
+        lab_cache_hit=lab_cache_hit,
+        attempts=attempts,
+        timeouts=timeouts,
+        quarantine=retry_policy.is_deterministic_failure(result),
+        setup_time=setup_time,
+        place_time=place_time,
+        wall_time=wall_time,
+    )
+
+    if result is None:
+        return stats
+
+    result = {k: result[k] for k in RESULT_KEYS if k in result}
+    result.update(stats)
+
+    return result
+
+
+def write_placement_result(
+    task: dict,
+    result: dict | None,
+    *,
+    scratch_dir: "Path",
+    writer: "SDWriter",
+    result_cache: "PlacementResultCache | None" = None,
+) -> bool:
+    """Write a successful placement to the SDF, and to the result cache if the task has a `cache_key`"""
 
+    name = task["name"]
+    subdir = scratch_dir / name
     mol_path = subdir / f"{name}.minimised.mol"
 
-    if mol_path.exists():
+    if result and "min_binary" in result and mol_path.exists():
 
         mol = Chem.Mol(result["min_binary"])
 
         mol.SetProp("_Name", name)
-        mol.SetProp("compound_id", str(compound.id))
+        mol.SetProp("compound_id", str(task["compound_id"]))
         mol.SetProp("target_id", str(1))
-        mol.SetProp("reference_id", str(reference.id))
-        mol.SetProp("inspiration_ids", str(inspirations.ids))
+        mol.SetProp("reference_id", str(task["reference_id"]))
+        mol.SetProp("inspiration_ids", task["inspiration_ids"])
         mol.SetProp("energy_score", str(result.get("∆∆G", "N/A")))
         mol.SetProp("distance_score", str(result.get("comRMSD", "N/A")))
         mol.SetProp("path", str(mol_path))
@@ -120,6 +443,9 @@ def fragmenstein_place(
 
         mrich.success(f"Wrote data to SDF")
 
+        if result_cache is not None and task.get("cache_key"):
+            result_cache.add(task["cache_key"], mol)
+
         return True
 
     else:
@@ -129,23 +455,142 @@ def fragmenstein_place(
         return False
 
 
+class LaboratoryCache:
+    """Per-process LRU cache of Fragmenstein `Laboratory` objects keyed by protein path"""
+
+    def __init__(self, maxsize: int = 8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._labs = OrderedDict()
+        self._scratch_dir = None
+
+    def __len__(self):
+        return len(self._labs)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(
+        self,
+        *,
+        scratch_dir: "Path",
+        protein_path: "Path",
+        reference_id: int | None = None,
+        protein_pack: str | None = None,
+    ) -> "tuple[Laboratory, bool]":
+        """Get a `Laboratory` for this protein, building it if needed
+
+        :param reference_id: ID of the reference pose, to look the protein up in the pack
+        :param protein_pack: directory of a :class:`.ProteinPack` to read the protein from instead of its PDB file
+        :returns: the `Laboratory` and whether it was a cache hit
+        """
+
+        scratch_dir = Path(scratch_dir)
+
+        # Wictor configuration is class-level, only redo it for a new scratch directory
+        if scratch_dir != self._scratch_dir:
+            self.clear()
+            setup_wictor(scratch_dir=scratch_dir)
+            self._scratch_dir = scratch_dir
+
+        key = str(protein_path)
+
+        if key in self._labs:
+            self.hits += 1
+            self._labs.move_to_end(key)
+            return self._labs[key], True
+
+        self.misses += 1
+
+        pdbblock = read_pdbblock(
+            str(protein_path), reference_id=reference_id, protein_pack=protein_pack
+        )
+
+        lab = create_laboratory(protein_path=protein_path, pdbblock=pdbblock)
+
+        self._labs[key] = lab
+
+        while len(self._labs) > self.maxsize:
+            self._labs.popitem(last=False)
+
+        return lab, False
+
+    def clear(self):
+        self._labs.clear()
+        self._scratch_dir = None
+
+
+LAB_CACHE = LaboratoryCache()
+
+
+def recover_placement_result(
+    task: dict,
+    *,
+    scratch_dirs: "list[Path]",
+    writer: "SDWriter",
+) -> bool:
+    """Write a minimised placement left in a scratch directory by an interrupted job"""
+
+    name = task["name"]
+
+    for scratch_dir in scratch_dirs:
+
+        mol_path = scratch_dir / name / f"{name}.minimised.mol"
+
+        if not mol_path.exists():
+            continue
+
+        mol = Chem.MolFromMolFile(str(mol_path), removeHs=False)
+
+        if mol is None:
+            continue
+
+        mrich.print(f"Recovered {name} from {mol_path}")
+
+        return write_placement_result(
+            task,
+            dict(min_binary=mol.ToBinary()),
+            scratch_dir=scratch_dir,
+            writer=writer,
+        )
+
+    return False
+
+
 # from syndirella.slipper.SlipperFitter.setup_Fragmenstein
 def setup_wictor_laboratory(
     *,
     scratch_dir: "Path",
     protein_path: "Path",
-    monster_joining_cutoff: float = 5,  # Å
+    monster_joining_cutoff: float = FRAGMENSTEIN_SETTINGS["monster_joining_cutoff"],
 ) -> "Laboratory":
 
+    setup_wictor(scratch_dir=scratch_dir, monster_joining_cutoff=monster_joining_cutoff)
+
+    return create_laboratory(protein_path=protein_path)
+
+
+def setup_wictor(
+    *,
+    scratch_dir: "Path",
+    monster_joining_cutoff: float = FRAGMENSTEIN_SETTINGS["monster_joining_cutoff"],
+) -> None:
+
     # from fragmenstein import Laboratory, Wictor, Igor
     assert Path(scratch_dir).exists(), f"{scratch_dir=} does not exist"
-    assert Path(protein_path).exists(), f"{protein_path=} does not exist"
 
     # set up Wictor
     Wictor.work_path = scratch_dir
-    Wictor.monster_throw_on_discard = True  # stop if fragment unusable
+    Wictor.monster_throw_on_discard = FRAGMENSTEIN_SETTINGS[
+        "monster_throw_on_discard"
+    ]  # stop if fragment unusable
     Wictor.monster_joining_cutoff = monster_joining_cutoff
-    Wictor.quick_reanimation = False  # for the impatient
+    Wictor.quick_reanimation = FRAGMENSTEIN_SETTINGS[
+        "quick_reanimation"
+    ]  # for the impatient
     Wictor.error_to_catch = Exception  # stop the whole laboratory otherwise
     Wictor.enable_stdout(logging.CRITICAL)
     Wictor.enable_logfile(scratch_dir / f"fragmenstein.log", logging.DEBUG)
@@ -156,24 +601,29 @@ def setup_wictor_laboratory(
 
     # Igor.init_pyrosetta() # needed?
 
-    with open(protein_path) as fh:
-        pdbblock: str = fh.read()
 
-    lab = Laboratory(pdbblock=pdbblock, covalent_resi=None, run_plip=False)
+def create_laboratory(*, protein_path: "Path", pdbblock: str | None = None) -> "Laboratory":
+
+    if pdbblock is None:
+        pdbblock = read_pdbblock(str(protein_path))
+
+    lab = Laboratory(
+        pdbblock=pdbblock,
+        covalent_resi=FRAGMENSTEIN_SETTINGS["covalent_resi"],
+        run_plip=FRAGMENSTEIN_SETTINGS["run_plip"],
+    )
 
     return lab
 
 
-def create_fragmenstein_queries_df(
-    *, compound: "Compound", reference: "Pose", inspirations: "PoseSet"
-):
+def create_fragmenstein_queries_df(task: dict):
 
     return DataFrame(
         [
             {
-                "name": f"{compound}-{reference}",
-                "smiles": compound.smiles,
-                "hits": [pose.mol for pose in inspirations],
+                "name": task["name"],
+                "smiles": task["smiles"],
+                "hits": task["hits"],
             }
         ]
     )
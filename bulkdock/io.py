@@ -1,37 +1,322 @@
+import re
 import mrich
 
 
 def split_input_csv(in_path: "Path", split: int, out_dir: "Path") -> "list[Path]":
 
+    return list(iter_split_input_csv(in_path, split=split, out_dir=out_dir))
+
+
+def iter_split_input_csv(in_path: "Path", split: int, out_dir: "Path"):
+    """Stream an input CSV into batches of `split` rows, yielding each batch's path as soon as it has been written
+
+    Only one row is held in memory at a time, so the memory use does not depend on the size of the input.
+
+    :param in_path: input CSV
+    :param split: number of rows per batch
+    :param out_dir: directory to write the batch CSVs to
+    :returns: generator of batch CSV paths
+    """
+
     mrich.h3("bulkdock.io.split_input_csv()")
     mrich.var("input", in_path)
     mrich.var("output", out_dir)
     mrich.var("batch size", split)
 
-    from pandas import read_csv
+    import csv
 
-    # read dataframe from CSV
-    df = read_csv(in_path)
+    stem = in_path.name.removesuffix(".csv")
+
+    n_rows = 0
+    n_batches = 0
+
+    out_file = None
+
+    with open(in_path, "rt", newline="") as f:
+
+        reader = csv.reader(f)
+        header = next(reader)
+
+        try:
+            for row in reader:
+
+                # skip blank lines
+                if not row:
+                    continue
+
+                if n_rows % split == 0:
+
+                    if out_file:
+                        out_file.close()
+                        yield out_path
+
+                    out_path = out_dir / f"{stem}_split{split}_batch{n_batches:03}.csv"
+                    mrich.writing(out_path)
+
+                    out_file = open(out_path, "wt", newline="")
+                    writer = csv.writer(out_file)
+                    writer.writerow(header)
+
+                    n_batches += 1
+
+                writer.writerow(row)
+                n_rows += 1
+
+        finally:
+            if out_file:
+                out_file.close()
+
+    if out_file:
+        yield out_path
 
-    mrich.var("#compounds", len(df))
+    mrich.var("#compounds", n_rows)
+    mrich.var("#batches", n_batches)
 
-    dfs = [df[i : i + split] for i in range(0, df.shape[0], split)]
 
-    mrich.var("#batches", len(dfs))
+# relative cost model for balanced splitting
+COST_PER_HEAVY_ATOM = 1.0
+COST_PER_ROTATABLE_BOND = 2.0
+COST_PER_EXTRA_HIT = 0.5
+DEFAULT_LIGAND_COST = 30.0
 
-    paths = []
+# bracket atoms and atoms of the organic subset in a SMILES string
+SMILES_ATOM_PATTERN = re.compile(r"\[[^\]]*\]|Br|Cl|[BCNOPSFIbcnops]")
 
-    for i, df in enumerate(dfs):
+# explicit hydrogens, e.g. [H], [2H] or [H+] but not [Hg]
+SMILES_HYDROGEN_PATTERN = re.compile(r"^\[\d*H[^a-z]*\]$")
 
-        out_file = in_path.name.removesuffix(".csv") + f"_split{split}_batch{i:03}.csv"
+# atoms, ring bond numbers, bond symbols and branches
+SMILES_TOKEN_PATTERN = re.compile(
+    r"(\[[^\]]*\]|Br|Cl|[BCNOPSFIbcnops])|(%\d\d|\d)|([-=#$:/\\.])|([()])"
+)
 
-        out_path = out_dir / out_file
 
-        mrich.writing(out_path)
-        df.to_csv(out_path, index=False)
-        paths.append(out_path)
+def count_smiles_heavy_atoms(smiles: str) -> int:
+    """Count the heavy atoms of a SMILES string without parsing the molecule"""
+    return sum(
+        1
+        for atom in SMILES_ATOM_PATTERN.findall(smiles)
+        if not SMILES_HYDROGEN_PATTERN.match(atom)
+    )
+
+
+def count_smiles_rotatable_bonds(smiles: str) -> int:
+    """Count the rotatable bonds of a SMILES string without parsing the molecule
+
+    This is a proxy for RDKit's count: single bonds outside rings between heavy atoms that are bonded to at least one other heavy atom each. The bonds of the SMILES chain and its branches form a spanning tree of the molecule, so a bond is in a ring if it is on the path between the two atoms of a ring closure.
+    """
+
+    heavy = []  # True for heavy atoms
+    parents = []  # previous atom in the chain, which is bonded to the atom in the tree
+    single = []  # True if the tree bond to the parent is a single bond
+    degrees = []  # number of bonded heavy atoms
+    closures = []
+    rings = {}
+    branches = []
+    previous = None
+    symbol = ""
+
+    for atom, ring, bond, branch in SMILES_TOKEN_PATTERN.findall(smiles):
+
+        if atom:
+            index = len(heavy)
+            is_heavy = atom[0] != "[" or not SMILES_HYDROGEN_PATTERN.match(atom)
+            heavy.append(is_heavy)
+            parents.append(previous)
+            single.append(symbol in "-/\\")
+            degrees.append(0)
+            if previous is not None and is_heavy and heavy[previous]:
+                degrees[index] += 1
+                degrees[previous] += 1
+            previous, symbol = index, ""
+
+        elif ring:
+            if ring in rings:
+                other = rings.pop(ring)
+                closures.append((other, previous))
+                if heavy[other] and heavy[previous]:
+                    degrees[other] += 1
+                    degrees[previous] += 1
+            else:
+                rings[ring] = previous
+            symbol = ""
+
+        elif bond == ".":
+            previous, symbol = None, ""
+
+        elif bond:
+            symbol = bond
+
+        elif branch == "(":
+            branches.append(previous)
+
+        elif branches:
+            previous = branches.pop()
+
+    # parents come before their children, so the path to the common ancestor is walked from the later atom
+    for i, j in closures:
+        while i != j and i is not None and j is not None:
+            if i < j:
+                i, j = j, i
+            single[i] = False
+            i = parents[i]
+
+    return sum(
+        1
+        for i, j in enumerate(parents)
+        if j is not None and single[i] and degrees[i] > 1 and degrees[j] > 1
+    )
+
+
+def estimate_row_cost(smiles: str, n_inspirations: int, reference: bool = False) -> float:
+    """Estimate the relative placement cost of an input row
+
+    Each placement grows with the size of the ligand and with the number of hits that are merged. In ensemble mode a row is placed once against each of its inspirations.
+
+    The heavy atoms and rotatable bonds are counted from the SMILES string, as parsing every row with RDKit takes minutes for libraries of millions of rows on the submitting node.
+
+    :param smiles: SMILES of the compound
+    :param n_inspirations: number of inspiration hits
+    :param reference: True if every row is placed once against a single reference
+    """
+
+    n_heavy_atoms = count_smiles_heavy_atoms(smiles)
+
+    if n_heavy_atoms:
+        ligand_cost = (
+            COST_PER_HEAVY_ATOM * n_heavy_atoms
+            + COST_PER_ROTATABLE_BOND * count_smiles_rotatable_bonds(smiles)
+        )
+    else:
+        ligand_cost = DEFAULT_LIGAND_COST
+
+    n_inspirations = max(1, n_inspirations)
+
+    placement_cost = ligand_cost * (1 + COST_PER_EXTRA_HIT * (n_inspirations - 1))
+
+    if reference:
+        return placement_cost
+
+    return n_inspirations * placement_cost
+
+
+def iter_balanced_split_input_csv(
+    in_path: "Path", split: int, out_dir: "Path", reference: bool = False
+):
+    """Stream an input CSV into batches of roughly equal expected runtime, yielding each batch's path as soon as it has been written
+
+    The number of batches and their names are the same as for :func:`iter_split_input_csv`, but rows are assigned so that each contiguous batch gets an equal share of the total estimated cost (see :func:`estimate_row_cost`). The input is read twice, and only the per-row costs are kept in memory.
+
+    :param in_path: input CSV
+    :param split: average number of rows per batch
+    :param out_dir: directory to write the batch CSVs to
+    :param reference: True if every row is placed once against a single reference
+    :returns: generator of batch CSV paths
+    """
+
+    mrich.h3("bulkdock.io.iter_balanced_split_input_csv()")
+    mrich.var("input", in_path)
+    mrich.var("output", out_dir)
+    mrich.var("batch size", split)
+
+    import csv
+    from math import ceil
+    from array import array
 
-    return paths
+    stem = in_path.name.removesuffix(".csv")
+
+    # first pass: estimate the cost of each row
+
+    costs = array("d")
+
+    with open(in_path, "rt", newline="") as f:
+
+        reader = csv.reader(f)
+        next(reader)
+
+        for row in mrich.track(reader, prefix="Estimating costs"):
+
+            # skip blank lines
+            if not row:
+                continue
+
+            n_inspirations = sum(1 for value in row[1:] if value)
+            costs.append(estimate_row_cost(row[0], n_inspirations, reference=reference))
+
+    n_rows = len(costs)
+    n_batches = ceil(n_rows / split)
+
+    if not n_batches:
+        return
+
+    total = sum(costs)
+    target = total / n_batches
+
+    mrich.var("#compounds", n_rows)
+    mrich.var("#batches", n_batches)
+    mrich.var("total cost", f"{total:.0f}")
+    mrich.var("cost per batch", f"{target:.0f}")
+
+    # second pass: write contiguous batches of equal cost
+
+    with open(in_path, "rt", newline="") as f:
+
+        reader = csv.reader(f)
+        header = next(reader)
+
+        batch = 0
+        cumulative = 0.0
+        batch_rows = 0
+        batch_cost = 0.0
+        r = 0
+
+        out_path = out_dir / f"{stem}_split{split}_batch{batch:03}.csv"
+        out_file = open(out_path, "wt", newline="")
+        writer = csv.writer(out_file)
+        writer.writerow(header)
+
+        try:
+            for row in reader:
+
+                if not row:
+                    continue
+
+                writer.writerow(row)
+
+                cumulative += costs[r]
+                batch_cost += costs[r]
+                batch_rows += 1
+                r += 1
+
+                if batch == n_batches - 1:
+                    continue
+
+                # close the batch at its share of the cost, leaving at least one row per remaining batch
+                if (
+                    cumulative >= (batch + 1) * target
+                    or n_rows - r == n_batches - batch - 1
+                ):
+
+                    out_file.close()
+                    mrich.writing(out_path)
+                    mrich.var("rows, cost", f"{batch_rows}, {batch_cost:.0f}")
+                    yield out_path
+
+                    batch += 1
+                    batch_rows = 0
+                    batch_cost = 0.0
+
+                    out_path = out_dir / f"{stem}_split{split}_batch{batch:03}.csv"
+                    out_file = open(out_path, "wt", newline="")
+                    writer = csv.writer(out_file)
+                    writer.writerow(header)
+
+        finally:
+            out_file.close()
+
+    mrich.writing(out_path)
+    mrich.var("rows, cost", f"{batch_rows}, {batch_cost:.0f}")
+    yield out_path
 
 
 def parse_input_csv(
@@ -39,6 +324,8 @@ def parse_input_csv(
     file: "Path",
     debug: bool = False,
     reference: str | None = None,
+    cache: "InspirationCache | None" = None,
+    inchikeys: "list[str] | None" = None,
 ) -> list[dict]:
     """
     Parse a BulkDock input CSV to prepare for an ensemble docking run where a compound is placed against each protein conformation from its inspirations.
@@ -46,11 +333,15 @@ def parse_input_csv(
     :param animal: `HIPPO` object to work within
     :param file: `Path` object to the input CSV
     :param debug: Increase verbosity of CLI output
-    :returns: a list of dictionaries containing HIPPO objects:
+    :param reference: alias of the reference pose, if not given an ensemble of placements is prepared
+    :param cache: optional :class:`InspirationCache` to share with the placement stage
+    :param inchikeys: InChIKeys of the rows if the compounds have already been registered, which avoids writing to the database
+    :returns: a list of dictionaries containing HIPPO objects and the input SMILES:
 
     compound: Compound
     reference: Pose
     inspirations: PoseSet
+    smiles: str
 
     """
 
@@ -61,22 +352,32 @@ def parse_input_csv(
 
     assert "smiles" in df.columns
 
-    mrich.h1("Compound Registration")
-    values = animal.register_compounds(smiles=df["smiles"].values)
+    if inchikeys is None:
+        mrich.h1("Compound Registration")
+        values = animal.register_compounds(smiles=df["smiles"].values)
 
-    inchikeys = [inchikey for inchikey, smiles in values]
+        inchikeys = [inchikey for inchikey, smiles in values]
+
+    assert len(inchikeys) == len(df), "InChIKeys do not match the input rows"
+
+    compounds = get_compounds_by_inchikey(animal, inchikeys)
+
+    if cache is None:
+        cache = InspirationCache(animal)
 
     data = []
 
     mrich.h1("Placements")
 
-    for (i, row), inchikey in zip(df.iterrows(), inchikeys):
+    rows = zip(
+        df["smiles"].to_numpy(),
+        df.iloc[:, 1:].to_numpy(dtype=object),
+        inchikeys,
+    )
 
-        # extract row values
-        smiles = row.smiles
-        inspirations = row.values[1:]
+    for i, (smiles, inspirations, inchikey) in enumerate(rows):
 
-        compound = animal.db.get_compound(inchikey=inchikey)
+        compound = compounds.get(inchikey)
         assert compound
 
         # debug output
@@ -87,16 +388,18 @@ def parse_input_csv(
         inspirations = [i for i in inspirations if isinstance(i, str) and i]
 
         try:
-            inspiration_poses = animal.poses[list(inspirations)]
+            entry = cache.get(inspirations, reference=reference)
         except Exception as e:
             mrich.error(e)
             mrich.error(f"Could not find get {inspirations=}")
             continue
 
+        inspiration_poses = entry["inspirations"]
+
         if not reference:
 
             # one placement against each inspiration's protein conformation
-            for pose in inspiration_poses:
+            for pose in entry["poses"]:
 
                 # all info needed for placement
                 data.append(
@@ -104,6 +407,7 @@ def parse_input_csv(
                         compound=compound,
                         reference=pose,
                         inspirations=inspiration_poses,
+                        smiles=smiles,
                     )
                 )
 
@@ -118,7 +422,7 @@ def parse_input_csv(
 
         else:
 
-            reference_pose = animal.poses[reference]
+            reference_pose = entry["reference"]
 
             # all info needed for placement
             data.append(
@@ -126,6 +430,7 @@ def parse_input_csv(
                     compound=compound,
                     reference=reference_pose,
                     inspirations=inspiration_poses,
+                    smiles=smiles,
                 )
             )
 
@@ -135,12 +440,100 @@ def parse_input_csv(
                 mrich.var("smiles", smiles)
                 mrich.var("inchikey", inchikey)
                 mrich.var("compound", compound)
-                mrich.var("protein", pose.alias)
+                mrich.var("protein", reference_pose.alias)
                 mrich.var("inspirations", inspiration_poses.aliases)
 
+    mrich.var("inspiration cache", cache)
+
     return data
 
 
+class InspirationCache:
+    """In-process memo of inspiration `PoseSet` objects, their poses and their deserialised molecules
+
+    Entries are keyed by the inspiration aliases in the order of the row, and the reference alias in `--reference` mode, so that repeated hit combinations are only looked up once. Molecules are memoised per pose and returned in the order of each `PoseSet`.
+
+    :param animal: `HIPPO` object to work within
+    """
+
+    def __init__(self, animal: "HIPPO"):
+        self._animal = animal
+        self._entries = {}
+        self._mols = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, aliases: "list[str]", reference: str | None = None) -> dict:
+        """Get the inspiration `PoseSet`, its `Pose` objects and the reference `Pose`"""
+
+        # the order of the hits is kept, as it is passed on to Fragmenstein
+        key = tuple(aliases), reference or None
+
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+
+        inspirations = self._animal.poses[list(aliases)]
+
+        entry = dict(
+            inspirations=inspirations,
+            poses=list(inspirations),
+            reference=self._animal.poses[reference] if reference else None,
+        )
+
+        self._entries[key] = entry
+
+        return entry
+
+    def get_mols(self, inspirations: "PoseSet") -> "list[Chem.Mol]":
+        """Get the molecules of the inspirations, in their order"""
+
+        if any(pose_id not in self._mols for pose_id in inspirations.ids):
+            for pose in inspirations:
+                if pose.id not in self._mols:
+                    self._mols[pose.id] = pose.mol
+
+        return [self._mols[pose_id] for pose_id in inspirations.ids]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{len(self)} combinations, {rate:.1f} % hit rate"
+
+
+def get_compounds_by_inchikey(animal: "HIPPO", inchikeys: "list[str]") -> "dict[str, Compound]":
+    """Resolve many InChIKeys to `Compound` objects with a single database query
+
+    :param animal: `HIPPO` object to work within
+    :param inchikeys: InChIKeys of registered compounds
+    :returns: dictionary mapping InChIKey to `Compound`
+    """
+
+    import json
+    from hippo.compound import Compound
+
+    records = animal.db.execute(
+        """
+        SELECT compound_id, compound_inchikey, compound_alias, compound_smiles
+        FROM compound
+        WHERE compound_inchikey IN (SELECT value FROM json_each(?))
+        """,
+        (json.dumps(list(set(inchikeys))),),
+    ).fetchall()
+
+    return {
+        record[1]: Compound(animal, animal.db, *record, metadata=None, mol=None)
+        for record in records
+    }
+
+
 def mols_to_sdf(mols, out_path):
 
     from rdkit.Chem import Mol
@@ -153,3 +546,186 @@ def mols_to_sdf(mols, out_path):
 
     df = DataFrame(data)
     PandasTools.WriteSDF(df, out_path, "ROMol", "_Name", list(df.columns))
+
+
+class AppendSDWriter:
+    """`SDWriter` that appends to an existing SDF and can flush through to disk"""
+
+    def __init__(self, path: "Path"):
+
+        from rdkit.Chem import SDWriter
+
+        self._file = open(path, "at")
+        self._writer = SDWriter(self._file)
+
+    def write(self, mol) -> None:
+        self._writer.write(mol)
+
+    def flush(self) -> None:
+        self._writer.flush()
+        self._file.flush()
+
+    def close(self) -> None:
+        self._writer.close()
+        self._file.close()
+
+
+def truncate_partial_sdf(path: "Path") -> int:
+    """Truncate an SDF after its last complete record, e.g. after a job was killed mid-write
+
+    :returns: the new size of the file in bytes
+    """
+
+    with open(path, "r+b") as f:
+
+        size = f.seek(0, 2)
+        new_size = get_sdf_end(f)
+
+        if new_size != size:
+            mrich.warning(f"Truncating partial record from {path}")
+            f.truncate(new_size)
+
+    return new_size
+
+
+def get_sdf_end(f: "BinaryIO", chunk_size: int = 1 << 16) -> int:
+    """Find the byte offset just after the last complete record of an open SDF"""
+
+    delimiter = b"$$$$\n"
+
+    end = f.seek(0, 2)
+
+    # search backwards for the last record delimiter
+    while end > 0:
+
+        start = max(0, end - chunk_size)
+        f.seek(start)
+        block = f.read(end - start + len(delimiter) - 1)
+
+        index = block.rfind(delimiter)
+
+        if index >= 0:
+            return start + index + len(delimiter)
+
+        end = start
+
+    return 0
+
+
+def combine_sdfs(
+    paths: "list[Path]", out_path: "Path", chunk_size: int = 1 << 20
+) -> list[int]:
+    """Concatenate SDFs as raw bytes without parsing any molecules
+
+    Any partial record at the end of an input is left out.
+
+    :param paths: input SDFs
+    :param out_path: combined SDF to write
+    :returns: the number of records copied from each input
+    """
+
+    delimiter = b"$$$$\n"
+
+    counts = []
+
+    mrich.writing(out_path)
+
+    with open(out_path, "wb") as out:
+
+        for path in mrich.track(paths, prefix="Combining SDFs"):
+
+            count = 0
+            tail = b""
+
+            with open(path, "rb") as f:
+
+                remaining = get_sdf_end(f)
+                f.seek(0)
+
+                while remaining:
+
+                    chunk = f.read(min(chunk_size, remaining))
+
+                    if not chunk:
+                        break
+
+                    out.write(chunk)
+                    remaining -= len(chunk)
+
+                    # the tail is too short to hold a delimiter itself
+                    count += (tail + chunk).count(delimiter)
+                    tail = chunk[-(len(delimiter) - 1) :]
+
+            counts.append(count)
+
+    return counts
+
+
+def count_csv_rows(path: "Path") -> int:
+    """Count the non-blank rows of a CSV, excluding the header"""
+
+    import csv
+
+    with open(path, "rt", newline="") as f:
+        return max(0, sum(1 for row in csv.reader(f) if row) - 1)
+
+
+def count_sdf_records(path: "Path", chunk_size: int = 1 << 20) -> int:
+    """Count the complete records of an SDF without parsing any molecules"""
+
+    delimiter = b"$$$$\n"
+
+    count = 0
+    tail = b""
+
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            count += (tail + chunk).count(delimiter)
+            tail = chunk[-(len(delimiter) - 1) :]
+
+    return count
+
+
+def iter_sdf_properties(path: "Path", properties: list[str] | None = None):
+    """Stream the name and (selected) properties of each record in an SDF without parsing molecules
+
+    :param path: SDF file to read
+    :param properties: property names to extract, defaults to all
+    :returns: generator of dictionaries with the `_Name` and requested properties
+    """
+
+    import re
+
+    header = re.compile(r"^>.*<(.+)>")
+
+    record = None
+    prop = None
+
+    with open(path, "rt") as f:
+
+        for line in f:
+
+            line = line.rstrip("\r\n")
+
+            if record is None:
+                record = {"_Name": line}
+                prop = None
+                continue
+
+            if line == "$$$$":
+                yield record
+                record = None
+                continue
+
+            if line.startswith(">"):
+                match = header.match(line)
+                prop = match.group(1) if match else None
+                if properties is not None and prop not in properties:
+                    prop = None
+                continue
+
+            if prop is not None:
+                if line:
+                    record[prop] = line if prop not in record else f"{record[prop]}\n{line}"
+                else:
+                    prop = None
@@ -0,0 +1,127 @@
+import mrich
+import json
+import sqlite3
+from pathlib import Path
+
+
+class PoseJobIndex:
+    """Sidecar index from SLURM job IDs to the IDs of the poses placed by those jobs
+
+    The index is kept in its own SQLite file next to the scratch data and is brought up to date incrementally, only reading poses that were registered since the last update.
+
+    :param path: path to the index SQLite file
+    """
+
+    def __init__(self, path: "Path"):
+
+        self._path = Path(path)
+        self._connection = sqlite3.connect(self._path)
+
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pose_job(
+                pose_id INTEGER PRIMARY KEY,
+                job_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pose_job_job_id ON pose_job(job_id);
+            CREATE TABLE IF NOT EXISTS meta(
+                key TEXT PRIMARY KEY,
+                value INTEGER
+            );
+            """
+        )
+
+    ### PROPERTIES
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def last_pose_id(self) -> int:
+        """Highest pose ID that has been scanned"""
+        record = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'last_pose_id'"
+        ).fetchone()
+        return record[0] if record else 0
+
+    ### METHODS
+
+    def update(self, animal: "HIPPO") -> int:
+        """Index the poses registered since the last update
+
+        :returns: number of newly indexed poses
+        """
+
+        records = animal.db.execute(
+            "SELECT pose_id, pose_path FROM pose WHERE pose_id > ?",
+            (self.last_pose_id,),
+        ).fetchall()
+
+        if not records:
+            return 0
+
+        values = []
+
+        for pose_id, pose_path in records:
+            job_id = job_id_from_pose_path(pose_path)
+            if job_id is not None:
+                values.append((pose_id, job_id))
+
+        self.add(values, last_pose_id=max(pose_id for pose_id, _ in records))
+
+        mrich.var("newly indexed poses", len(values))
+
+        return len(values)
+
+    def add(self, values: "list[tuple[int, int]]", last_pose_id: int | None = None) -> None:
+        """Add (pose_id, job_id) pairs, e.g. at the time the poses are registered"""
+
+        with self._connection:
+
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO pose_job(pose_id, job_id) VALUES (?, ?)",
+                values,
+            )
+
+            if last_pose_id is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta(key, value) VALUES ('last_pose_id', MAX(?, ?))",
+                    (last_pose_id, self.last_pose_id),
+                )
+
+    def get_pose_ids(self, job_ids: "set[int]") -> set[int]:
+        """Get the IDs of the poses placed by the given jobs"""
+
+        records = self._connection.execute(
+            "SELECT pose_id FROM pose_job WHERE job_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(job_id) for job_id in job_ids]),),
+        ).fetchall()
+
+        return set(pose_id for pose_id, in records)
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def job_id_from_pose_path(pose_path: str | None) -> int | None:
+    """Get the SLURM job ID from a path of the form SCRATCH/{job_id}/{name}/{name}.minimised.mol"""
+
+    if not pose_path:
+        return None
+
+    try:
+        return int(Path(pose_path).parent.parent.name)
+    except ValueError:
+        return None
+
+
+def filter_pose_ids_by_tag(animal: "HIPPO", pose_ids: "set[int]", tag: str) -> set[int]:
+    """Keep only the pose IDs that carry a given tag"""
+
+    records = animal.db.execute(
+        "SELECT tag_pose FROM tag WHERE tag_name = ? AND tag_pose IN (SELECT value FROM json_each(?))",
+        (tag, json.dumps(sorted(pose_ids))),
+    ).fetchall()
+
+    return set(pose_id for pose_id, in records)
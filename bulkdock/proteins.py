@@ -0,0 +1,200 @@
+import mrich
+import json
+import mmap
+import hashlib
+from pathlib import Path
+
+PACK_NAME = "proteins.pack"
+
+
+def get_protein_path(reference_path: str) -> str:
+    """Path of the apo-desolvated protein PDB of a reference pose"""
+    return reference_path.replace("_hippo.pdb", ".pdb").replace(
+        ".pdb", "_apo-desolv.pdb"
+    )
+
+
+class ProteinPack:
+    """Per-target pack of the protein PDBs that placements are run against
+
+    All PDB blocks are concatenated into a single file that place jobs memory-map, so each conformation is read from shared storage once per pack instead of once per `Laboratory`. The first line of the file is a JSON index keyed by reference pose ID, which stores the SHA-256 of each PDB file. A PDB that changed since the pack was built (size or mtime), or whose packed copy does not match its SHA-256, is read from its file instead. Each protein is only checked the first time a process reads it.
+
+    :param directory: pack directory, usually `SCRATCH/{target}_proteins`
+    """
+
+    def __init__(self, directory: "Path"):
+
+        self._directory = Path(directory)
+
+        self._file = open(self.pack_path, "rb")
+
+        self._index = json.loads(self._file.readline())
+        self._data_start = self._file.tell()
+
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # (reference ID, protein path) of proteins that have been checked, and whether they can be read from the pack
+        self._checked = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    ### PROPERTIES
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def pack_path(self) -> Path:
+        return self.directory / PACK_NAME
+
+    ### METHODS
+
+    def get(self, reference_id: int, protein_path: str) -> str | None:
+        """Get the PDB block of a reference pose's protein, None if it is not packed or out of date"""
+
+        key = str(reference_id), str(protein_path)
+
+        entry = self._index.get(key[0])
+
+        if entry is None or entry["path"] != key[1] or self._checked.get(key) is False:
+            self.misses += 1
+            return None
+
+        start = self._data_start + entry["offset"]
+        data = bytes(self._mmap[start : start + entry["length"]])
+
+        if key not in self._checked:
+            self._checked[key] = self._check(entry, data)
+
+        if not self._checked[key]:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return data.decode()
+
+    def _check(self, entry: dict, data: bytes) -> bool:
+        """True if the packed PDB matches its file and its SHA-256"""
+
+        protein_path = entry["path"]
+
+        try:
+            stat = Path(protein_path).stat()
+        except FileNotFoundError:
+            stat = None
+
+        if stat and (stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]):
+            mrich.warning(f"Packed protein is out of date: {protein_path}")
+            return False
+
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            mrich.warning(f"Packed protein does not match its SHA-256: {protein_path}")
+            return False
+
+        return True
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, reference_id: int) -> bool:
+        return str(reference_id) in self._index
+
+    ### BUILDING
+
+    @classmethod
+    def build(cls, directory: "Path", references: "list[tuple[int, str]]") -> "ProteinPack":
+        """Write a pack of the proteins of (reference pose ID, reference pose path) pairs
+
+        The pack is written next to the current one and moved into place, so running jobs keep the version they opened.
+        """
+
+        directory = Path(directory)
+        directory.mkdir(exist_ok=True, parents=True)
+
+        index = {}
+        blocks = []
+        offset = 0
+
+        for reference_id, reference_path in mrich.track(
+            references, prefix="Packing proteins"
+        ):
+
+            protein_path = get_protein_path(reference_path)
+
+            try:
+                data = Path(protein_path).read_bytes()
+                stat = Path(protein_path).stat()
+            except FileNotFoundError:
+                mrich.warning(f"Missing protein for pose {reference_id}: {protein_path}")
+                continue
+
+            index[str(reference_id)] = dict(
+                path=protein_path,
+                sha256=hashlib.sha256(data).hexdigest(),
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                offset=offset,
+                length=len(data),
+            )
+
+            blocks.append(data)
+            offset += len(data)
+
+        tmp_path = directory / f".{PACK_NAME}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(index).encode() + b"\n")
+            for data in blocks:
+                f.write(data)
+
+        tmp_path.replace(directory / PACK_NAME)
+
+        mrich.var("#packed proteins", len(index))
+        mrich.var("pack size", f"{offset / 1024**2:.1f} MB")
+
+        return cls(directory)
+
+
+_PACKS = {}
+
+
+def get_protein_pack(directory: str | None) -> ProteinPack | None:
+    """Per-process memo of opened protein packs, None if there is no pack"""
+
+    if not directory:
+        return None
+
+    if directory not in _PACKS:
+        try:
+            _PACKS[directory] = ProteinPack(directory)
+        except FileNotFoundError:
+            _PACKS[directory] = None
+
+    return _PACKS[directory]
+
+
+def read_pdbblock(
+    protein_path: str,
+    reference_id: int | None = None,
+    protein_pack: str | None = None,
+) -> str:
+    """Read a protein PDB block from the pack if possible, otherwise from its file"""
+
+    pack = get_protein_pack(protein_pack)
+
+    if pack is not None and reference_id is not None:
+        pdbblock = pack.get(reference_id, protein_path)
+        if pdbblock is not None:
+            return pdbblock
+
+    assert Path(protein_path).exists(), f"{protein_path=} does not exist"
+
+    with open(protein_path) as fh:
+        return fh.read()
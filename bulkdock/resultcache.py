@@ -0,0 +1,372 @@
+import mrich
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+
+# bump to invalidate every cached result
+CACHE_VERSION = 1
+
+
+class PlacementResultCache:
+    """Content-addressed cache of successful placements shared by all runs for a target
+
+    Records are keyed by :func:`placement_cache_key` and stored as pickled RDKit molecules with the SDF properties of the original output record.
+
+    Placement jobs open the target's cache read-only and add their results to a cache of their own in the job scratch directory, which are merged into the target's cache when the next run is submitted (see :meth:`merge`).
+
+    :param path: path to the cache, usually `SCRATCH/{target}_result_cache.sqlite`
+    :param readonly: open an existing cache without taking any write locks
+    """
+
+    def __init__(self, path: "Path", readonly: bool = False):
+
+        self._path = Path(path)
+
+        if readonly:
+            self._connection = sqlite3.connect(
+                f"file:{self._path}?mode=ro", uri=True, timeout=60
+            )
+            return
+
+        self._connection = sqlite3.connect(self._path, timeout=60)
+
+        # caches are opened from many nodes, which rules out WAL as it needs shared memory on one host
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode=DELETE;
+            CREATE TABLE IF NOT EXISTS result(
+                key TEXT PRIMARY KEY,
+                mol BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS merged_cache(
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            """
+        )
+
+    ### PROPERTIES
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    ### METHODS
+
+    def get(self, key: str) -> "Chem.Mol | None":
+
+        from rdkit.Chem import Mol
+
+        record = self._connection.execute(
+            "SELECT mol FROM result WHERE key = ?", (key,)
+        ).fetchone()
+
+        return Mol(record[0]) if record else None
+
+    def get_many(self, keys: "list[str]") -> "dict[str, bytes]":
+        """Get the pickled molecules of many keys with a single query"""
+
+        records = self._connection.execute(
+            "SELECT key, mol FROM result WHERE key IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(keys)),),
+        ).fetchall()
+
+        return dict(records)
+
+    def add(self, key: str, mol: "Chem.Mol") -> None:
+
+        from rdkit.Chem import PropertyPickleOptions
+
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO result(key, mol) VALUES (?, ?)",
+                (key, mol.ToBinary(PropertyPickleOptions.AllProps)),
+            )
+
+    def merge(self, paths: "list[Path]") -> int:
+        """Add the results of per-job caches, skipping those that have not changed since they were last merged
+
+        :returns: number of merged caches
+        """
+
+        count = 0
+
+        for path in mrich.track(paths, prefix="Merging job result caches"):
+
+            stat = path.stat()
+
+            record = self._connection.execute(
+                "SELECT size, mtime_ns FROM merged_cache WHERE path = ?", (str(path),)
+            ).fetchone()
+
+            if record == (stat.st_size, stat.st_mtime_ns):
+                continue
+
+            self._connection.execute("ATTACH DATABASE ? AS job_cache", (str(path),))
+
+            try:
+                with self._connection:
+                    self._connection.execute(
+                        "INSERT OR IGNORE INTO result(key, mol) SELECT key, mol FROM job_cache.result"
+                    )
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO merged_cache(path, size, mtime_ns) VALUES (?, ?, ?)",
+                        (str(path), stat.st_size, stat.st_mtime_ns),
+                    )
+
+            except sqlite3.DatabaseError as e:
+                # e.g. the cache of a job that was killed before creating its table
+                mrich.warning(f"Could not merge {path}: {e}")
+                continue
+
+            finally:
+                self._connection.execute("DETACH DATABASE job_cache")
+
+            count += 1
+
+        return count
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM result").fetchone()[0]
+
+
+def find_job_result_caches(scratch_dir: "Path", target: str) -> "list[Path]":
+    """Find the result caches written by placement jobs for a target"""
+
+    # one cache per job, or per task of a sharded job
+    return sorted(Path(scratch_dir).glob(f"*/{Path(target).name}_result_cache*.sqlite"))
+
+
+def canonical_smiles(smiles: str) -> str:
+    """RDKit canonical SMILES, or the input if it can not be parsed"""
+
+    from rdkit.Chem import MolFromSmiles, MolToSmiles
+
+    mol = MolFromSmiles(smiles)
+
+    if mol is None:
+        return smiles
+
+    return MolToSmiles(mol)
+
+
+def placement_cache_key(
+    smiles: str,
+    reference_id: int,
+    inspiration_ids: "list[int]",
+    settings: dict | None = None,
+) -> str:
+    """Key of a placement in the result cache
+
+    :param smiles: input SMILES of the ligand, canonicalised here
+    :param reference_id: ID of the reference pose
+    :param inspiration_ids: IDs of the inspiration poses
+    :param settings: Fragmenstein settings, defaults to :data:`.config.FRAGMENSTEIN_SETTINGS`
+    """
+
+    if settings is None:
+        from .config import FRAGMENSTEIN_SETTINGS as settings
+
+    content = json.dumps(
+        [
+            CACHE_VERSION,
+            canonical_smiles(smiles),
+            int(reference_id),
+            sorted(int(i) for i in inspiration_ids),
+            settings,
+        ],
+        sort_keys=True,
+    )
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def result_from_mol(mol: "Chem.Mol") -> dict:
+    """Placement result fields from the SDF properties of a cached record"""
+
+    props = mol.GetPropsAsDict()
+
+    return {
+        "∆∆G": props.get("energy_score"),
+        "comRMSD": props.get("distance_score"),
+        "runtime": props.get("fragmenstein_runtime"),
+        "outcome": props.get("fragmenstein_outcome"),
+        "mode": props.get("fragmenstein_mode"),
+        "error": props.get("fragmenstein_error"),
+    }
+
+
+def read_pose_ids_by_alias(animal_path: "Path") -> "dict[str, int]":
+    """Read the IDs of all aliased poses straight from a HIPPO database, without importing HIPPO"""
+
+    connection = sqlite3.connect(f"file:{animal_path}?mode=ro", uri=True, timeout=60)
+
+    records = connection.execute(
+        "SELECT pose_alias, pose_id FROM pose WHERE pose_alias IS NOT NULL"
+    ).fetchall()
+
+    connection.close()
+
+    return dict(records)
+
+
+def split_cached_rows(
+    in_path: "Path",
+    out_path: "Path",
+    *,
+    cache: PlacementResultCache,
+    pose_ids: "dict[str, int]",
+    cached_sdf: "Path",
+    reference: str | None = None,
+) -> "tuple[int, int, int]":
+    """Drop input rows whose placements are all cached or duplicate an earlier row
+
+    The remaining rows are written to `out_path` and the cached records of the dropped rows to `cached_sdf`.
+
+    :param in_path: input CSV
+    :param out_path: CSV of the rows that still need placing
+    :param cache: result cache of the target
+    :param pose_ids: pose IDs by alias, see :func:`read_pose_ids_by_alias`
+    :param cached_sdf: SDF to write the cached records to
+    :param reference: alias of the reference pose, if not given each row is placed against each of its inspirations
+    :returns: number of input rows, cached rows and duplicate rows
+    """
+
+    import csv
+    from rdkit.Chem import Mol, SDWriter
+
+    reference_id = pose_ids[reference] if reference else None
+
+    n_rows = 0
+    n_cached = 0
+    n_duplicates = 0
+
+    seen = set()
+
+    writer = SDWriter(str(cached_sdf))
+
+    with open(in_path, "rt", newline="") as f, open(out_path, "wt", newline="") as g:
+
+        reader = csv.reader(f)
+        out = csv.writer(g)
+        out.writerow(next(reader))
+
+        for row in mrich.track(reader, prefix="Checking result cache"):
+
+            if not row:
+                continue
+
+            n_rows += 1
+
+            aliases = [alias for alias in row[1:] if alias]
+
+            # unknown hits are reported by the placement job
+            if not aliases or any(alias not in pose_ids for alias in aliases):
+                out.writerow(row)
+                continue
+
+            inspiration_ids = [pose_ids[alias] for alias in aliases]
+
+            if reference_id:
+                reference_ids = [reference_id]
+            else:
+                reference_ids = sorted(set(inspiration_ids))
+
+            keys = [
+                placement_cache_key(row[0], ref_id, inspiration_ids)
+                for ref_id in reference_ids
+            ]
+
+            digest = hashlib.sha256("".join(keys).encode()).digest()[:16]
+
+            if digest in seen:
+                n_duplicates += 1
+                continue
+
+            seen.add(digest)
+
+            cached = cache.get_many(keys)
+
+            if len(cached) < len(keys):
+                out.writerow(row)
+                continue
+
+            for key in keys:
+                writer.write(Mol(cached[key]))
+
+            n_cached += 1
+
+    writer.close()
+
+    mrich.var("#input rows", n_rows)
+    mrich.var("#cached rows", n_cached)
+    mrich.var("#duplicate rows", n_duplicates)
+
+    return n_rows, n_cached, n_duplicates
+
+
+def stage_cached_records(sdf_path: "Path", staging_path: "Path", csv_name: str) -> int:
+    """Stage the cached records of dropped input rows, so that the merge job registers them like the placed poses
+
+    :param sdf_path: SDF of cached records written by :func:`split_cached_rows`
+    :param staging_path: staging store to write, found by the merge job through its `csv_name`
+    :param csv_name: name of the input CSV of the placement run
+    :returns: number of staged poses
+    """
+
+    from rdkit.Chem import SDMolSupplier
+    from .staging import StagingStore
+
+    store = StagingStore(staging_path)
+    store.set_meta(csv_name=csv_name, cached=True)
+
+    count = 0
+
+    for mol in SDMolSupplier(str(sdf_path), removeHs=False):
+
+        if mol is None:
+            continue
+
+        store.add_pose(
+            task=dict(
+                compound_id=int(mol.GetProp("compound_id")),
+                reference_id=int(mol.GetProp("reference_id")),
+                inspiration_ids=mol.GetProp("inspiration_ids"),
+            ),
+            result=result_from_mol(mol),
+            path=mol.GetProp("path"),
+            metadata=dict(csv_name=csv_name),
+        )
+
+        count += 1
+
+    store.close()
+
+    mrich.writing(staging_path)
+    mrich.var("#staged cached poses", count)
+
+    return count
+
+
+def write_cached_result(
+    mol: "Chem.Mol",
+    writer: "SDWriter",
+    *,
+    name: str,
+    compound_id: int,
+    reference_id: int,
+    inspiration_ids: "list[int]",
+) -> None:
+    """Write a cached record to the output SDF under the names of the current task"""
+
+    mol.SetProp("_Name", name)
+    mol.SetProp("compound_id", str(compound_id))
+    mol.SetProp("reference_id", str(reference_id))
+    mol.SetProp("inspiration_ids", str(inspiration_ids))
+
+    writer.write(mol)
@@ -0,0 +1,248 @@
+import mrich
+from pathlib import Path
+
+# SDF properties written by write_placement_result, with their column types
+PROPERTIES = {
+    "compound_id": "Int64",
+    "reference_id": "Int64",
+    "inspiration_ids": "string",
+    "energy_score": "float64",
+    "distance_score": "float64",
+    "fragmenstein_runtime": "float64",
+    "fragmenstein_outcome": "string",
+    "fragmenstein_mode": "string",
+    "fragmenstein_error": "string",
+}
+
+COLUMNS = ["name", *PROPERTIES, "offset", "length"]
+
+
+def get_index_path(sdf_path: "Path", suffix: str = ".parquet") -> Path:
+    """Path of the results index of an SDF, e.g. `OUTPUTS/{name}.index.parquet`"""
+    sdf_path = Path(sdf_path)
+    return sdf_path.with_name(sdf_path.name.removesuffix(".sdf") + ".index" + suffix)
+
+
+def iter_sdf_record_offsets(path: "Path", properties: "list[str]"):
+    """Stream the name, selected properties, byte offset and length of each complete record in an SDF
+
+    :param path: SDF file to read
+    :param properties: property names to extract
+    :returns: generator of dictionaries with `name`, the requested properties, `offset` and `length`
+    """
+
+    import re
+
+    header = re.compile(rb"^>.*<(.+)>")
+    properties = {prop.encode(): prop for prop in properties}
+
+    record = None
+    prop = None
+    offset = 0
+    start = 0
+
+    with open(path, "rb") as f:
+
+        for line in f:
+
+            line_start = offset
+            offset += len(line)
+
+            line = line.rstrip(b"\r\n")
+
+            if record is None:
+                record = {"name": line.decode(errors="replace")}
+                start = line_start
+                prop = None
+                continue
+
+            if line == b"$$$$":
+                record["offset"] = start
+                record["length"] = offset - start
+                yield record
+                record = None
+                continue
+
+            if line.startswith(b">"):
+                match = header.match(line)
+                prop = properties.get(match.group(1)) if match else None
+                continue
+
+            if prop is not None:
+                if line:
+                    record[prop] = line.decode(errors="replace")
+                else:
+                    prop = None
+
+
+def build_result_index(sdf_path: "Path") -> "DataFrame":
+    """Scan an SDF for the placement properties and byte range of every record"""
+
+    from pandas import DataFrame, to_numeric
+
+    df = DataFrame(
+        iter_sdf_record_offsets(sdf_path, list(PROPERTIES)),
+        columns=COLUMNS,
+    )
+
+    for column, dtype in PROPERTIES.items():
+        if dtype == "string":
+            df[column] = df[column].astype(dtype)
+        else:
+            # "N/A" and other placeholders become missing values
+            df[column] = to_numeric(df[column], errors="coerce").astype(dtype)
+
+    df["offset"] = df["offset"].astype("int64")
+    df["length"] = df["length"].astype("int64")
+
+    return df
+
+
+def write_result_index(sdf_path: "Path", df: "DataFrame | None" = None) -> Path:
+    """Write the results index of an SDF, building it by scanning the SDF if not given
+
+    :returns: path of the written index, Parquet or CSV if no Parquet engine is installed
+    """
+
+    if df is None:
+        df = build_result_index(sdf_path)
+
+    try:
+        path = get_index_path(sdf_path)
+        df.to_parquet(path, index=False)
+        get_index_path(sdf_path, ".csv").unlink(missing_ok=True)
+    except ImportError:
+        path = get_index_path(sdf_path, ".csv")
+        df.to_csv(path, index=False)
+
+    mrich.writing(path)
+
+    return path
+
+
+def load_result_index(sdf_path: "Path") -> "DataFrame | None":
+    """Load the results index of an SDF, None if there is none or it does not match the SDF"""
+
+    import pandas as pd
+    from .io import get_sdf_end
+
+    sdf_path = Path(sdf_path)
+
+    for suffix in [".parquet", ".csv"]:
+
+        path = get_index_path(sdf_path, suffix)
+
+        if not path.exists():
+            continue
+
+        # written before the SDF was last modified
+        if path.stat().st_mtime < sdf_path.stat().st_mtime:
+            mrich.warning(f"Ignoring out of date results index {path}")
+            return None
+
+        if suffix == ".parquet":
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype=PROPERTIES)
+
+        with open(sdf_path, "rb") as f:
+            end = get_sdf_end(f)
+
+        indexed_end = int((df["offset"] + df["length"]).max()) if len(df) else 0
+
+        if indexed_end != end:
+            mrich.warning(f"Ignoring results index that does not match the SDF {path}")
+            return None
+
+        return df
+
+    return None
+
+
+def get_result_index(sdf_path: "Path") -> "DataFrame":
+    """Load the results index of an SDF, or build and write it"""
+
+    df = load_result_index(sdf_path)
+
+    if df is None:
+        df = build_result_index(sdf_path)
+        write_result_index(sdf_path, df)
+
+    return df
+
+
+def combine_result_indexes(paths: "list[Path]") -> "DataFrame":
+    """Results index of the concatenation of SDFs as written by :func:`.io.combine_sdfs`
+
+    The index of each input is loaded (or built) and its offsets are shifted by the bytes copied before it.
+    """
+
+    import pandas as pd
+    from .io import get_sdf_end
+
+    dfs = []
+    shift = 0
+
+    for path in paths:
+
+        df = get_result_index(path)
+        df["offset"] += shift
+        dfs.append(df)
+
+        with open(path, "rb") as f:
+            shift += get_sdf_end(f)
+
+    if not dfs:
+        return pd.DataFrame(columns=COLUMNS)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def read_records(sdf_path: "Path", df: "DataFrame") -> "list[Chem.Mol]":
+    """Read the molecules of the index rows from the SDF, seeking straight to each record"""
+
+    from rdkit.Chem import SDMolSupplier
+
+    mols = []
+
+    supplier = SDMolSupplier()
+
+    with open(sdf_path, "rb") as f:
+        for offset, length in zip(df["offset"], df["length"]):
+
+            f.seek(offset)
+
+            # parses the properties as well as the molblock
+            supplier.SetData(f.read(length).decode(), removeHs=False)
+            mols.append(supplier[0])
+
+    return mols
+
+
+def report_results(df: "DataFrame", top: int = 10) -> None:
+    """Print outcome counts, score percentiles and the best scoring placements from a results index"""
+
+    if df.empty:
+        mrich.error("Results index is empty")
+        return
+
+    mrich.h3("Outcomes")
+
+    for outcome, count in df["fragmenstein_outcome"].value_counts(dropna=False).items():
+        mrich.var(str(outcome), f"{count} ({count / len(df) * 100:.1f} %)")
+
+    mrich.h3("Score percentiles")
+
+    for column in ["energy_score", "distance_score", "fragmenstein_runtime"]:
+        p50, p90, p99 = df[column].quantile([0.5, 0.9, 0.99])
+        mrich.var(column, f"p50={p50:.2f} p90={p90:.2f} p99={p99:.2f}")
+
+    mrich.h3(f"Best acceptable placements (top {top})")
+
+    best = df[df["fragmenstein_outcome"] == "acceptable"].nsmallest(top, "energy_score")
+
+    for _, row in best.iterrows():
+        mrich.var(
+            row["name"],
+            f"energy_score={row['energy_score']:.2f} distance_score={row['distance_score']:.2f}",
+        )
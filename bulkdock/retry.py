@@ -0,0 +1,169 @@
+import mrich
+import json
+import time
+from pathlib import Path
+from .checkpoint import placement_key
+
+# Fragmenstein errors that may not happen again on a retry
+TRANSIENT_ERRORS = ["MemoryError", "OSError", "BrokenPipeError", "ConnectionError"]
+
+
+class RetryPolicy:
+    """When to retry a Fragmenstein placement and with which timeout
+
+    Null results and crashes with a transient error are retried up to `n_retries` attempts. Timeouts are only retried until `max_timeouts` have happened, and each attempt's timeout is scaled by `timeout_factor` (above 1 to escalate, below 1 to decay) within `min_timeout` and `max_timeout`. By default a placement that times out is retried once with half the timeout, as a compound that times out once usually does so again.
+
+    Timeouts are never treated as deterministic failures, as they also depend on the load of the node.
+
+    :param n_retries: maximum number of attempts
+    :param timeout: timeout of the first attempt in seconds
+    :param timeout_factor: factor applied to the timeout after every attempt
+    :param min_timeout: lower bound of the timeout in seconds
+    :param max_timeout: upper bound of the timeout in seconds
+    :param max_timeouts: number of timeouts after which a placement is given up
+    """
+
+    def __init__(
+        self,
+        n_retries: int = 3,
+        timeout: float = 300,
+        timeout_factor: float = 0.5,
+        min_timeout: float = 30,
+        max_timeout: float = 3600,
+        max_timeouts: int = 2,
+    ):
+        self.n_retries = int(n_retries)
+        self.timeout = float(timeout)
+        self.timeout_factor = float(timeout_factor)
+        self.min_timeout = float(min_timeout)
+        self.max_timeout = float(max_timeout)
+        self.max_timeouts = int(max_timeouts)
+
+    def __repr__(self):
+        return f"RetryPolicy(n_retries={self.n_retries}, timeout={self.timeout}, timeout_factor={self.timeout_factor}, max_timeouts={self.max_timeouts})"
+
+    def get_timeout(self, attempt: int) -> int:
+        """Timeout of an attempt, counting from zero"""
+        timeout = self.timeout * self.timeout_factor**attempt
+        return int(min(self.max_timeout, max(self.min_timeout, timeout)))
+
+    def should_retry(self, result: dict | None, timeouts: int) -> bool:
+        """Decide if a placement result is worth another attempt
+
+        :param result: placement result, None for a null result
+        :param timeouts: number of timeouts so far, including this result
+        """
+
+        if result is None:
+            return True
+
+        if is_timeout(result):
+            return timeouts < self.max_timeouts
+
+        if result.get("outcome") == "crashed":
+            return error_class(result) in TRANSIENT_ERRORS
+
+        return False
+
+    def is_deterministic_failure(self, result: dict | None) -> bool:
+        """True if a final result is a failure that is expected to happen again"""
+
+        if result is None or is_timeout(result):
+            return False
+
+        return (
+            result.get("outcome") == "crashed"
+            and error_class(result) not in TRANSIENT_ERRORS
+        )
+
+
+def error_class(result: dict) -> str:
+    """Class name of the error of a placement result, Fragmenstein reports crashes as `"<ClassName> <message>"`"""
+    return str(result.get("error") or "").split(" ", 1)[0].rstrip(":")
+
+
+def is_timeout(result: dict) -> bool:
+    return result.get("outcome") == "crashed" and error_class(result) == "TimeoutError"
+
+
+class PlacementQuarantine:
+    """Per-target record of (compound, reference, inspirations) placements that failed deterministically
+
+    Every job appends to its own JSON-lines file in the quarantine directory, placements in any of them are skipped by later jobs. Delete the directory to try them again.
+
+    :param directory: quarantine directory of the target, usually `SCRATCH/{target}_quarantine`
+    :param job_id: SLURM job ID of the current job
+    """
+
+    def __init__(self, directory: "Path", job_id: str):
+
+        self._directory = Path(directory)
+        self._directory.mkdir(exist_ok=True, parents=True)
+
+        self._job_id = str(job_id)
+        self._pairs = set()
+
+        self.load()
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"{self._job_id}.jsonl"
+
+    def load(self) -> None:
+
+        for path in sorted(self.directory.glob("*.jsonl")):
+
+            with open(path, "rt") as f:
+                for line in f:
+
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    self._pairs.add(
+                        (
+                            int(entry["compound_id"]),
+                            int(entry["reference_id"]),
+                            entry.get("inspirations", ""),
+                        )
+                    )
+
+        if self._pairs:
+            mrich.var("quarantined placements", len(self._pairs))
+
+    def add(self, task: dict, result: dict) -> None:
+        """Quarantine the placement of a task"""
+
+        key = placement_key(
+            task["compound_id"], task["reference_id"], task["inspiration_ids"]
+        )
+
+        self._pairs.add(key)
+
+        entry = dict(
+            compound_id=key[0],
+            reference_id=key[1],
+            inspirations=key[2],
+            name=task["name"],
+            outcome=str(result.get("outcome")),
+            error=str(result.get("error")),
+            attempts=result.get("attempts"),
+            job_id=self._job_id,
+            time=round(time.time(), 3),
+        )
+
+        with open(self.path, "at") as f:
+            f.write(json.dumps(entry) + "\n")
+
+        mrich.warning(f"Quarantined {task['name']} ({entry['error']})")
+
+    def __contains__(self, key: tuple[int, int, str]) -> bool:
+        return key in self._pairs
+
+    def __len__(self) -> int:
+        return len(self._pairs)
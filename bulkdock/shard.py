@@ -0,0 +1,187 @@
+import mrich
+import os
+import json
+import time
+from pathlib import Path
+
+
+class PlacementShard:
+    """One task's share of a placement job that is run with `srun` across several SLURM tasks
+
+    Each task places the compounds whose ID modulo the number of tasks is its rank (`SLURM_PROCID`), so all placements of a compound are made by the same task. Rank 0 registers the compounds, prepares the output for resuming and then writes a ready marker to the job scratch directory, which the other ranks wait for. Every rank writes its own partial SDF next to it and a done marker when it finishes, after which rank 0 merges the partial SDFs into the batch output.
+
+    :param directory: scratch directory of the job
+    :param key: name of the input batch without suffix
+    :param rank: rank of this task
+    :param n_tasks: number of tasks in the job step
+    :param restart: number of times the job has been requeued, markers of earlier runs are ignored
+    """
+
+    def __init__(
+        self,
+        directory: "Path",
+        key: str,
+        rank: int = 0,
+        n_tasks: int = 1,
+        restart: int = 0,
+    ):
+
+        assert 0 <= rank < n_tasks, f"Invalid shard {rank=} {n_tasks=}"
+
+        self._directory = Path(directory)
+        self._key = key
+        self._rank = int(rank)
+        self._n_tasks = int(n_tasks)
+        self._restart = int(restart)
+
+    @classmethod
+    def from_env(cls, directory: "Path", key: str) -> "PlacementShard":
+        """Shard of the current task from `SLURM_PROCID`, `SLURM_NTASKS` and `SLURM_RESTART_COUNT`"""
+
+        rank = int(os.environ.get("SLURM_PROCID", 0))
+        n_tasks = int(os.environ.get("SLURM_NTASKS", 1))
+        restart = int(os.environ.get("SLURM_RESTART_COUNT", 0))
+
+        return cls(directory, key, rank=rank, n_tasks=n_tasks, restart=restart)
+
+    def __repr__(self):
+        return f"PlacementShard({self.rank}/{self.n_tasks})"
+
+    ### PROPERTIES
+
+    @property
+    def rank(self) -> int:
+        return self._rank
+
+    @property
+    def n_tasks(self) -> int:
+        return self._n_tasks
+
+    @property
+    def enabled(self) -> bool:
+        return self._n_tasks > 1
+
+    @property
+    def is_root(self) -> bool:
+        return self._rank == 0
+
+    @property
+    def suffix(self) -> str:
+        """Suffix of the per-task files (ledgers, progress, telemetry, staging), empty if not sharded"""
+        return f".rank{self._rank:03}" if self.enabled else ""
+
+    @property
+    def ready_path(self) -> Path:
+        return self._directory / f"{self._key}.{self._restart}.ready.json"
+
+    def get_done_path(self, rank: int) -> Path:
+        return self._directory / f"{self._key}.{self._restart}.rank{rank:03}.done.json"
+
+    def get_partial_path(self, rank: int) -> Path:
+        return self._directory / f"{self._key}.rank{rank:03}.sdf"
+
+    @property
+    def partial_path(self) -> Path:
+        return self.get_partial_path(self._rank)
+
+    ### METHODS
+
+    def select(self, items: list, key: "Callable") -> list:
+        """Items of this shard, where key gives an integer such as the compound ID"""
+        return [item for item in items if key(item) % self._n_tasks == self._rank]
+
+    def mark_ready(self, inchikeys: "list[str] | None" = None, error: str | None = None) -> None:
+        """Release the other ranks, passing them the InChIKeys of the registered compounds"""
+        _write_marker(self.ready_path, dict(inchikeys=inchikeys, error=error))
+
+    def wait_ready(self, poll: float = 2.0) -> "list[str] | None":
+        """Wait for rank 0 to be ready
+
+        :returns: InChIKeys of the input rows
+        """
+
+        with mrich.clock(f"Waiting for rank 0 of {self._n_tasks}..."):
+            marker = _wait_marker(self.ready_path, poll=poll)
+
+        assert not marker["error"], f"Rank 0 failed: {marker['error']}"
+
+        return marker["inchikeys"]
+
+    def mark_done(self, count: int, success: bool) -> None:
+        _write_marker(
+            self.get_done_path(self._rank),
+            dict(rank=self._rank, count=count, success=success),
+        )
+
+    def wait_done(self, poll: float = 5.0) -> list[dict]:
+        """Wait for every rank to finish
+
+        :returns: done markers of all ranks
+        """
+
+        markers = []
+
+        with mrich.clock(f"Waiting for {self._n_tasks} ranks to finish..."):
+            for rank in range(self._n_tasks):
+                markers.append(_wait_marker(self.get_done_path(rank), poll=poll))
+
+        for marker in markers:
+            if not marker["success"]:
+                mrich.warning(f"Rank {marker['rank']} did not finish, merging its partial output")
+
+        return markers
+
+
+def in_job_step() -> bool:
+    """True if running in a job step launched by srun rather than in the batch script"""
+    return os.environ.get("SLURM_STEP_ID", "batch") not in ["batch", "4294967294"]
+
+
+def find_partial_sdfs(directories: "list[Path]", key: str) -> "list[Path]":
+    """Find partial SDFs of an input batch that earlier sharded jobs did not merge"""
+
+    paths = []
+
+    for directory in directories:
+        paths += sorted(Path(directory).glob(f"{key}.rank[0-9][0-9][0-9].sdf"))
+
+    return paths
+
+
+def merge_partial_sdfs(outfile: "Path", partials: "list[Path]") -> int:
+    """Append partial SDFs to an output SDF and delete them
+
+    The merged file is written next to the output and moved into place, so a killed merge leaves both the output and the partial SDFs intact.
+
+    :returns: number of records in the merged output
+    """
+
+    from .io import combine_sdfs
+
+    paths = [outfile] if outfile.exists() else []
+    paths += [path for path in partials if path.exists() and path not in paths]
+
+    tmp_path = outfile.with_name(f".{outfile.name}.tmp")
+
+    counts = combine_sdfs(paths, tmp_path)
+
+    tmp_path.replace(outfile)
+
+    for path in partials:
+        path.unlink(missing_ok=True)
+
+    return sum(counts)
+
+
+def _write_marker(path: "Path", data: dict) -> None:
+    """Write a JSON marker atomically"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wt") as f:
+        json.dump(data, f)
+    tmp_path.replace(path)
+
+
+def _wait_marker(path: "Path", poll: float) -> dict:
+    while not path.exists():
+        time.sleep(poll)
+    return json.load(open(path, "rt"))
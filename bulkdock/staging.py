@@ -0,0 +1,269 @@
+import mrich
+import json
+import inspect
+import sqlite3
+from contextlib import nullcontext
+from pathlib import Path
+
+
+class StagingStore:
+    """Per-job SQLite store of placed poses, merged into the target's HIPPO database by a separate job
+
+    Placement jobs only ever write to their own store, so they never wait on the shared database.
+
+    :param path: path to the store, usually `SCRATCH/{job_id}/staging.sqlite`
+    :param readonly: open an existing store without writing to it, e.g. one that a running job may still write to
+    """
+
+    def __init__(self, path: "Path", readonly: bool = False):
+
+        self._path = Path(path)
+
+        if readonly:
+            self._connection = sqlite3.connect(f"file:{self._path}?mode=ro", uri=True)
+            return
+
+        self._connection = sqlite3.connect(self._path)
+
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta(
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pose(
+                staging_id INTEGER PRIMARY KEY,
+                compound_id INTEGER NOT NULL,
+                reference_id INTEGER NOT NULL,
+                inspiration_ids TEXT NOT NULL,
+                path TEXT NOT NULL,
+                energy_score REAL,
+                distance_score REAL,
+                metadata TEXT,
+                pose_id INTEGER
+            );
+            """
+        )
+
+    ### PROPERTIES
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def job_id(self) -> int | None:
+        try:
+            return int(self.get_meta("job_id"))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def num_unmerged(self) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM pose WHERE pose_id IS NULL"
+        ).fetchone()[0]
+
+    ### METHODS
+
+    def get_meta(self, key: str) -> str | None:
+        record = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return record[0] if record else None
+
+    def set_meta(self, **kwargs) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)",
+                [(key, str(value)) for key, value in kwargs.items()],
+            )
+
+    def add_pose(
+        self,
+        *,
+        task: dict,
+        result: dict,
+        path: "Path",
+        metadata: dict | None = None,
+    ) -> None:
+        """Stage a successful placement"""
+
+        metadata = dict(metadata or {})
+
+        for key in ["runtime", "outcome", "mode", "error"]:
+            metadata[f"fragmenstein_{key}"] = str(result.get(key, "N/A"))
+
+        with self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO pose(compound_id, reference_id, inspiration_ids, path, energy_score, distance_score, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    task["compound_id"],
+                    task["reference_id"],
+                    task["inspiration_ids"],
+                    str(path),
+                    _to_float(result.get("∆∆G")),
+                    _to_float(result.get("comRMSD")),
+                    json.dumps(metadata, default=str),
+                ),
+            )
+
+    def get_unmerged_poses(self) -> list[tuple]:
+        return self._connection.execute(
+            """
+            SELECT staging_id, compound_id, reference_id, inspiration_ids, path, energy_score, distance_score, metadata
+            FROM pose WHERE pose_id IS NULL
+            """
+        ).fetchall()
+
+    def set_pose_ids(self, values: "list[tuple[int, int]]") -> None:
+        """Record the HIPPO pose IDs for (staging_id, pose_id) pairs"""
+        with self._connection:
+            self._connection.executemany(
+                "UPDATE pose SET pose_id = ? WHERE staging_id = ?",
+                [(pose_id, staging_id) for staging_id, pose_id in values],
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def find_staging_stores(scratch_dir: "Path", key: str) -> "list[Path]":
+    """Find the staging stores of the placement jobs for an input file"""
+
+    paths = []
+
+    # one store per job, or per task of a sharded job
+    for path in sorted(Path(scratch_dir).glob("*/staging*.sqlite")):
+
+        # stores of other jobs may still be written to
+        store = StagingStore(path, readonly=True)
+
+        try:
+            csv_name = store.get_meta("csv_name") or ""
+        except sqlite3.OperationalError:
+            # a store that its job has not set up yet
+            csv_name = ""
+        finally:
+            store.close()
+
+        if csv_name == f"{key}.csv" or csv_name.startswith(f"{key}_split"):
+            paths.append(path)
+
+    return paths
+
+
+def merge_staging_stores(
+    animal: "HIPPO",
+    paths: "list[Path]",
+    *,
+    tag: str = "Fragmenstein placed",
+    transaction_size: int = 5_000,
+    index: "PoseJobIndex | None" = None,
+) -> int:
+    """Register staged poses into the HIPPO database in a few large transactions
+
+    :param animal: `HIPPO` object to merge into
+    :param paths: staging stores to merge
+    :param tag: tag added to every merged pose
+    :param transaction_size: number of poses registered per commit
+    :param index: optional :class:`.PoseJobIndex` to add the new poses to
+    :returns: number of merged poses
+    """
+
+    # older HIPPO versions commit every registered pose
+    if "commit" in inspect.signature(animal.register_pose).parameters:
+        kwargs = dict(commit=False)
+        deferred = nullcontext
+    else:
+        mrich.warning(
+            "HIPPO.register_pose has no commit argument, deferring database commits"
+        )
+        kwargs = {}
+        deferred = DeferredCommits
+
+    count = 0
+
+    for path in mrich.track(paths, prefix="Merging staging stores"):
+
+        store = StagingStore(path)
+        job_id = store.job_id
+
+        records = store.get_unmerged_poses()
+
+        mrich.var(str(path), f"{len(records)} unmerged poses")
+
+        for i in range(0, len(records), transaction_size):
+
+            merged = []
+
+            with deferred(animal.db):
+
+                for (
+                    staging_id,
+                    compound_id,
+                    reference_id,
+                    inspiration_ids,
+                    pose_path,
+                    energy_score,
+                    distance_score,
+                    metadata,
+                ) in records[i : i + transaction_size]:
+
+                    pose_id = animal.register_pose(
+                        compound=compound_id,
+                        target=1,
+                        path=pose_path,
+                        reference=reference_id,
+                        inspirations=json.loads(inspiration_ids),
+                        tags=[tag],
+                        energy_score=energy_score,
+                        distance_score=distance_score,
+                        metadata=json.loads(metadata),
+                        **kwargs,
+                    )
+
+                    if pose_id:
+                        merged.append((staging_id, pose_id))
+
+            animal.db.commit()
+
+            store.set_pose_ids(merged)
+
+            if index is not None and job_id is not None:
+                index.add([(pose_id, job_id) for _, pose_id in merged])
+
+            count += len(merged)
+
+        store.close()
+
+    return count
+
+
+class DeferredCommits:
+    """Context manager that turns the commits of a HIPPO database into no-ops, so that the writes in the context share one transaction
+
+    :param db: `Database` object of the `HIPPO` animal
+    """
+
+    def __init__(self, db: "Database"):
+        self._db = db
+        self._commit = None
+
+    def __enter__(self):
+        self._commit = self._db.commit
+        self._db.commit = lambda *args, **kwargs: None
+        return self
+
+    def __exit__(self, *args):
+        self._db.commit = self._commit
+
+
+def _to_float(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
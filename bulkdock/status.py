@@ -1,14 +1,22 @@
 import mrich
-import subprocess
+import json
+from pathlib import Path
 from rich.table import Table
 from rich.panel import Panel
 from richqueue.slurm import combined_df, get_user
 from richqueue.table import color_by_state, COLUMNS
 from datetime import timedelta
 from richqueue.tools import human_timedelta  # , human_timedelta_to_seconds
+from .telemetry import read_last_record
 
 
-def status():
+PROGRESS_PATTERN = b"Placement task "
+LOCKED_PATTERN = b"SQLite Database was locked, retrying..."
+
+LOG_CACHE_PATH = Path.home() / ".cache" / "bulkdock" / "status_logs.json"
+
+
+def status(scratch_dir: "Path | None" = None):
 
     user = get_user()
 
@@ -45,6 +53,48 @@ def status():
         "[cornflower_blue underline]Remaining", justify="right", style="cornflower_blue"
     )
 
+    # structured progress sidecars written by place jobs
+
+    sidecars = {}
+
+    if scratch_dir:
+
+        scratch_ids = get_scratch_job_ids(user)
+
+        for job_id in df["job_id"]:
+
+            job_scratch_dir = Path(scratch_dir) / scratch_ids.get(str(job_id), str(job_id))
+
+            # one sidecar per task of a sharded job
+            records = [
+                read_last_record(path)
+                for path in sorted(job_scratch_dir.glob("progress*.jsonl"))
+            ]
+
+            records = [record for record in records if record]
+
+            if records:
+                sidecars[job_id] = records
+
+    # otherwise scan only the new bytes of each log, in parallel
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = load_log_cache()
+
+    logs = [
+        log
+        for job_id, log in zip(df["job_id"], df["standard_output"])
+        if job_id not in sidecars
+    ]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        entries = list(pool.map(lambda log: scan_log(log, cache.get(log)), logs))
+
+    cache = dict(zip(logs, entries))
+
+    dump_log_cache(cache)
+
     for i, row in df.iterrows():
 
         values = []
@@ -56,32 +106,20 @@ def status():
 
         # calculate placement progress
 
-        grep = [f'grep "Placement task " {row.standard_output} | tail -n 1']
-
-        x = subprocess.run(
-            grep, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-
-        progress = x.stdout.decode()
-
-        grep = [
-            f'grep "SQLite Database was locked, retrying..." {row.standard_output} | wc -l'
-        ]
-
-        x = subprocess.run(
-            grep, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-
-        locked = x.stdout.decode()
+        if row.job_id in sidecars:
+            i, n, locked = map(
+                sum, zip(*map(progress_from_sidecar, sidecars[row.job_id]))
+            )
+        else:
+            entry = cache[row.standard_output]
+            i, n = progress_from_log(entry["progress"])
+            locked = entry["locked"]
 
         run_seconds = human_timedelta_to_seconds(row.run_time)
 
-        if command == "place":
-            try:
-                i, n = progress.split("Placement task ")[-1].split(" ")[0].split("/")
-
-                i = int(i)
-                n = int(n)
+        # queue workers report the progress of their current batch
+        if command in ["place", "work"]:
+            if i and n:
 
                 fraction = i / n
 
@@ -96,7 +134,7 @@ def status():
                 remaining = (n - i) * (run_seconds / i)
                 remaining = human_timedelta(timedelta(seconds=remaining))
 
-            except ValueError:
+            else:
                 progress = color_by_fraction(0)
                 performance = ""
                 remaining = ""
@@ -132,6 +170,117 @@ def status():
     mrich.print(Panel(table, expand=False))
 
 
+def get_scratch_job_ids(user: str) -> dict[str, str]:
+    """Map the IDs of array tasks (`<array_job_id>_<task_id>`) to their own numeric job IDs, which name their scratch directories"""
+
+    import subprocess
+
+    try:
+        x = subprocess.run(
+            ["squeue", "--user", user, "--noheader", "--format=%i %A"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except FileNotFoundError:
+        return {}
+
+    scratch_ids = {}
+
+    for line in x.stdout.splitlines():
+        try:
+            job_id, scratch_id = line.split()
+        except ValueError:
+            continue
+        scratch_ids[job_id] = scratch_id
+
+    return scratch_ids
+
+
+def scan_log(path: str, entry: dict | None = None, chunk_size: int = 1 << 23) -> dict:
+    """Update the last progress line and lock count of a log, only reading bytes past the cached offset"""
+
+    path = Path(path)
+
+    try:
+        stat = path.stat()
+    except (FileNotFoundError, TypeError):
+        return dict(inode=None, offset=0, carry="", progress="", locked=0)
+
+    # start again if the log is new or was truncated
+    if not entry or entry["inode"] != stat.st_ino or entry["offset"] > stat.st_size:
+        entry = dict(inode=stat.st_ino, offset=0, carry="", progress="", locked=0)
+
+    if entry["offset"] == stat.st_size:
+        return entry
+
+    entry = dict(entry)
+
+    with open(path, "rb") as f:
+
+        f.seek(entry["offset"])
+
+        while data := f.read(chunk_size):
+
+            entry["offset"] += len(data)
+
+            data = entry["carry"].encode() + data
+
+            # keep an incomplete last line for the next chunk or scan
+            complete, _, carry = data.rpartition(b"\n")
+            entry["carry"] = carry.decode(errors="replace")
+
+            entry["locked"] += complete.count(LOCKED_PATTERN)
+
+            index = complete.rfind(PROGRESS_PATTERN)
+
+            if index >= 0:
+                end = complete.find(b"\n", index)
+                line = complete[index:] if end < 0 else complete[index:end]
+                entry["progress"] = line.decode(errors="replace")
+
+    return entry
+
+
+def progress_from_sidecar(record: dict) -> tuple[int, int, int]:
+    """Get the number of attempted tasks, total tasks and lock retries from the last sidecar record"""
+
+    total = record.get("total", 0)
+
+    if record["event"] == "task":
+        index = record["index"]
+    elif record["event"] == "end":
+        index = total
+    else:
+        index = 0
+
+    return index, total, record.get("lock_waits", 0)
+
+
+def progress_from_log(progress: str) -> tuple[int, int]:
+    """Get the number of attempted and total tasks from a "Placement task i/n" line"""
+
+    try:
+        i, n = progress.split("Placement task ")[-1].split(" ")[0].split("/")
+        return int(i), int(n)
+    except ValueError:
+        return 0, 0
+
+
+def load_log_cache() -> dict:
+
+    try:
+        return json.load(open(LOG_CACHE_PATH, "rt"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def dump_log_cache(cache: dict) -> None:
+
+    LOG_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    json.dump(cache, open(LOG_CACHE_PATH, "wt"))
+
+
 def human_timedelta_to_seconds(s):
 
     values = s.split()
@@ -0,0 +1,367 @@
+import mrich
+import json
+import time
+from pathlib import Path
+
+
+class ProgressLog:
+    """JSON-lines progress and metrics sidecar written by a placement job
+
+    The first record has `event="start"` and the total number of tasks, followed by one `event="task"` record per finished placement and a final `event="end"` record.
+
+    :param path: path of the sidecar file, usually `SCRATCH/{job_id}/progress.jsonl`
+    """
+
+    def __init__(self, path: "Path"):
+        self._path = Path(path)
+        self._start = time.time()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def start(self, total: int, **kwargs) -> None:
+        self.write(dict(event="start", total=total, **kwargs))
+
+    def task(
+        self,
+        *,
+        index: int,
+        total: int,
+        task: dict,
+        result: dict | None,
+        success: bool,
+        lock_waits: int = 0,
+    ) -> None:
+
+        result = result or {}
+
+        self.write(
+            dict(
+                event="task",
+                index=index,
+                total=total,
+                name=task["name"],
+                compound_id=task["compound_id"],
+                reference_id=task["reference_id"],
+                outcome=str(result.get("outcome", "null")),
+                success=success,
+                runtime=result.get("wall_time"),
+                retries=max(0, result.get("attempts", 1) - 1),
+                lock_waits=lock_waits,
+            )
+        )
+
+    def end(self, **kwargs) -> None:
+        self.write(dict(event="end", **kwargs))
+
+    def write(self, record: dict) -> None:
+
+        record["time"] = round(time.time(), 3)
+        record["elapsed"] = round(record["time"] - self._start, 3)
+
+        with open(self.path, "at") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+def read_last_record(path: "Path", block_size: int = 4096) -> dict | None:
+    """Read the last complete record of a JSON-lines file without reading the whole file"""
+
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+    with f:
+
+        end = f.seek(0, 2)
+        f.seek(max(0, end - block_size))
+        lines = f.read().splitlines()
+
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+    return None
+
+
+class LockWaitCounter:
+    """Count HIPPO's "SQLite Database was locked" retries while the context is active
+
+    HIPPO does not expose its retries, but reports each of them with `mrich.warning`, which is wrapped for the duration of the context and restored when it is left, also on an exception. Only calls through the `mrich` module attribute are counted, code that bound `mrich.warning` to a name of its own beforehand bypasses the counter, so the count is a lower bound.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._warning = None
+        self._depth = 0
+
+    def __enter__(self):
+
+        # nested contexts share the outermost wrapper
+        if not self._depth:
+            self._warning = mrich.warning
+            mrich.warning = self._counting_warning
+
+        self._depth += 1
+
+        return self
+
+    def __exit__(self, *args):
+
+        self._depth -= 1
+
+        if not self._depth:
+            mrich.warning = self._warning
+            self._warning = None
+
+    def _counting_warning(self, *args, **kwargs):
+        if any("Database was locked" in str(arg) for arg in args):
+            self.count += 1
+        return self._warning(*args, **kwargs)
+
+
+class PlacementTelemetry:
+    """Per-placement stage timings of a placement job, written as a columnar table
+
+    Stages are the HIPPO database reads needed to prepare the task (`db_time`), `Laboratory` lookup and input validation (`setup_time`), the Fragmenstein placement including its minimisation (`place_time`) and the SDF and staging writes (`write_time`). Fragmenstein minimises within `Laboratory.place`, so the minimisation can not be timed on its own.
+
+    The table is written as Parquet if `pyarrow` is available and as CSV otherwise. It is rewritten every `flush_interval` seconds, so a job that is killed keeps the rows up to its last write.
+
+    :param path: path of the table without its suffix, usually `SCRATCH/{target}_telemetry/{batch}_{job_id}`
+    :param job_id: SLURM job ID recorded with every row
+    :param flush_interval: minimum number of seconds between writes of the table
+    """
+
+    COLUMNS = [
+        "job_id",
+        "name",
+        "compound_id",
+        "reference_id",
+        "n_inspirations",
+        "success",
+        "outcome",
+        "attempts",
+        "retries",
+        "timed_out",
+        "lab_cache_hit",
+        "db_time",
+        "setup_time",
+        "place_time",
+        "write_time",
+        "total_time",
+        "wall_time",
+        "fragmenstein_runtime",
+        "time",
+    ]
+
+    def __init__(self, path: "Path", job_id: str, flush_interval: float = 60):
+        self._path = Path(path)
+        self._job_id = str(job_id)
+        self._flush_interval = flush_interval
+        self._rows = []
+        self._written = 0
+        self._last_write = time.time()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def due(self) -> bool:
+        return (
+            len(self._rows) > self._written
+            and time.time() - self._last_write >= self._flush_interval
+        )
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(
+        self,
+        *,
+        task: dict,
+        result: dict | None,
+        success: bool,
+        write_time: float = 0.0,
+    ) -> None:
+
+        result = result or {}
+
+        db_time = task.get("db_time", 0.0)
+        setup_time = result.get("setup_time", 0.0)
+        place_time = result.get("place_time", 0.0)
+        attempts = result.get("attempts", 0)
+
+        self._rows.append(
+            (
+                self._job_id,
+                task["name"],
+                int(task["compound_id"]),
+                int(task["reference_id"]),
+                len(task["hits"]),
+                bool(success),
+                str(result.get("outcome", "null")),
+                attempts,
+                max(0, attempts - 1),
+                # any attempt, also those that were retried successfully
+                result.get("timeouts", 0) > 0,
+                bool(result.get("lab_cache_hit", False)),
+                db_time,
+                setup_time,
+                place_time,
+                write_time,
+                db_time + setup_time + place_time + write_time,
+                result.get("wall_time", 0.0),
+                _to_float(result.get("runtime")),
+                time.time(),
+            )
+        )
+
+    def write(self) -> "Path | None":
+        """Write the table, replacing any previous version
+
+        :returns: path of the written file
+        """
+
+        if not self._rows:
+            return None
+
+        from pandas import DataFrame
+
+        df = DataFrame(self._rows, columns=self.COLUMNS)
+
+        self._path.parent.mkdir(exist_ok=True, parents=True)
+
+        # written next to the table and moved into place, so a killed job leaves the last complete version
+        try:
+            path = self._path.with_name(self._path.name + ".parquet")
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            df.to_parquet(tmp_path, index=False)
+        except ImportError:
+            path = self._path.with_name(self._path.name + ".csv")
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            df.to_csv(tmp_path, index=False)
+
+        tmp_path.replace(path)
+
+        self._written = len(self._rows)
+        self._last_write = time.time()
+
+        mrich.writing(path)
+
+        return path
+
+
+def find_telemetry_tables(directory: "Path", key: str) -> "list[Path]":
+    """Find the telemetry tables of the placement jobs for an input file"""
+
+    import re
+
+    pattern = re.compile(
+        rf"^{re.escape(key)}(_split\d+_batch\d+)?_\d+(\.rank\d+)?\.(parquet|csv)$"
+    )
+
+    return [
+        path
+        for path in sorted(Path(directory).glob(f"{key}*"))
+        if pattern.match(path.name)
+    ]
+
+
+def load_telemetry_tables(paths: "list[Path]") -> "DataFrame":
+    """Concatenate telemetry tables written by :class:`PlacementTelemetry`"""
+
+    import pandas as pd
+
+    dfs = []
+
+    for path in paths:
+        if path.suffix == ".parquet":
+            dfs.append(pd.read_parquet(path))
+        else:
+            dfs.append(pd.read_csv(path))
+
+    if not dfs:
+        return pd.DataFrame(columns=PlacementTelemetry.COLUMNS)
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def report_telemetry(df: "DataFrame", top: int = 10) -> None:
+    """Print throughput, latency percentiles, timeout rate and the slowest compounds and references"""
+
+    if df.empty:
+        mrich.error("No placement telemetry found")
+        return
+
+    n = len(df)
+
+    # first placement start to last placement end
+    start = (df["time"] - df["total_time"]).min()
+    span = df["time"].max() - start
+
+    mrich.h3("Throughput")
+    mrich.var("#placements", n)
+    mrich.var("#successful", int(df["success"].sum()))
+    mrich.var("#jobs", df["job_id"].nunique())
+    mrich.var("wall span", f"{span / 3600:.2f} h")
+    mrich.var("placements / hour", f"{n / span * 3600:.1f}" if span else "N/A")
+    mrich.var("wall hours / placement", f"{df['total_time'].sum() / n / 3600:.4f}")
+    mrich.var("timeout rate", f"{df['timed_out'].mean() * 100:.1f} %")
+    mrich.var("retry rate", f"{(df['retries'] > 0).mean() * 100:.1f} %")
+    mrich.var("Laboratory cache hit rate", f"{df['lab_cache_hit'].mean() * 100:.1f} %")
+
+    mrich.h3("Latency percentiles (s)")
+
+    stages = ["db_time", "setup_time", "place_time", "write_time", "total_time"]
+    percentiles = df[stages].quantile([0.5, 0.9, 0.99]).T
+    percentiles.columns = ["p50", "p90", "p99"]
+    percentiles["mean"] = df[stages].mean()
+    percentiles["share"] = df[stages].sum() / df["total_time"].sum()
+
+    for stage, row in percentiles.iterrows():
+        mrich.var(
+            stage,
+            f"p50={row['p50']:.2f} p90={row['p90']:.2f} p99={row['p99']:.2f} mean={row['mean']:.2f} ({row['share'] * 100:.1f} %)",
+        )
+
+    mrich.h3(f"Slowest compounds (top {top})")
+
+    compounds = (
+        df.groupby("compound_id")["total_time"]
+        .agg(["sum", "count", "max"])
+        .sort_values("sum", ascending=False)
+        .head(top)
+    )
+
+    for compound_id, row in compounds.iterrows():
+        mrich.var(
+            f"C{compound_id}",
+            f"{row['sum']:.1f} s over {int(row['count'])} placements (max {row['max']:.1f} s)",
+        )
+
+    mrich.h3(f"Slowest references (top {top})")
+
+    references = (
+        df.groupby("reference_id")["total_time"]
+        .agg(["mean", "count"])
+        .join(df.groupby("reference_id")["timed_out"].mean().rename("timeout_rate"))
+        .sort_values("mean", ascending=False)
+        .head(top)
+    )
+
+    for reference_id, row in references.iterrows():
+        mrich.var(
+            f"P{reference_id}",
+            f"{row['mean']:.1f} s mean over {int(row['count'])} placements, {row['timeout_rate'] * 100:.1f} % timed out",
+        )
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
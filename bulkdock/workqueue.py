@@ -0,0 +1,251 @@
+import mrich
+import time
+import _thread
+import sqlite3
+import threading
+from pathlib import Path
+
+STATES = ["pending", "leased", "done", "failed"]
+
+# default batch size of queued runs, small batches keep every worker busy until the queue is empty
+QUEUE_SPLIT = 25
+
+# errors that are specific to a batch, any other error stops the worker
+BATCH_ERRORS = (OSError, MemoryError, sqlite3.OperationalError)
+
+
+class PlacementQueue:
+    """Shared queue of batch inputs that worker jobs claim until it is empty
+
+    Batches are claimed with a lease, which the worker renews while it places the batch. The batch of a worker that died goes back to the queue when its lease expires, and the next worker resumes it from the checkpoint ledger. A batch is marked as failed after `max_attempts` claims that did not complete.
+
+    :param path: path to the queue, usually `SCRATCH/{target}_inputs/{name}.queue.sqlite`
+    :param max_attempts: number of claims before a batch is given up
+    """
+
+    def __init__(self, path: "Path", max_attempts: int = 3):
+
+        self._path = Path(path)
+        self._max_attempts = max_attempts
+
+        self._connection = sqlite3.connect(
+            self._path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+
+        # the connection is shared with the lease renewal thread
+        self._lock = threading.Lock()
+
+        # workers on different nodes share the file, which rules out WAL as it needs shared memory on one host
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode=DELETE;
+            PRAGMA busy_timeout=60000;
+            CREATE TABLE IF NOT EXISTS batch(
+                batch_id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expiry REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS batch_state ON batch(state);
+            """
+        )
+
+    ### PROPERTIES
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    ### METHODS
+
+    def add(self, paths: "list[Path]") -> None:
+        """Queue batch inputs, batches that are already queued are left as they are"""
+
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO batch(path) VALUES (?)",
+                [(str(Path(path).resolve()),) for path in paths],
+            )
+            self._connection.execute("COMMIT")
+
+    def claim(self, worker: str, lease: float) -> "tuple[int, Path] | None":
+        """Claim the next pending batch, or one whose lease has expired
+
+        :param worker: name of the claiming worker
+        :param lease: duration of the lease in seconds
+        :returns: batch ID and path of the input CSV, None if there is nothing left to claim
+        """
+
+        now = time.time()
+
+        with self._lock:
+
+            # the write lock is taken up front so that no two workers claim the same batch
+            self._connection.execute("BEGIN IMMEDIATE")
+
+            try:
+
+                # expired leases of workers that died
+                expired = self._connection.execute(
+                    "SELECT batch_id, worker FROM batch WHERE state = 'leased' AND lease_expiry < ?",
+                    (now,),
+                ).fetchall()
+
+                for batch_id, dead_worker in expired:
+                    mrich.warning(f"Lease of batch {batch_id} by {dead_worker} expired")
+
+                self._connection.execute(
+                    """
+                    UPDATE batch SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                    WHERE state = 'leased' AND lease_expiry < ?
+                    """,
+                    (self._max_attempts, now),
+                )
+
+                record = self._connection.execute(
+                    "SELECT batch_id, path FROM batch WHERE state = 'pending' ORDER BY batch_id LIMIT 1"
+                ).fetchone()
+
+                if record:
+                    self._connection.execute(
+                        """
+                        UPDATE batch SET state = 'leased', worker = ?, lease_expiry = ?, attempts = attempts + 1
+                        WHERE batch_id = ?
+                        """,
+                        (worker, now + lease, record[0]),
+                    )
+
+                self._connection.execute("COMMIT")
+
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        if not record:
+            return None
+
+        return record[0], Path(record[1])
+
+    def renew(self, batch_id: int, worker: str, lease: float) -> bool:
+        """Extend the lease of a claimed batch
+
+        :returns: False if the worker no longer holds the lease
+        """
+
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE batch SET lease_expiry = ? WHERE batch_id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + lease, batch_id, worker),
+            )
+
+        return cursor.rowcount == 1
+
+    def complete(self, batch_id: int, worker: str) -> None:
+
+        with self._lock:
+            self._connection.execute(
+                "UPDATE batch SET state = 'done', lease_expiry = NULL WHERE batch_id = ? AND worker = ?",
+                (batch_id, worker),
+            )
+
+    def release(self, batch_id: int, worker: str, count_attempt: bool = True) -> None:
+        """Put a claimed batch back in the queue, or give it up after too many attempts
+
+        :param count_attempt: False if the claim failed for reasons unrelated to the batch, which then does not count towards `max_attempts`
+        """
+
+        with self._lock:
+
+            if not count_attempt:
+                self._connection.execute(
+                    """
+                    UPDATE batch SET state = 'pending', lease_expiry = NULL, attempts = attempts - 1
+                    WHERE batch_id = ? AND worker = ? AND state = 'leased'
+                    """,
+                    (batch_id, worker),
+                )
+                return
+
+            self._connection.execute(
+                """
+                UPDATE batch SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                lease_expiry = NULL
+                WHERE batch_id = ? AND worker = ? AND state = 'leased'
+                """,
+                (self._max_attempts, batch_id, worker),
+            )
+
+    def counts(self) -> dict[str, int]:
+        """Number of batches in each state"""
+
+        with self._lock:
+            records = self._connection.execute(
+                "SELECT state, COUNT(*) FROM batch GROUP BY state"
+            ).fetchall()
+
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(records)
+
+        return counts
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM batch").fetchone()[0]
+
+
+class LeaseKeeper:
+    """Context manager that renews a batch lease from a background thread
+
+    If the lease is lost, e.g. because it expired and another worker claimed the batch, the main thread is interrupted with a `KeyboardInterrupt` so that the two workers do not write to the same output. The interrupt only takes effect once the main thread runs Python code again.
+
+    :param queue: queue the batch was claimed from
+    :param batch_id: ID of the claimed batch
+    :param worker: name of the worker
+    :param lease: duration of the lease in seconds, renewed every third of it
+    """
+
+    def __init__(self, queue: PlacementQueue, batch_id: int, worker: str, lease: float):
+        self._queue = queue
+        self._batch_id = batch_id
+        self._worker = worker
+        self._lease = lease
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._lost = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def lost(self) -> bool:
+        """True if the lease was lost and the main thread interrupted"""
+        return self._lost
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        # no interrupt once the context has been left
+        with self._lock:
+            self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._lease / 3):
+            try:
+                if not self._queue.renew(self._batch_id, self._worker, self._lease):
+                    with self._lock:
+                        if not self._stop.is_set():
+                            mrich.warning(
+                                f"Lost the lease of batch {self._batch_id}, stopping it"
+                            )
+                            self._lost = True
+                            _thread.interrupt_main()
+                    return
+            except sqlite3.OperationalError as e:
+                mrich.warning(f"Could not renew the lease of batch {self._batch_id}: {e}")